@@ -1,51 +1,45 @@
 import openql as ql
-import os
-import random  # Importing the random module to simulate measurement results
-
-# Initialize the OpenQL framework
-ql.initialize()
-
-# Set the directory for output files
-output_dir = 'output'
-ql.set_option('output_dir', output_dir)
-# Set the logging level to display warnings
-ql.set_option('log_level', 'LOG_WARNING')
-
-# Define the quantum platform with a name and specify no configuration file
-platform = ql.Platform('my_platform', 'none')
-
-# Number of qubits for the Deutsch-Jozsa Algorithm (2 input qubits + 1 ancilla qubit)
-n = 3
+import sys  # Import sys to stop after a batch run
+import argparse  # Import argparse to read the oracle from the command line
+import numpy as np  # Import numpy to compare probabilities with a tolerance
+from batch_input import read_records, write_record  # Helpers for reading oracles and streaming results
+from expectation import final_state  # State of the kernel before its measurements
+from deutsch_jozsa import LABELS, build_deutsch_jozsa_kernel, classify, parse_oracle, truth_tables, zero_probability  # Oracle library
+from sampling import counts_from_probabilities, marginal_probabilities  # Exact distribution and shots drawn from it
+from session import get_platform  # OpenQL session shared by all scripts
+
+# Read the command line
+parser = argparse.ArgumentParser(description='Deutsch-Jozsa algorithm.')  # Create the command line parser
+parser.add_argument('--inputs', type=int, default=2, help='number of input qubits')  # Number of input qubits
+parser.add_argument('--oracle', default='parity:3', help="oracle: constant:<0|1>, parity:<mask> or table:<bits>")  # Oracle of the circuit
+parser.add_argument('--classify', help="JSONL file of oracles to classify without compiling, '-' for stdin")  # Many oracles at once
+args = parser.parse_args()  # Parse the command line
+
+if args.classify:
+    # Batch mode: classify every oracle of the file in one vectorized call and stream one JSON line per oracle
+    # Records may be oracle strings such as "parity:3" or {"oracle": "parity:3"} objects
+    specs = [record['oracle'] if isinstance(record, dict) else record
+             for record in read_records(args.classify, 'jsonl')]  # Oracle descriptions
+    tables = truth_tables([parse_oracle(spec) for spec in specs], args.inputs)  # Truth tables of all oracles
+    for spec, label, probability in zip(specs, classify(tables), zero_probability(tables)):
+        write_record({'oracle': spec, 'class': LABELS[label], 'zero_probability': float(probability)})
+    sys.exit()  # Nothing to compile in batch mode
+
+# Get the platform shared by all scripts (see session.get_platform() for the OpenQL settings)
+platform = get_platform()
+
+# Number of qubits for the Deutsch-Jozsa Algorithm (input qubits + 1 ancilla qubit)
+n = args.inputs + 1
+
+# Oracle to test; the default is the balanced function f(x) = x1 ⊕ x2 of the original example
+oracle = parse_oracle(args.oracle)
 
 # Create a quantum program named 'deutsch_jozsa' for the defined platform
-program = ql.Program('deutsch_jozsa', platform, n)
-
-# Create a quantum kernel named 'deutsch_jozsa'
-dj_kernel = ql.Kernel('deutsch_jozsa', platform, n)
-
-# Initialize the ancilla qubit to |1>
-dj_kernel.gate('x', [n-1])  # Apply X gate to the ancilla qubit to set it to |1>
-
-# Apply Hadamard gates to all qubits to create superposition
-# This puts the input qubits in a superposition of all possible inputs and prepares the ancilla for the Oracle.
-for i in range(n):
-    dj_kernel.gate('h', [i])
-
-# Apply the Oracle function
-# For the Deutsch-Jozsa algorithm, the Oracle distinguishes between constant and balanced functions.
-# This example assumes a balanced function f(x) = x1 ⊕ x2.
-dj_kernel.gate('cnot', [0, 2])  # Apply CNOT gate with qubit 0 as control and ancilla as target
-dj_kernel.gate('cnot', [1, 2])  # Apply CNOT gate with qubit 1 as control and ancilla as target
-
-# Apply Hadamard gates to all input qubits again
-# This completes the interference process that reveals whether the function is constant or balanced.
-for i in range(n-1):
-    dj_kernel.gate('h', [i])
-
-# Measure all input qubits to get the result
+# Create a quantum kernel named 'deutsch_jozsa' with the ancilla set to |1>, Hadamard gates on all qubits,
+# the Oracle, Hadamard gates on the input qubits and measurements of the input qubits
 # The measurement will reveal whether the function is constant (all 0s) or balanced (at least one 1).
-for i in range(n-1):
-    dj_kernel.gate('measure', [i])
+dj_kernel = build_deutsch_jozsa_kernel(platform, args.inputs, oracle)  # Build the kernel for any number of inputs
+program = ql.Program('deutsch_jozsa', platform, dj_kernel.num_qubits)  # Program with the qubits of the kernel (including ancillas)
 
 # Add the kernel to the program
 program.add_kernel(dj_kernel)
@@ -55,24 +49,26 @@ program.compile()
 
 print("Deutsch-Jozsa Algorithm program compiled successfully.")
 
-# Simulate measurement results
-def simulate_measurement_results(n):
-    """
-    Simulates measurement results for the Deutsch-Jozsa algorithm.
-    
-    :param n: Number of qubits
-    :return: List of measurement results
-    """
-    return [random.randint(0, 1) for _ in range(n-1)]
+# Number of times the circuit is sampled
+shots = 1000
 
-# Simulate the results (assuming we have a function to simulate measurement results)
-results = simulate_measurement_results(n)
+# Simulate the kernel once; the shots and the decision below both come from this one final state
+state = final_state(dj_kernel.gates, n)  # State just before the measurements
+probabilities = marginal_probabilities(state, range(n - 1), n)  # Exact distribution of the input qubits
+counts = counts_from_probabilities(probabilities, n - 1, shots)  # Draw all shots from that distribution
 
 # Display the results
-print("Measurement results of input qubits: ", results)
+print("Measurement results of input qubits: ", counts)
 
 # Explain the result
-if all(result == 0 for result in results):
+# The function is constant exactly when the input qubits are measured as all 0s with probability 1 (and balanced when
+# the probability is 0), so the decision is read from the exact probability instead of from the random shots
+p_zero = float(probabilities[0])  # Exact probability of measuring all 0s
+print(f"Probability of measuring all input qubits as 0: {p_zero:.6f}")
+if np.isclose(p_zero, 1):
     print("The function is constant.")
-else:
+elif np.isclose(p_zero, 0):
     print("The function is balanced.")
+else:
+    # Any other probability means the oracle is neither constant nor balanced, so the algorithm's answer is meaningless
+    print("The oracle breaks the promise: the function is neither constant nor balanced.")
@@ -1,17 +1,8 @@
 import openql as ql
-import os
+from session import get_platform
 
-# Initialize the OpenQL framework
-ql.initialize()
-
-# Set the directory for output files
-output_dir = 'output'
-ql.set_option('output_dir', output_dir)
-# Set the logging level to display warnings
-ql.set_option('log_level', 'LOG_WARNING')
-
-# Define the quantum platform with a name and specify no configuration file
-platform = ql.Platform('my_platform', 'none')
+# Get the platform shared by all scripts (see session.get_platform() for the OpenQL settings)
+platform = get_platform()
 
 # Number of qubits for the Grover's Algorithm (3 qubits for simplicity)
 n = 3
@@ -1,121 +1,243 @@
-import openql as ql  # Import OpenQL library for quantum programming
 import os  # Import os module for interacting with the operating system
-import random  # Import random module for generating random numbers
+import argparse  # Import argparse to read batch options from the command line
+import contextlib  # Import contextlib for a no-op profiler when profiling is off
+import numpy as np  # Import numpy to choose the precision of the simulation
+from batch_input import read_records, write_record  # Helpers for reading targets and streaming results
+import circuit_format  # Binary circuit files that other processes can memory-map
+from compile_cache import compile_cached  # Reuses compiled output when the same program is compiled again
+from grover import batch_search, build_grover_kernel, grover_gates, optimal_iterations  # Grover circuit builder
+from noise import add_noise_arguments, density_matrix_distribution, noise_from_args, sample_noisy_counts  # Simulation with gate and readout errors
+from optimizer import optimize  # Cancels and fuses gates before the kernel is built
+from profiling import Profiler, span  # Timers around construction, compilation and simulation
+from recording import RecordingProgram  # Program that remembers its kernels so it can be cached
+from scheduler import schedule  # Groups gates on disjoint qubits into parallel layers
+from results_sink import ShotWriter, count_shots, write_samples  # Packed binary shot files
+from sampling import counts_from_probabilities, measurement_distribution  # Exact outcome distribution and shots drawn from it
+from session import get_platform  # OpenQL session shared by all scripts
+
+# Read the command line; without targets the script asks for one interactively
+parser = argparse.ArgumentParser(description="Grover's algorithm.")  # Create the command line parser
+parser.add_argument('targets', nargs='*', type=int, help='target values to search for')  # Targets given directly
+parser.add_argument('--input', help="JSONL or CSV file with targets, '-' for stdin")  # Targets read from a file
+parser.add_argument('--format', choices=['jsonl', 'csv'], help='format of the input file')  # Format of the input file
+parser.add_argument('--shots', type=int, default=1000, help='number of shots per target')  # Shots per target
+parser.add_argument('--qubits', type=int, default=10, help='number of qubits of the search register')  # Size of the search space
+parser.add_argument('--memmap', help='file to keep the statevector in, for registers larger than memory')  # Statevector on disk
+parser.add_argument('--complex64', action='store_true', help='simulate in single precision to halve the memory')  # Smaller amplitudes
+parser.add_argument('--batch', action='store_true', help='simulate all targets together without compiling a kernel per target')  # Many lookups at once
+parser.add_argument('--shots-dir', help='directory to stream every shot to, as packed grover_<target>.shots files')  # Keep all shots
+parser.add_argument('--circuit-dir', help='directory to save every program to, as grover_<target>.kwc circuit files')  # Ship circuits to workers
+parser.add_argument('--profile', metavar='TRACE', help='time every stage and write a Chrome trace JSON file')  # Profiling
+add_noise_arguments(parser)  # --depolarizing, --amplitude-damping, --readout-error and --noise-method
+args = parser.parse_args()  # Parse the command line
+if args.shots < 1:
+    parser.error('--shots must be at least 1')  # The frequencies and success rates divide by the number of shots
+noise = noise_from_args(args)  # Error rates of the simulated device, None for a perfect device
+if args.batch and (noise is not None or args.shots_dir or args.memmap or args.circuit_dir):
+    parser.error('--batch cannot be combined with noise, --shots-dir, --memmap or --circuit-dir')  # Only the ideal simulation is batched
+if args.shots_dir:
+    os.makedirs(args.shots_dir, exist_ok=True)  # Create the directory for the shot files
+if args.circuit_dir:
+    os.makedirs(args.circuit_dir, exist_ok=True)  # Create the directory for the circuit files
+profiler = Profiler() if args.profile else contextlib.nullcontext()  # Collects the timers of the searches
+
+# Get the platform shared by all scripts (see session.get_platform() for the OpenQL settings)
+platform = get_platform()  # Platform named 'my_platform' with no configuration file
 
-# Initialize the OpenQL framework
-ql.initialize()  # Initialize OpenQL framework
+# Number of qubits for Grover's Algorithm (10 qubits for a database with 1000 items)
+n = args.qubits  # Define the number of qubits, 10 by default
 
-# Set the directory for output files
-output_dir = 'output'  # Define output directory for result files
-ql.set_option('output_dir', output_dir)  # Set output directory in OpenQL
-# Set the logging level to display warnings
-ql.set_option('log_level', 'LOG_WARNING')  # Set log level to LOG_WARNING to display warnings
+# Precision of the simulated amplitudes; complex64 needs 8 bytes per amplitude instead of 16
+dtype = np.complex64 if args.complex64 else np.complex128
 
-# Define the quantum platform with a name and no configuration file
-platform = ql.Platform('my_platform', 'none')  # Create a quantum platform named 'my_platform' with no configuration file
+# Number of oracle + diffusion iterations that maximizes the chance of measuring the target
+iterations = optimal_iterations(n)  # floor(pi/4 * sqrt(2**n)) iterations for a single marked state
 
-# Number of qubits for Grover's Algorithm (10 qubits for a database with 1000 items)
-n = 10  # Define the number of qubits as 10
-
-# Create a quantum program named 'grover' for the defined platform
-program = ql.Program('grover', platform, n)  # Create a quantum program named 'grover' for the defined platform with 10 qubits
-
-# Create a quantum kernel named 'grover'
-grover_kernel = ql.Kernel('grover', platform, n)  # Create a quantum kernel named 'grover' for the defined platform with 10 qubits
-
-# Apply Hadamard gates to all qubits to create superposition
-# This puts each qubit in a superposition of |0> and |1>, effectively exploring all possible states simultaneously.
-for i in range(n):
-    grover_kernel.gate('h', [i])  # Apply Hadamard gate to qubit i
-
-# Get the target value from the user and convert it to a list of bits
-target_value = int(input("Enter the target value to find (0-999): "))  # Get the target value from the user
-target_bits = [int(bit) for bit in format(target_value, f'0{n}b')]  # Convert the target value to a list of bits
-
-# Apply the Oracle (invert the amplitude of the target state)
-for i in range(n):
-    if target_bits[i] == 0:
-        grover_kernel.gate('x', [i])  # Apply X gate to qubit i if the target bit is 0
-
-grover_kernel.gate('h', [n-1])  # Apply Hadamard gate to the last qubit
-for i in range(n-1):
-    grover_kernel.gate('cnot', [i, n-1])  # Apply CNOT gates with the last qubit as the control
-grover_kernel.gate('h', [n-1])  # Apply Hadamard gate to the last qubit
-
-for i in range(n):
-    if target_bits[i] == 0:
-        grover_kernel.gate('x', [i])  # Apply X gate to qubit i if the target bit is 0
-
-# Apply Hadamard gates to all qubits again
-# This is part of Grover's diffusion operator, which inverts about the average amplitude.
-for i in range(n):
-    grover_kernel.gate('h', [i])  # Apply Hadamard gate to qubit i
-
-# Apply X gates to all qubits to invert about the average
-# These X gates are part of the inversion process.
-for i in range(n):
-    grover_kernel.gate('x', [i])  # Apply X gate to qubit i
-
-# Apply a Z gate with multiple controls (in this case, a sequence of H-CNOT-H)
-# This inverts the phase of the |000> state, which is necessary for Grover's diffusion operator.
-grover_kernel.gate('h', [n-1])  # Apply Hadamard gate to the last qubit to prepare it for the controlled operation
-for i in range(n-1):
-    grover_kernel.gate('cnot', [i, n-1])  # Apply CNOT gates with the last qubit as the control
-grover_kernel.gate('h', [n-1])  # Apply Hadamard gate to the last qubit to complete the phase inversion
-
-# Apply X gates to all qubits again
-# Reverting the X gates applied before the multi-controlled Z gate.
-for i in range(n):
-    grover_kernel.gate('x', [i])  # Apply X gate to qubit i
-
-# Apply Hadamard gates to all qubits again
-# This completes Grover's diffusion operator.
-for i in range(n):
-    grover_kernel.gate('h', [i])  # Apply Hadamard gate to qubit i
-
-# Measure all qubits to get the result
-# This collapses the superposition to one of the states, revealing the marked state with high probability.
-for i in range(n):
-    grover_kernel.gate('measure', [i])  # Apply measure operation to qubit i
-
-# Add the kernel to the program
-program.add_kernel(grover_kernel)  # Add the grover_kernel to the program
-
-# Compile the program
-program.compile()  # Compile the quantum program
-
-# Function to simulate measurement results
-def simulate_measurement_results(target_bits, n, probability=0.9):
+# Number of times the circuit is sampled
+shots = args.shots  # All shots are drawn from a single simulation of the circuit
+
+
+# Function to compile and run Grover's algorithm for one target
+def search(target_value):
     """
-    Simulates measurement results for Grover's algorithm.
+    Builds, compiles and simulates Grover's algorithm for one target value.
 
-    :param target_bits: List of bits representing the target value.
-    :param n: Number of qubits.
-    :param probability: Probability of finding the target value.
-    :return: List of bits representing the measurement result.
+    :param target_value: Value to search for.
+    :return: Tuple (histogram of measured bitstrings, most frequent bitstring, optimization report, circuit depth,
+        probability of measuring the target; exact unless it is estimated from the shots of a noisy simulation).
     """
-    # Draw the result based on probability
-    if random.random() < probability:
-        return target_bits  # Found the target value
+    # Build the gate list from the precomputed template and remove redundant gates from it
+    # Back-to-back X gates cancel and runs of single-qubit gates are fused into one gate
+    with span('optimize', 'construct', target=target_value):
+        gates, report = optimize(grover_gates(n, [target_value], iterations))  # Optimize the gate list
+
+    # Emit the gates layer by layer: gates on disjoint qubits that can run at the same time end up next to each other
+    layers = schedule(gates)  # As-soon-as-possible schedule of the optimized gates
+    gates = [gate for layer in layers for gate in layer]  # The gates in layer order
+
+    # Create a quantum kernel named 'grover' running all iterations
+    # The kernel gets extra ancilla qubits so the multi-controlled Z gates can be built from toffoli gates
+    grover_kernel = build_grover_kernel(platform, n, [target_value], iterations, gates=gates)  # Build the kernel from the optimized gates
+
+    # Create a quantum program named 'grover' for the defined platform
+    program = RecordingProgram('grover', platform, grover_kernel.num_qubits)  # Create a quantum program with the qubits of the kernel (including ancillas)
+
+    # Add the kernel to the program
+    program.add_kernel(grover_kernel)  # Add the grover_kernel to the program
+
+    # Compile the program, reusing the previous output if the same target was compiled before
+    compile_cached(program)  # Compile the quantum program
+
+    if args.circuit_dir:
+        # Save the recorded program so it can be loaded (memory-mapped) and simulated again without rebuilding it
+        circuit_format.save(os.path.join(args.circuit_dir, f'grover_{target_value}.kwc'), program)  # One file per target
+
+    if args.shots_dir:
+        # Stream every shot to a packed file (one bit per qubit) in large blocks and build the histogram from the file
+        # With noise the density matrix is used, which is the cheaper engine for millions of shots
+        shots_path = os.path.join(args.shots_dir, f'grover_{target_value}.shots')  # One file per target
+        if noise is None:
+            probabilities, _ = measurement_distribution(grover_kernel.gates, n, dtype, args.memmap)  # Distribution of the outcomes
+        else:
+            probabilities, _ = density_matrix_distribution(grover_kernel.gates, n, noise, dtype)  # Distribution with errors
+        with ShotWriter(shots_path, n) as writer:
+            write_samples(writer, probabilities, shots)  # Draw the shots in chunks and write them as packed words
+        counts = count_shots(shots_path)  # Histogram read back block by block
+    elif noise is None:
+        # Simulate the recorded circuit once and draw all shots from the final distribution
+        # With --memmap the statevector is kept in a file and updated in chunks instead of held in memory
+        probabilities, _ = measurement_distribution(grover_kernel.gates, n, dtype, args.memmap)  # Exact distribution of the outcomes
+        counts = counts_from_probabilities(probabilities, n, shots)  # Histogram of measured bitstrings (qubit 0 first)
     else:
-        # Draw another result
-        return [random.randint(0, 1) for _ in range(n)]  # Generate a random result
-
-# Simulate the results (assuming we have a function to simulate measurement results)
-results = simulate_measurement_results(target_bits, n)  # Simulate the measurement results for Grover's algorithm
+        # Simulate a noisy device: exactly on a density matrix for small registers, with one trajectory per shot otherwise
+        probabilities = None  # Only the shots are known
+        counts = sample_noisy_counts(grover_kernel.gates, n, shots, noise, args.noise_method, dtype=dtype)  # Histogram with errors
+
+    # Take the most frequent outcome as the result
+    best = max(counts, key=counts.get)  # Bitstring measured most often
+    # Probability of the target, read from the distribution when it is known instead of estimated from the shots
+    if probabilities is not None:
+        success_rate = float(probabilities[target_value])  # Outcome index i is the bitstring of i, qubit 0 first
+    else:
+        success_rate = counts.get(format(target_value, f'0{n}b'), 0) / shots  # Fraction of shots that measured the target
+    return counts, best, report, len(layers), success_rate
 
-# Display the results
-print("Measurement results of qubits: ", results)  # Display the measurement results
 
-# Convert results to a number
-result_number = 0
-for bit in results:
-    result_number = (result_number << 1) | bit  # Convert the list of bits to a decimal number
+# Function to check one target of a batch run
+def validate_target(record):
+    """
+    Reads a target from a plain number or a {"target": number} object and checks that it fits in the register.
 
-print("Found number is: ", result_number)  # Display the found number
+    :param record: Input record.
+    :return: Target value as an int.
+    :raises ValueError: If the record has no target or the target is out of range.
+    """
+    if isinstance(record, dict):
+        if 'target' not in record:
+            raise ValueError(f"A target record needs a 'target' field, got {record}.")
+        record = record['target']
+    try:
+        target_value = int(record)
+    except (TypeError, ValueError):
+        raise ValueError(f"Target {record!r} is not a number.")
+    if not 0 <= target_value < 2 ** n:
+        raise ValueError(f"Target {target_value} is out of range 0-{2 ** n - 1} for {n} qubits.")
+    return target_value
+
+
+# Function to read the targets of a batch run
+def batch_targets():
+    """
+    Yields the targets given on the command line and then those read from --input.
 
-# Explain the result
-if result_number == target_value:
-    print(f"Grover's algorithm successfully found the number {target_value}.")  # Display message if the algorithm found the correct number
-else:
-    print(f"Grover's algorithm did not find the correct number {target_value}. Found number is {result_number}.")  # Display message if the algorithm did not find the correct number
+    Input records may be plain numbers, {"target": number} objects or CSV rows of numbers. Every target is
+    yielded as a tuple (record, target value, error); invalid targets have the value None and the error message.
+    """
+    def checked(record):
+        try:
+            return record, validate_target(record), None
+        except ValueError as error:
+            return record, None, str(error)
+
+    yield from map(checked, args.targets)  # Targets given directly on the command line
+    if args.input:
+        for record in read_records(args.input, args.format):  # Records are read lazily, one line at a time
+            if isinstance(record, list):
+                yield from map(checked, record)  # CSV row (or JSON list) of targets
+            else:
+                yield checked(record)  # JSONL object with a 'target' field or a plain number
+
+
+# Run the searches; the profiler (if any) stops and its trace is written even when a search fails
+try:
+    with profiler:
+        if args.batch:
+            # Vectorized batch mode: all targets share the register size, so they are simulated together as one array of
+            # amplitudes (targets x 2**n) with the diffusion applied in closed form; no kernels are built or compiled
+            targets = list(batch_targets())  # All targets of the batch
+            valid = [target_value for _, target_value, error in targets if error is None]  # Targets that fit in the register
+            batch = batch_search(n, valid, iterations, shots)  # Most frequent outcome and success probability of every target
+            results = zip(batch.found, batch.frequency, batch.success_probability)  # One result per valid target, in order
+            for record, target_value, error in targets:
+                if error is not None:
+                    write_record({'target': record, 'error': error})  # Report invalid targets and continue
+                    continue
+                found, frequency, probability = next(results)
+                write_record({
+                    'target': target_value,  # Searched value
+                    'found': int(found),  # Most frequent outcome as a number
+                    'success': int(found) == target_value,  # Whether the target was found
+                    'frequency': float(frequency),  # Fraction of shots that measured the most frequent outcome
+                    'success_rate': float(probability),  # Exact probability of measuring the target
+                })
+        elif args.targets or args.input:
+            # Batch mode: process every target in this process and stream one JSON line per target
+            for record, target_value, error in batch_targets():
+                if error is not None:
+                    write_record({'target': record, 'error': error})  # Report invalid targets and continue
+                    continue
+                counts, best, _, _, success_rate = search(target_value)  # Run Grover's algorithm for this target
+                write_record({
+                    'target': target_value,  # Searched value
+                    'found': int(best, 2),  # Most frequent outcome as a number
+                    'success': int(best, 2) == target_value,  # Whether the target was found
+                    'frequency': counts[best] / shots,  # Fraction of shots that measured the most frequent outcome
+                    'success_rate': success_rate,  # Probability of measuring the target
+                })
+        else:
+            print(f"Running {iterations} Grover iterations.")  # Display the number of iterations
+
+            # Get the target value from the user
+            target_value = int(input(f"Enter the target value to find (0-{2 ** n - 1}): "))  # Get the target value from the user
+
+            # Run Grover's algorithm for the target
+            counts, best, report, layers, success_rate = search(target_value)  # Compile and simulate the circuit
+            print(f"Optimized the circuit from {report.gates_before} to {report.gates_after} gates.")  # Display the gate counts before and after optimization
+            print(f"The optimized circuit runs in {layers} layers of parallel gates.")  # Display the depth of the schedule
+            results = [int(bit) for bit in best]  # Convert the bitstring to a list of bits
+            print(f"Most frequent outcome was measured in {counts[best]} of {shots} shots.")  # Display how often it was measured
+            if noise is not None:
+                print(f"Predicted success rate on the noisy device: {success_rate:.3f}")  # Display the success rate with errors
+            else:
+                print(f"Probability of measuring the target: {success_rate:.6f}")  # Exact, independent of the shots
+
+            # Display the results
+            print("Measurement results of qubits: ", results)  # Display the measurement results
+
+            # Convert results to a number
+            result_number = 0
+            for bit in results:
+                result_number = (result_number << 1) | bit  # Convert the list of bits to a decimal number
+
+            print("Found number is: ", result_number)  # Display the found number
+
+            # Explain the result
+            if result_number == target_value:
+                print(f"Grover's algorithm successfully found the number {target_value}.")  # Display message if the algorithm found the correct number
+            else:
+                print(f"Grover's algorithm did not find the correct number {target_value}. Found number is {result_number}.")  # Display message if the algorithm did not find the correct number
+finally:
+    # Write the trace and print where the time went
+    if args.profile:
+        profiler.write_chrome_trace(args.profile)  # Open it in chrome://tracing or Perfetto
+        profiler.print_summary()  # Time per stage on stderr, so batch results on stdout stay clean
@@ -1,60 +1,56 @@
-import openql as ql
-import os
+import numpy as np
+from noise import noisy_teleportation_fidelity
+from recording import RecordingKernel, RecordingProgram
+from compile_cache import compile_cached
+from session import get_platform
 
-# Initialize OpenQL
-ql.initialize()
-
-# Set options
-ql.set_option('output_dir', 'output')  # 'output' is a string specifying the directory for output files
-ql.set_option('log_level', 'LOG_INFO')  # 'LOG_INFO' is a string specifying the log level
-
-# Define the platform
-platform = ql.Platform('my_platform', 'none')  # 'platform' is an instance of ql.Platform, created with a name and configuration
+# Get the platform shared by all scripts (see session.get_platform() for the OpenQL settings)
+platform = get_platform()  # Platform named 'my_platform' with no configuration file
 
 # Define the number of qubits
 nqubits = 3  # 'nqubits' is an integer specifying the number of qubits
 
 # Create a quantum program
-program = ql.Program('quantum_teleportation', platform, nqubits)  
+program = RecordingProgram('quantum_teleportation', platform, nqubits)  
 # 'program' is an instance of ql.Program, created with a name, a platform, and the number of qubits
 
 # Create a quantum kernel
-kernel = ql.Kernel('teleportation_kernel', platform, nqubits)
+kernel = RecordingKernel('teleportation_kernel', platform, nqubits)
 # 'kernel' is an instance of ql.Kernel, created with a name, a platform, and the number of qubits
 
 # Initialize qubits to |0> state
 for i in range(nqubits):
     kernel.prepz(i)  # 'i' is an integer index of the qubit to initialize
 
-# Step 1: Create an entangled pair between qubit 1 and qubit 2
+# Step 1: Create an entangled pair (a Bell pair) between qubit 1 and qubit 2
 kernel.hadamard(1)  # Apply a Hadamard gate to qubit 1
-kernel.cz(1, 2)  # Apply a controlled-Z gate between qubit 1 (control) and qubit 2 (target)
+kernel.cnot(1, 2)  # Apply a CNOT gate with qubit 1 as control and qubit 2 as target
 
 # Step 2: Apply operations to teleport the state of qubit 0 to qubit 2
 # Assume qubit 0 is already in the state we want to teleport
 kernel.cnot(0, 1)  # Apply a CNOT gate with qubit 0 as control and qubit 1 as target
 kernel.hadamard(0)  # Apply a Hadamard gate to qubit 0
 
-# Measure qubits 0 and 1
+# Measure qubits 0 and 1; measure(q) writes the result to bit register q
 kernel.measure(0)  # Measure qubit 0
 kernel.measure(1)  # Measure qubit 1
 
-# Apply classical corrections based on measurement outcomes
-# Note: These corrections are done conditionally based on classical measurement results,
-# but for simplicity, we assume both measurements yield 0 (no corrections needed)
-# In a real implementation, classical feedback would be required here.
-
-# Step 3: Apply correction operations to qubit 2
+# Step 3: Apply correction operations to qubit 2, conditioned on the measurement results
 # If measurement result of qubit 1 was 1, apply X gate to qubit 2
-kernel.cnot(1, 2)  # Apply a CNOT gate with qubit 1 as control and qubit 2 as target
+kernel.conditional_gate('x', [2], [1])  # X on qubit 2 when bit register 1 holds 1
 
 # If measurement result of qubit 0 was 1, apply Z gate to qubit 2
-kernel.cz(0, 2)  # Apply a controlled-Z gate between qubit 0 (control) and qubit 2 (target)
+kernel.conditional_gate('z', [2], [0])  # Z on qubit 2 when bit register 0 holds 1
+
+# Without errors the state must arrive exactly; stop if a change to the kernel above breaks the teleportation
+ideal = noisy_teleportation_fidelity(kernel.gates, nqubits, [(0, 2)])  # Exact average fidelity of qubit 0 -> 2
+if not np.allclose(ideal, 1):
+    raise SystemExit(f"The teleportation kernel is broken: its noiseless fidelity is {ideal[0]} instead of 1.")
 
 # Add the kernel to the program
 program.add_kernel(kernel)  # Add the kernel to the program
 
-# Compile the program
-program.compile()  # Compile the program to generate the necessary instructions for the quantum computer
+# Compile the program, reusing the previous output if the program has not changed
+compile_cached(program)  # Compile the program to generate the necessary instructions for the quantum computer
 
 print("Compiled quantum teleportation program.")  # Print a message indicating the compilation is complete
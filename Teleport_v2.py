@@ -1,25 +1,27 @@
-import openql as ql
-import os
+import argparse
+import numpy as np
+from noise import add_noise_arguments, noise_from_args, noisy_teleportation_fidelity
+from recording import RecordingKernel, RecordingProgram
+from scheduler import schedule
+from compile_cache import compile_cached
+from session import get_platform
 
-# Initialize OpenQL framework
-ql.initialize()
+# Read the optional error rates of a noisy device from the command line
+parser = argparse.ArgumentParser(description='Double quantum teleportation.')
+add_noise_arguments(parser)
+args = parser.parse_args()
 
-# Set the directory for output files
-ql.set_option('output_dir', 'output')
-# Set the logging level to display informational messages
-ql.set_option('log_level', 'LOG_INFO')
-
-# Define a quantum computing platform with a name and specify no configuration file
-platform = ql.Platform('my_platform', 'none')
+# Get the platform shared by all scripts (see session.get_platform() for the OpenQL settings)
+platform = get_platform()
 
 # Define the number of qubits required (6 qubits for teleporting 2 qubits)
 nqubits = 6  
 
 # Create a quantum program named 'double_quantum_teleportation' for the defined platform with the specified number of qubits
-program = ql.Program('double_quantum_teleportation', platform, nqubits)
+program = RecordingProgram('double_quantum_teleportation', platform, nqubits)
 
 # Create a quantum kernel named 'double_teleportation_kernel' for the defined platform with the specified number of qubits
-kernel = ql.Kernel('double_teleportation_kernel', platform, nqubits)
+kernel = RecordingKernel('double_teleportation_kernel', platform, nqubits)
 
 # Initialize all qubits to the |0⟩ state
 for i in range(nqubits):
@@ -27,15 +29,15 @@ for i in range(nqubits):
 
 # Steps for teleporting the state of qubit 0 to qubit 4 and qubit 1 to qubit 5
 
-# Step 1: Create entangled pairs
+# Step 1: Create entangled pairs (Bell pairs)
 # Apply Hadamard gate on qubit 2 to create superposition
 kernel.hadamard(2)
-# Apply controlled-Z gate between qubit 2 and qubit 4 to entangle them
-kernel.cz(2, 4)
+# Apply CNOT gate with qubit 2 as control and qubit 4 as target to entangle them
+kernel.cnot(2, 4)
 # Apply Hadamard gate on qubit 3 to create superposition
 kernel.hadamard(3)
-# Apply controlled-Z gate between qubit 3 and qubit 5 to entangle them
-kernel.cz(3, 5)
+# Apply CNOT gate with qubit 3 as control and qubit 5 as target to entangle them
+kernel.cnot(3, 5)
 
 # Step 2: Teleport the state of qubit 0 to qubit 4
 # Apply CNOT gate with qubit 0 as control and qubit 2 as target
@@ -46,10 +48,10 @@ kernel.hadamard(0)
 kernel.measure(0)
 # Measure qubit 2
 kernel.measure(2)
-# Apply CNOT gate with qubit 2 as control and qubit 4 as target
-kernel.cnot(2, 4)
-# Apply controlled-Z gate between qubit 0 and qubit 4
-kernel.cz(0, 4)
+# Apply X to qubit 4 if qubit 2 was measured as 1 (measure(q) writes bit register q)
+kernel.conditional_gate('x', [4], [2])
+# Apply Z to qubit 4 if qubit 0 was measured as 1
+kernel.conditional_gate('z', [4], [0])
 
 # Step 3: Teleport the state of qubit 1 to qubit 5
 # Apply CNOT gate with qubit 1 as control and qubit 3 as target
@@ -60,16 +62,32 @@ kernel.hadamard(1)
 kernel.measure(1)
 # Measure qubit 3
 kernel.measure(3)
-# Apply CNOT gate with qubit 3 as control and qubit 5 as target
-kernel.cnot(3, 5)
-# Apply controlled-Z gate between qubit 1 and qubit 5
-kernel.cz(1, 5)
+# Apply X to qubit 5 if qubit 3 was measured as 1
+kernel.conditional_gate('x', [5], [3])
+# Apply Z to qubit 5 if qubit 1 was measured as 1
+kernel.conditional_gate('z', [5], [1])
 
 # Add the defined kernel to the program
 program.add_kernel(kernel)
 
-# Compile the quantum program
-program.compile()
+# Compile the quantum program, reusing the previous output if the program has not changed
+compile_cached(program)
 
 # Print a message indicating that the program has been compiled
 print("Compiled double quantum teleportation program.")
+
+# The two teleportation chains use disjoint qubits, so their gates run side by side in the same layers
+print(f"The kernel runs in {len(schedule(kernel.gates))} layers for {len(kernel.gates)} operations.")
+
+# Without errors both states must arrive exactly; stop if a change to the kernel above breaks the teleportation
+pairs = [(0, 4), (1, 5)]  # (source, target) qubits of the two chains
+ideal = noisy_teleportation_fidelity(kernel.gates, nqubits, pairs)  # Exact average fidelity without errors
+if not np.allclose(ideal, 1):
+    raise SystemExit(f"The teleportation kernel is broken: its noiseless fidelities are {ideal} instead of 1.")
+
+# With error rates given, predict how well both states arrive on the noisy device
+noise = noise_from_args(args)
+if noise is not None:
+    # Average fidelity of each teleported state, computed exactly on density matrices
+    fidelities = noisy_teleportation_fidelity(kernel.gates, nqubits, pairs, noise)
+    print(f"Predicted average fidelity: qubit 0 -> 4: {fidelities[0]:.3f}, qubit 1 -> 5: {fidelities[1]:.3f}")
@@ -0,0 +1,52 @@
+import csv
+import json
+import sys
+
+
+def read_records(path='-', fmt=None):
+    """
+    Reads input records one at a time from a JSONL or CSV file, or from stdin.
+
+    JSONL lines are decoded with json; CSV rows are returned as lists of integers. Blank lines are skipped,
+    and so is a CSV header row that does not contain numbers.
+
+    :param path: File name, or '-' for stdin.
+    :param fmt: 'jsonl' or 'csv'; guessed from the file extension if not given (stdin defaults to JSONL).
+    :return: Generator of records.
+    """
+    if fmt is None:
+        fmt = 'csv' if path.lower().endswith('.csv') else 'jsonl'
+    stream = sys.stdin if path == '-' else open(path, newline='')
+    try:
+        if fmt == 'csv':
+            for number, row in enumerate(csv.reader(stream)):
+                cells = [cell.strip() for cell in row if cell.strip()]
+                if not cells:
+                    continue
+                try:
+                    yield [int(cell) for cell in cells]
+                except ValueError:
+                    if number == 0:
+                        continue  # Header row
+                    raise ValueError(f"Invalid CSV row {number + 1}: {row}")
+        elif fmt == 'jsonl':
+            for line in stream:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            raise ValueError(f"Unknown input format '{fmt}'.")
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+def write_record(record, stream=None):
+    """
+    Writes one result as a JSON line and flushes it, so results are visible as soon as they are ready.
+
+    :param record: JSON-serializable result.
+    :param stream: Output stream; defaults to stdout.
+    """
+    stream = stream or sys.stdout
+    stream.write(json.dumps(record) + '\n')
+    stream.flush()
@@ -0,0 +1,226 @@
+import argparse
+import contextlib
+import json
+import os
+import platform as host
+import resource
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from control_flow import ProgramInterpreter
+from equivalence import check_equivalence
+from example_circuits import EXAMPLES, build_program
+from optimizer import optimize
+from profiling import Profiler, circuit_stats, span
+from sampling import BACKENDS, sample_counts
+import session
+
+# Timings that are compared against the baseline
+TIMINGS = ('construct_s', 'compile_s', 'simulate_s')
+
+
+def _used_qubits(program):
+    return max((qubit for kernel in program.kernels for gate in kernel.gates for qubit in gate.qubits), default=0) + 1
+
+
+def simulate_program(program, shots, backend='auto'):
+    """
+    Simulates an example program: single-kernel programs are sampled, programs with control flow are interpreted.
+
+    :param program: RecordingProgram.
+    :param shots: Number of shots for single-kernel programs.
+    :param backend: Simulator for single-kernel programs, one of sampling.BACKENDS.
+    """
+    if len(program.blocks) == 1 and program.blocks[0][0] == 'kernel':
+        sample_counts(program.kernels[0].gates, _used_qubits(program), shots, backend=backend)
+    else:
+        ProgramInterpreter(program).run()
+
+
+def run_example(example, platform, size, shots, compile=True, backend='auto'):
+    """
+    Times one example at one size.
+
+    :param example: Example name.
+    :param platform: ql.Platform.
+    :param size: Size of the example.
+    :param shots: Number of shots to simulate.
+    :param compile: Whether to time program.compile().
+    :param backend: Simulator for single-kernel programs.
+    :return: Dictionary of measurements; a step that fails records its error instead of a time.
+    """
+    result = {'example': example, 'size': size}
+    start = time.perf_counter()
+    program = build_program(example, platform, size)
+    result['construct_s'] = time.perf_counter() - start
+    result['num_qubits'] = program.num_qubits
+    result['gates'] = sum(len(kernel.gates) for kernel in program.kernels)
+    result['depth'] = circuit_stats([gate for kernel in program.kernels for gate in kernel.gates])['depth']
+    if compile:
+        start = time.perf_counter()
+        program.compile()
+        result['compile_s'] = time.perf_counter() - start
+    start = time.perf_counter()
+    try:
+        simulate_program(program, shots, backend)
+        result['simulate_s'] = time.perf_counter() - start
+    except ValueError as error:
+        result['simulate_error'] = str(error)
+    return result
+
+
+def peak_memory(example, platform, size, shots, backend='auto'):
+    """
+    Peak memory allocated through Python (including NumPy arrays) while an example is built and simulated.
+
+    This is a separate, untimed run: tracemalloc slows down every allocation, so it would distort the timings
+    of run_example(). Compilation is left out because OpenQL allocates its memory in C++, where tracemalloc does
+    not see it; the high-water mark of the whole process, compilation included, is max_rss_kb in the report.
+
+    :return: Peak traced memory in bytes.
+    """
+    tracemalloc.start()
+    try:
+        program = build_program(example, platform, size)
+        try:
+            simulate_program(program, shots, backend)
+        except ValueError:
+            pass  # run_example() records the error
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def check_example(example, platform, size):
+    """
+    Checks that the optimizer leaves every kernel of an example equivalent (see equivalence.check_equivalence()).
+
+    :return: Dictionary with 'equivalent', the methods used and the time taken; a kernel that cannot be checked
+        records its error instead.
+    """
+    program = build_program(example, platform, size)
+    result = {'equivalent': True, 'equivalence_methods': []}
+    start = time.perf_counter()
+    try:
+        for kernel in program.kernels:
+            outcome = check_equivalence(kernel.gates, optimize(kernel.gates)[0], kernel.num_qubits)
+            result['equivalent'] = result['equivalent'] and outcome.equivalent
+            result['equivalence_methods'].append(outcome.method)
+    except ValueError as error:
+        result['equivalent'] = None
+        result['equivalence_error'] = str(error)
+    result['equivalence_s'] = time.perf_counter() - start
+    return result
+
+
+def best_of(results):
+    """
+    Combines repeated runs of the same example, keeping the fastest time of each step.
+    """
+    combined = dict(results[0])
+    for key in TIMINGS:
+        values = [result[key] for result in results if key in result]
+        if values:
+            combined[key] = min(values)
+    return combined
+
+
+def compare(results, baseline, tolerance, min_delta):
+    """
+    Finds timings that got slower than the baseline.
+
+    :param results: Results of this run.
+    :param baseline: Results of an earlier run (the 'results' list of its JSON file).
+    :param tolerance: Allowed relative slowdown, for example 0.2 for 20%.
+    :param min_delta: Slowdowns smaller than this many seconds are ignored as noise.
+    :return: List of regression descriptions.
+    """
+    previous = {(result['example'], result['size']): result for result in baseline}
+    regressions = []
+    for result in results:
+        old = previous.get((result['example'], result['size']))
+        if old is None:
+            continue
+        for key in TIMINGS:
+            if key in result and key in old:
+                if result[key] > old[key] * (1 + tolerance) and result[key] - old[key] > min_delta:
+                    regressions.append(f"{result['example']} size {result['size']}: {key} "
+                                       f"{old[key]:.4f}s -> {result[key]:.4f}s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the example circuits.')
+    parser.add_argument('--examples', nargs='+', choices=EXAMPLES, default=list(EXAMPLES))
+    parser.add_argument('--sizes', nargs='+', type=int, default=[3, 6, 10], help='qubit counts to run')
+    parser.add_argument('--shots', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=3, help='runs per measurement; the fastest is kept')
+    parser.add_argument('--no-compile', action='store_true', help='skip program.compile()')
+    parser.add_argument('--backend', choices=BACKENDS, default='auto', help='simulator for single-kernel examples')
+    parser.add_argument('--output', default='benchmark.json', help='file the JSON results are written to')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative slowdown')
+    parser.add_argument('--min-delta', type=float, default=0.005, help='ignore slowdowns below this many seconds')
+    parser.add_argument('--trace', help='Chrome trace JSON file with the stages of every run')
+    parser.add_argument('--check-equivalence', action='store_true',
+                        help='check that the optimized kernels are equivalent to the originals; fail if not')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    session.initialize(os.path.join('output', 'benchmark'))
+    platform = session.get_platform()
+    initialize_s = time.perf_counter() - start
+
+    results = []
+    # Profiling walks the output directory after every compilation, so it is only switched on for --trace
+    profiler = Profiler() if args.trace else contextlib.nullcontext()
+    with profiler:
+        for example in args.examples:
+            for size in args.sizes:
+                with span(f'{example}[{size}]', 'benchmark'):
+                    result = best_of([run_example(example, platform, size, args.shots, not args.no_compile,
+                                                  args.backend) for _ in range(args.repeat)])
+                result['peak_memory_bytes'] = peak_memory(example, platform, size, args.shots, args.backend)
+                result['backend'] = args.backend
+                if args.check_equivalence:
+                    result.update(check_example(example, platform, size))
+                results.append(result)
+                print(json.dumps(result))
+    if args.trace:
+        profiler.write_chrome_trace(args.trace)
+
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': sys.version.split()[0],
+            'numpy': np.__version__,
+            'machine': host.machine(),
+            'initialize_s': initialize_s,
+            'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    failed = False
+    if args.check_equivalence:
+        for result in results:
+            if result['equivalent'] is False:
+                print('NOT EQUIVALENT', f"{result['example']} size {result['size']}")
+                failed = True
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f)['results'], args.tolerance, args.min_delta)
+        for regression in regressions:
+            print('REGRESSION', regression)
+        failed = failed or bool(regressions)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,228 @@
+import numpy as np
+
+from gates import SINGLE_QUBIT_GATES
+from statevector import apply_gate, apply_matrix, split_terminal_measurements, zero_state
+
+
+class BranchingSimulator:
+    """
+    Simulates circuits with mid-circuit measurements and gates conditioned on measurement results.
+
+    Instead of simulating the circuit again for every shot, the state is split once per measurement outcome.
+    Every branch is a statevector that is not normalized (its squared norm is the probability of the branch)
+    together with the measurement results that led to it, and gates act on all branches at once as a batch.
+    A measurement is only split when a later gate touches its qubit or reads its result; the others are read
+    from the final states, so a circuit with only terminal measurements keeps a single branch.
+    """
+
+    def __init__(self, num_qubits, state=None, dtype=np.complex128, tolerance=1e-12):
+        """
+        :param num_qubits: Number of qubits.
+        :param state: Optional initial statevector, or batch of statevectors of shape (..., 2**num_qubits)
+            that are all run through the same circuit; it is copied. Defaults to |00...0>.
+        :param dtype: Complex dtype of the amplitudes when no state is given.
+        :param tolerance: Branches whose probability is below this for every state of the batch are dropped.
+        """
+        if state is None:
+            state = zero_state(num_qubits, dtype)
+        self.num_qubits = num_qubits
+        self.tolerance = tolerance
+        self.states = np.array(state)[np.newaxis]  # Shape (branches, ..., 2**num_qubits)
+        self.outcomes = np.zeros((1, 0), dtype=np.int8)  # Shape (branches, measurements), -1 if not split yet
+        self.measured = []  # Qubit of every measurement, in the order they were made
+        self._pending = {}  # Qubit -> measurement that has not been split yet
+        self._bregs = {}  # Bit register -> measurement that last wrote it
+
+    def run(self, gates):
+        """
+        Applies a list of recorded gates.
+
+        :param gates: Recorded gates (for example RecordingKernel.gates).
+        :return: self.
+        """
+        for gate in gates:
+            self.apply(gate)
+        return self
+
+    def apply(self, gate):
+        """
+        Applies one recorded gate, measurement or reset to every branch.
+        """
+        if gate.name == 'measure':
+            qubit = gate.qubits[0]
+            self._resolve(qubit)
+            self._pending[qubit] = self._bregs[qubit] = len(self.measured)
+            self.measured.append(qubit)
+            self.outcomes = np.concatenate([self.outcomes, np.full((len(self.outcomes), 1), -1, np.int8)], axis=1)
+            return
+        if gate.name == 'prepz':
+            qubit = gate.qubits[0]
+            self._resolve(qubit)
+            # A reset is a measurement whose result is not kept, followed by an X on the branch that measured 1
+            ones = self._split(qubit)
+            self.states[ones] = apply_matrix(self.states[ones], SINGLE_QUBIT_GATES['x'], qubit, self.num_qubits)
+            return
+        for qubit in gate.qubits:
+            self._resolve(qubit)
+        if not gate.condition:
+            apply_gate(self.states, gate, self.num_qubits)
+            return
+        # Bit registers that were never written hold 0, so the gate does not act anywhere
+        if not all(breg in self._bregs for breg in gate.condition):
+            return
+        for breg in gate.condition:
+            self._resolve(self.measured[self._bregs[breg]])
+        active = np.all(self.outcomes[:, [self._bregs[breg] for breg in gate.condition]] == 1, axis=1)
+        if active.any():
+            self.states[active] = apply_gate(self.states[active], gate._replace(condition=None), self.num_qubits)
+
+    def _resolve(self, qubit):
+        """
+        Splits the pending measurement of a qubit, if any, before its qubit or result is used.
+        """
+        column = self._pending.pop(qubit, None)
+        if column is not None:
+            ones = self._split(qubit)
+            self.outcomes[:, column] = ones
+
+    def _split(self, qubit):
+        """
+        Replaces every branch by the two branches in which the qubit is |0> and |1>.
+
+        :return: Boolean array telling for every new branch whether the qubit is |1> in it.
+        """
+        count = len(self.states)
+        zero = self.states.copy()
+        one = self.states
+        zero.reshape(count, -1, 2 ** qubit, 2, 2 ** (self.num_qubits - qubit - 1))[:, :, :, 1, :] = 0
+        one.reshape(count, -1, 2 ** qubit, 2, 2 ** (self.num_qubits - qubit - 1))[:, :, :, 0, :] = 0
+        states = np.concatenate([zero, one])
+        ones = np.repeat([False, True], count)
+        keep = np.concatenate([self._weights(zero), self._weights(one)]) > self.tolerance
+        self.states = np.ascontiguousarray(states[keep])
+        self.outcomes = np.concatenate([self.outcomes, self.outcomes])[keep]
+        return ones[keep]
+
+    @staticmethod
+    def _weights(states):
+        # Largest branch probability over the batch of input states
+        return (np.abs(states) ** 2).reshape(len(states), -1, states.shape[-1]).sum(axis=2).max(axis=1)
+
+    def probabilities(self):
+        """
+        Probability of every branch.
+
+        :return: Array of shape (branches, ...) with the squared norms of the branch states.
+        """
+        return np.sum(np.abs(self.states) ** 2, axis=-1)
+
+    def outcome_distribution(self):
+        """
+        Distribution of the results of all measurements, including the ones that were not split.
+
+        :return: Array of shape (..., 2**len(self.measured)); index i is the outcome whose binary digits give
+            the measurement results in the order the measurements were made.
+        """
+        count = len(self.states)
+        num_measurements = len(self.measured)
+        columns = sorted(self._pending.values())
+        qubits = [self.measured[column] for column in columns]
+        # Distribution of the pending measurements inside every branch
+        probabilities = (np.abs(self.states) ** 2).reshape((count, -1) + (2,) * self.num_qubits)
+        others = tuple(2 + q for q in range(self.num_qubits) if q not in qubits)
+        marginal = probabilities.sum(axis=others)
+        order = sorted(qubits)
+        marginal = marginal.transpose([0, 1] + [2 + order.index(q) for q in qubits])
+        marginal = marginal.reshape(count, -1, 2 ** len(qubits))
+        # Outcome index of every (branch, pending result) pair
+        weights = 1 << (num_measurements - 1 - np.arange(num_measurements))
+        base = np.where(self.outcomes > 0, weights, 0).sum(axis=1)
+        results = np.arange(2 ** len(qubits))
+        offsets = np.zeros(len(results), dtype=np.int64)
+        for j, column in enumerate(columns):
+            offsets += ((results >> (len(qubits) - 1 - j)) & 1) * weights[column]
+        indices = (base[:, None] + offsets[None, :]).reshape(-1)
+        batch = marginal.shape[1]
+        distribution = np.zeros((batch, 2 ** num_measurements))
+        np.add.at(distribution, (slice(None), indices), marginal.transpose(1, 0, 2).reshape(batch, -1))
+        return distribution.reshape(self.states.shape[1:-1] + (2 ** num_measurements,))
+
+
+def needs_branching(gates):
+    """
+    Tells whether a circuit measures or resets qubits in the middle of the computation, or conditions gates
+    on measurement results, so that it cannot be simulated as a single statevector.
+    """
+    try:
+        split_terminal_measurements(gates)
+    except ValueError:
+        return True
+    return False
+
+
+def simulate_branches(gates, num_qubits, state=None, dtype=np.complex128):
+    """
+    Simulates a recorded gate list with the branching simulator.
+
+    :param gates: Recorded gates.
+    :param num_qubits: Number of qubits to simulate.
+    :param state: Optional initial statevector or batch of statevectors.
+    :param dtype: Complex dtype of the amplitudes when no state is given.
+    :return: BranchingSimulator after running the gates.
+    """
+    return BranchingSimulator(num_qubits, state, dtype).run(gates)
+
+
+def random_qubit_states(count, rng=None):
+    """
+    Draws uniformly distributed (Haar random) single-qubit states.
+
+    :param count: Number of states.
+    :param rng: Optional numpy.random.Generator.
+    :return: Complex array of shape (count, 2) of normalized states.
+    """
+    rng = rng or np.random.default_rng()
+    states = rng.standard_normal((count, 2)) + 1j * rng.standard_normal((count, 2))
+    return states / np.linalg.norm(states, axis=1, keepdims=True)
+
+
+def teleportation_fidelity(gates, num_qubits, pairs, num_states=1000, rng=None, max_amplitudes=1 << 22):
+    """
+    Measures how well a teleportation circuit transfers random states, averaged over all measurement outcomes.
+
+    Every source qubit is given a random input state (after the prepz operations at the start of the circuit,
+    which are skipped), the inputs are run through the circuit in batches, and the fidelity <psi|rho|psi>
+    of the state arriving on the target qubit is computed exactly from the branches.
+
+    :param gates: Recorded gates of the teleportation circuit.
+    :param num_qubits: Number of qubits.
+    :param pairs: (source, target) qubit pairs, one per teleported state.
+    :param num_states: Number of random input states per source qubit.
+    :param rng: Optional numpy.random.Generator.
+    :param max_amplitudes: Approximate number of amplitudes (over all branches) simulated at once.
+    :return: Array of shape (num_states, len(pairs)) with the fidelity of every teleported state.
+    """
+    rng = rng or np.random.default_rng()
+    inputs = {source: random_qubit_states(num_states, rng) for source, _ in pairs}
+    start = next((i for i, gate in enumerate(gates) if gate.name != 'prepz'), len(gates))
+    body = gates[start:]
+    # Every measurement or reset can double the number of branches
+    splits = sum(gate.name in ('measure', 'prepz') for gate in body)
+    batch = max(1, max_amplitudes // (2 ** num_qubits * 2 ** min(splits, 20)))
+    zero = np.array([1, 0], dtype=np.complex128)
+    fidelities = np.empty((num_states, len(pairs)))
+    for first in range(0, num_states, batch):
+        chunk = slice(first, min(first + batch, num_states))
+        size = chunk.stop - chunk.start
+        # Product state with the inputs on the source qubits and |0> elsewhere
+        state = np.ones((size, 1), dtype=np.complex128)
+        for qubit in range(num_qubits):
+            vector = inputs[qubit][chunk] if qubit in inputs else np.broadcast_to(zero, (size, 2))
+            state = (state[:, :, np.newaxis] * vector[:, np.newaxis, :]).reshape(size, -1)
+        branches = simulate_branches(body, num_qubits, state)
+        count = len(branches.states)
+        for i, (source, target) in enumerate(pairs):
+            view = branches.states.reshape(count, size, 2 ** target, 2, -1)
+            overlap = np.einsum('sk,bsakr->bsar', inputs[source][chunk].conj(), view)
+            fidelities[chunk, i] = (np.abs(overlap) ** 2).sum(axis=(0, 2, 3))
+    return fidelities
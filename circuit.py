@@ -0,0 +1,263 @@
+import math
+
+import numpy as np
+
+from gates import (Gate, MULTI_QUBIT_GATES, NON_UNITARY_GATES, ROTATION_GATES, SINGLE_QUBIT_GATES, UNITARY_GATE,
+                   canonical_name)
+from recording import RecordingKernel, RecordingProgram
+
+# Every gate name gets a small integer code so a circuit can store its gates in NumPy arrays
+OPCODES = tuple(SINGLE_QUBIT_GATES) + ROTATION_GATES + (UNITARY_GATE,) + MULTI_QUBIT_GATES + NON_UNITARY_GATES
+_CODES = {name: code for code, name in enumerate(OPCODES)}
+
+
+def _opcode(name):
+    name = canonical_name(name)
+    if name not in _CODES:
+        raise ValueError(f"Unknown gate '{name}'.")
+    return _CODES[name]
+
+
+class Circuit:
+    """
+    A gate list stored as arrays, built without calling OpenQL.
+
+    The gates are kept as a struct of arrays: an opcode per gate, the qubits of all gates in one flat array with
+    the offset of every gate's first qubit, and a float parameter per gate (NaN if none). The rare parameters
+    that are not a number ('unitary' matrices, 'classical' operands) and gate conditions live in a dictionary
+    keyed by gate index. Whole layers of gates or repeated blocks are appended with one NumPy operation each,
+    and the circuit is only turned into Gate tuples or a RecordingKernel when it is simulated or compiled.
+    """
+
+    __slots__ = ('name', 'num_qubits', 'num_cregs', '_size', '_opcodes', '_offsets', '_qubits', '_params', '_extras')
+
+    def __init__(self, num_qubits, name='circuit', num_cregs=0, capacity=1024):
+        """
+        :param num_qubits: Number of qubits.
+        :param name: Name used for the kernel and program the circuit is lowered to.
+        :param num_cregs: Number of classical registers.
+        :param capacity: Number of gates to allocate room for; the arrays grow as needed.
+        """
+        self.name = name
+        self.num_qubits = num_qubits
+        self.num_cregs = num_cregs
+        self._size = 0
+        self._opcodes = np.empty(capacity, dtype=np.uint8)
+        self._offsets = np.zeros(capacity + 1, dtype=np.int64)
+        self._qubits = np.empty(2 * capacity, dtype=np.int32)
+        self._params = np.empty(capacity, dtype=np.float64)
+        self._extras = {}  # Gate index -> (param, condition) for parameters that are not floats and for conditions
+
+    @classmethod
+    def from_gates(cls, gates, num_qubits, name='circuit'):
+        """
+        Builds a circuit from a list of Gate tuples.
+        """
+        return cls(num_qubits, name, capacity=max(len(gates), 1)).extend(gates)
+
+    @classmethod
+    def from_arrays(cls, num_qubits, opcodes, offsets, qubits, params, extras=None, name='circuit', num_cregs=0):
+        """
+        Wraps existing arrays, as returned by arrays(), without copying them.
+
+        The arrays may be read-only, for example views of a memory-mapped file; appending gates to the circuit
+        then copies them first.
+
+        :param num_qubits: Number of qubits.
+        :param opcodes: Opcode of every gate.
+        :param offsets: Offset of the first qubit of every gate, plus the total number of qubit entries.
+        :param qubits: Qubits of all gates, concatenated.
+        :param params: Float parameter of every gate (NaN if none).
+        :param extras: Dictionary mapping gate index to (param, condition) for the other parameters.
+        :param name: Name of the circuit.
+        :param num_cregs: Number of classical registers.
+        :return: Circuit.
+        """
+        circuit = cls.__new__(cls)
+        circuit.name = name
+        circuit.num_qubits = num_qubits
+        circuit.num_cregs = num_cregs
+        circuit._size = len(opcodes)
+        circuit._opcodes = opcodes
+        circuit._offsets = offsets
+        circuit._qubits = qubits
+        circuit._params = params
+        circuit._extras = dict(extras or {})
+        return circuit
+
+    def arrays(self):
+        """
+        The arrays of the circuit, trimmed to its gates (views, not copies), and its extras.
+
+        :return: Tuple (opcodes, offsets, qubits, params, extras) as taken by from_arrays().
+        """
+        size = self._size
+        return (self._opcodes[:size], self._offsets[:size + 1], self._qubits[:self._offsets[size]],
+                self._params[:size], self._extras)
+
+    def __len__(self):
+        return self._size
+
+    def _reserve(self, num_gates, num_qubit_entries):
+        needed = self._size + num_gates
+        if needed > len(self._opcodes):
+            capacity = max(needed, 2 * len(self._opcodes))
+            self._opcodes = np.resize(self._opcodes, capacity)
+            self._params = np.resize(self._params, capacity)
+            offsets = np.zeros(capacity + 1, dtype=np.int64)
+            offsets[:self._size + 1] = self._offsets[:self._size + 1]
+            self._offsets = offsets
+        needed = self._offsets[self._size] + num_qubit_entries
+        if needed > len(self._qubits):
+            self._qubits = np.resize(self._qubits, max(needed, 2 * len(self._qubits)))
+
+    def _append(self, opcodes, arities, qubits, params):
+        """
+        Appends a block of gates given as arrays.
+
+        :param opcodes: Opcode of every gate.
+        :param arities: Number of qubits of every gate.
+        :param qubits: Qubits of all gates, concatenated.
+        :param params: Float parameter of every gate (NaN if none).
+        """
+        qubits = np.asarray(qubits, dtype=np.int32)
+        if len(qubits) and (qubits.min() < 0 or qubits.max() >= self.num_qubits):
+            raise ValueError(f"Qubit out of range for a circuit of {self.num_qubits} qubits.")
+        count = len(opcodes)
+        self._reserve(count, len(qubits))
+        start, end = self._size, self._size + count
+        first = self._offsets[start]
+        self._opcodes[start:end] = opcodes
+        self._params[start:end] = params
+        self._offsets[start + 1:end + 1] = first + np.cumsum(arities)
+        self._qubits[first:first + len(qubits)] = qubits
+        self._size = end
+
+    def gate(self, name, qubits, param=None, condition=None):
+        """
+        Appends one gate.
+
+        :param name: Gate name.
+        :param qubits: Qubits the gate acts on.
+        :param param: Rotation angle, 'unitary' matrix or 'classical' operands.
+        :param condition: Optional bit registers that must all be 1 for the gate to act.
+        :return: self, so calls can be chained.
+        """
+        index = self._size
+        number = isinstance(param, (int, float, np.integer, np.floating)) and not isinstance(param, bool)
+        self._append([_opcode(name)], [len(qubits)], qubits, [param if number else math.nan])
+        if (param is not None and not number) or condition:
+            self._extras[index] = (None if number else param, tuple(condition) if condition else None)
+        return self
+
+    def layer(self, name, qubits=None, param=None):
+        """
+        Appends the same single-qubit gate (or measure/prepz) on many qubits in one step.
+
+        :param name: Gate name, for example 'h' or 'measure'.
+        :param qubits: Qubits to apply it to; defaults to all qubits.
+        :param param: Rotation angle for rx/ry/rz.
+        :return: self.
+        """
+        qubits = np.arange(self.num_qubits) if qubits is None else np.asarray(qubits)
+        count = len(qubits)
+        self._append(np.full(count, _opcode(name)), np.ones(count, dtype=np.int64), qubits,
+                     np.full(count, math.nan if param is None else param))
+        return self
+
+    def pairs(self, name, firsts, seconds):
+        """
+        Appends a two-qubit gate for every pair (firsts[i], seconds[i]) in one step, for example a row of cnots.
+
+        :return: self.
+        """
+        qubits = np.column_stack([firsts, seconds]).reshape(-1)
+        count = len(qubits) // 2
+        self._append(np.full(count, _opcode(name)), np.full(count, 2), qubits, np.full(count, math.nan))
+        return self
+
+    def extend(self, gates):
+        """
+        Appends Gate tuples, for example the gates of a RecordingKernel.
+
+        :return: self.
+        """
+        for gate in gates:
+            self.gate(gate.name, gate.qubits, gate.param, gate.condition)
+        return self
+
+    def append(self, other, times=1):
+        """
+        Appends another circuit, repeated a number of times, by tiling its arrays.
+
+        :param other: Circuit on at most as many qubits.
+        :param times: Number of copies.
+        :return: self.
+        """
+        size = other._size
+        entries = other._offsets[size]
+        if not size or not times:
+            return self
+        index = self._size
+        arities = np.diff(other._offsets[:size + 1])
+        self._append(np.tile(other._opcodes[:size], times), np.tile(arities, times),
+                     np.tile(other._qubits[:entries], times), np.tile(other._params[:size], times))
+        for copy in range(times):
+            for i, extra in other._extras.items():
+                self._extras[index + copy * size + i] = extra
+        return self
+
+    def __iter__(self):
+        # Converting whole arrays to lists first is much faster than reading NumPy scalars one by one
+        opcodes = self._opcodes[:self._size].tolist()
+        offsets = self._offsets[:self._size + 1].tolist()
+        qubits = self._qubits[:offsets[-1]].tolist()
+        params = self._params[:self._size].tolist()
+        extras = self._extras
+        for i, code in enumerate(opcodes):
+            param = params[i]
+            param = None if param != param else param  # NaN marks a gate without a float parameter
+            condition = None
+            if i in extras:
+                extra_param, condition = extras[i]
+                if extra_param is not None:
+                    param = extra_param
+            yield Gate(OPCODES[code], tuple(qubits[offsets[i]:offsets[i + 1]]), param, condition)
+
+    def gates(self):
+        """
+        The gates as a list of Gate tuples, as used by the simulators and the optimizer.
+        """
+        return list(self)
+
+    def gate_counts(self):
+        """
+        Number of gates of every kind.
+
+        :return: Dictionary mapping gate name to count.
+        """
+        counts = np.bincount(self._opcodes[:self._size], minlength=len(OPCODES))
+        return {OPCODES[code]: int(count) for code, count in enumerate(counts) if count}
+
+    def kernel(self, platform, name=None, extra_qubits=0):
+        """
+        Lowers the circuit to a RecordingKernel; this is the only step that calls OpenQL.
+
+        :param platform: ql.Platform.
+        :param name: Kernel name; defaults to the circuit name.
+        :param extra_qubits: Ancilla qubits added after the circuit's qubits for mcz decompositions.
+        :return: RecordingKernel.
+        """
+        kernel = RecordingKernel(name or self.name, platform, self.num_qubits + extra_qubits, self.num_cregs)
+        kernel.add_gates(self, range(self.num_qubits, self.num_qubits + extra_qubits))
+        return kernel
+
+    def program(self, platform, name=None, extra_qubits=0):
+        """
+        Lowers the circuit to a RecordingProgram with a single kernel, ready to compile.
+        """
+        kernel = self.kernel(platform, name, extra_qubits)
+        program = RecordingProgram(name or self.name, platform, kernel.num_qubits, self.num_cregs)
+        program.add_kernel(kernel)
+        return program
+
@@ -0,0 +1,274 @@
+import collections
+import json
+import struct
+
+import numpy as np
+
+from circuit import Circuit, OPCODES
+from gates import Gate, gate_from_record, gate_to_record
+from recording import RecordingCReg, RecordingKernel, RecordingOperation, RecordingProgram
+
+# Circuit files start with the magic bytes and the length of a JSON header (uint64). The header describes the
+# program: its name, qubits, classical registers, the kernels and the control-flow blocks that run them (as in
+# RecordingProgram.blocks), plus the position of every array. The arrays follow the header, each starting at a
+# multiple of ALIGNMENT bytes: per kernel the opcodes (uint8), qubit offsets (int64), qubits (int32) and float
+# parameters (float64) of Circuit.arrays(), little-endian. Parameters that are not a number and gate conditions
+# are rare and stored in the header, as gate_to_record() values.
+MAGIC = b'KWCIRC\x01\x00'
+_PREFIX = struct.Struct('<8sQ')
+ALIGNMENT = 64
+
+_ARRAYS = (('opcodes', '<u1'), ('offsets', '<i8'), ('qubits', '<i4'), ('params', '<f8'))
+
+# Condition of an if_else or do_while block read from a file, with the fields of a RecordingOperation
+Condition = collections.namedtuple('Condition', ['lhs', 'operator', 'rhs', 'value'])
+
+
+class LoadedKernel:
+    """
+    A kernel read from a circuit file.
+
+    It has the attributes of a RecordingKernel that the simulators use, so a loaded program runs in
+    control_flow.ProgramInterpreter, and kernel.circuit or kernel.gates go to sampling.sample_counts().
+    """
+
+    def __init__(self, name, num_qubits, num_cregs, circuit):
+        """
+        :param name: Kernel name.
+        :param num_qubits: Number of qubits of the kernel, including ancillas the gates do not use.
+        :param num_cregs: Number of classical registers.
+        :param circuit: Circuit over the arrays of the file.
+        """
+        self.kernel_name = name
+        self.num_qubits = num_qubits
+        self.num_cregs = num_cregs
+        self.circuit = circuit
+        self._gates = None
+
+    @property
+    def gates(self):
+        """
+        The gates as Gate tuples, decoded from the arrays on first use.
+        """
+        if self._gates is None:
+            self._gates = self.circuit.gates()
+        return self._gates
+
+    def kernel(self, platform):
+        """
+        Lowers the kernel to a RecordingKernel; qubits after the last one used by a gate serve as mcz ancillas.
+        """
+        kernel = RecordingKernel(self.kernel_name, platform, self.num_qubits, self.num_cregs)
+        used = int(self.circuit.arrays()[2].max(initial=-1)) + 1
+        kernel.add_gates(self.gates, range(used, self.num_qubits))
+        return kernel
+
+
+class CircuitFile:
+    """
+    A program read from a circuit file by load().
+
+    The arrays of all kernels are read-only views of one memory map of the file, so loading costs no copies and
+    processes that load the same file share its pages. The object has the attributes of a RecordingProgram that
+    the simulators use (num_qubits, num_cregs, blocks, kernels).
+    """
+
+    def __init__(self, name, num_qubits, num_cregs, kernels, blocks):
+        self.program_name = name
+        self.num_qubits = num_qubits
+        self.num_cregs = num_cregs
+        self.kernels = kernels
+        self.blocks = blocks
+
+    def program(self, platform, name=None):
+        """
+        Lowers the file back to a RecordingProgram with the same kernels and control flow, ready to compile.
+
+        :param platform: ql.Platform.
+        :param name: Program name; defaults to the stored name.
+        :return: RecordingProgram.
+        """
+        program = RecordingProgram(name or self.program_name, platform, self.num_qubits, self.num_cregs)
+        lowered = {id(kernel): kernel.kernel(platform) for kernel in self.kernels}
+        for kind, kernels, count, condition in self.blocks:
+            kernels = [lowered[id(kernel)] for kernel in kernels]
+            if condition is not None:
+                if condition.value is not None:
+                    condition = RecordingOperation(condition.value)
+                else:
+                    condition = RecordingOperation(RecordingCReg(condition.lhs), condition.operator,
+                                                   None if condition.rhs is None else RecordingCReg(condition.rhs))
+            if kind == 'kernel':
+                program.add_kernel(*kernels)
+            elif kind == 'if_else':
+                program.add_if_else(*kernels, condition)
+            elif kind == 'for':
+                program.add_for(*kernels, count)
+            else:
+                program.add_do_while(*kernels, condition)
+        return program
+
+
+def _kernel_circuit(kernel):
+    if isinstance(kernel, (Circuit, LoadedKernel)):
+        return kernel if isinstance(kernel, Circuit) else kernel.circuit
+    return Circuit.from_gates(kernel.gates, kernel.num_qubits, kernel.kernel_name)
+
+
+def save(path, program, name=None):
+    """
+    Writes a program to a circuit file.
+
+    :param path: File to create; it is overwritten.
+    :param program: RecordingProgram (or CircuitFile) with its control flow, a single RecordingKernel or a Circuit.
+    :param name: Program name to store; defaults to the name of the program.
+    """
+    if isinstance(program, (RecordingProgram, CircuitFile)):
+        blocks = program.blocks
+        name = name or program.program_name
+    else:
+        blocks = [('kernel', (program,), None, None)]
+        name = name or getattr(program, 'kernel_name', None) or program.name
+    # A kernel used by several blocks is stored once
+    kernels = list({id(kernel): kernel for _, members, _, _ in blocks for kernel in members}.values())
+    index = {id(kernel): i for i, kernel in enumerate(kernels)}
+
+    header = {'name': name, 'num_qubits': program.num_qubits, 'num_cregs': program.num_cregs,
+              'kernels': [], 'blocks': []}
+    arrays = []
+    position = 0
+    for kernel in kernels:
+        circuit = _kernel_circuit(kernel)
+        *values, extras = circuit.arrays()
+        entry = {'name': getattr(kernel, 'kernel_name', circuit.name), 'num_qubits': kernel.num_qubits,
+                 'num_cregs': kernel.num_cregs, 'gates': len(circuit), 'arrays': {}, 'extras': {}}
+        for (key, dtype), array in zip(_ARRAYS, values):
+            array = np.ascontiguousarray(array, dtype=dtype)
+            entry['arrays'][key] = [position, len(array)]
+            arrays.append((position, array))
+            position += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+        for i, (param, condition) in extras.items():
+            _, _, param, condition = gate_to_record(Gate(OPCODES[values[0][i]], (), param, condition))
+            entry['extras'][str(i)] = [param, condition]
+        header['kernels'].append(entry)
+    for kind, members, count, condition in blocks:
+        if condition is not None:
+            condition = [condition.lhs, condition.operator, condition.rhs, condition.value]
+        header['blocks'].append([kind, [index[id(kernel)] for kernel in members], count, condition])
+
+    encoded = json.dumps(header, separators=(',', ':')).encode()
+    start = -(-(_PREFIX.size + len(encoded)) // ALIGNMENT) * ALIGNMENT
+    with open(path, 'wb') as f:
+        f.write(_PREFIX.pack(MAGIC, len(encoded)))
+        f.write(encoded)
+        for offset, array in arrays:
+            f.write(b'\0' * (start + offset - f.tell()))
+            f.write(array.tobytes())
+
+
+def read_header(path):
+    """
+    Reads the JSON header of a circuit file.
+
+    :return: Tuple (header dictionary, byte offset of the arrays).
+    """
+    with open(path, 'rb') as f:
+        magic, length = _PREFIX.unpack(f.read(_PREFIX.size))
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a circuit file.")
+        header = json.loads(f.read(length))
+    return header, -(-(_PREFIX.size + length) // ALIGNMENT) * ALIGNMENT
+
+
+def load(path):
+    """
+    Memory-maps a circuit file written by save().
+
+    :param path: Circuit file.
+    :return: CircuitFile whose kernels are backed by the file.
+    """
+    header, start = read_header(path)
+    data = np.memmap(path, dtype=np.uint8, mode='r')
+    kernels = []
+    for entry in header['kernels']:
+        values = []
+        for key, dtype in _ARRAYS:
+            offset, length = entry['arrays'][key]
+            offset += start
+            values.append(data[offset:offset + length * np.dtype(dtype).itemsize].view(dtype))
+        extras = {}
+        for i, (param, condition) in entry['extras'].items():
+            gate = gate_from_record([OPCODES[values[0][int(i)]], (), param, condition])
+            # A float parameter is always in the params array
+            extras[int(i)] = (gate.param if isinstance(gate.param, (np.ndarray, tuple)) else None, gate.condition)
+        circuit = Circuit.from_arrays(entry['num_qubits'], *values, extras, entry['name'], entry['num_cregs'])
+        kernels.append(LoadedKernel(entry['name'], entry['num_qubits'], entry['num_cregs'], circuit))
+    blocks = []
+    for kind, members, count, condition in header['blocks']:
+        blocks.append((kind, tuple(kernels[i] for i in members), count,
+                       None if condition is None else Condition(*condition)))
+    return CircuitFile(header['name'], header['num_qubits'], header['num_cregs'], kernels, blocks)
+
+
+def check_round_trip(program, platform, path):
+    """
+    Saves a program, loads it and lowers it again, and compares the result with the original.
+
+    :param program: RecordingProgram.
+    :param platform: ql.Platform to lower the loaded program on.
+    :param path: File to write the program to.
+    :return: List of differences; empty if the program survived the round trip.
+    """
+    save(path, program)
+    lowered = load(path).program(platform)
+    problems = []
+    if len(lowered.blocks) != len(program.blocks):
+        problems.append(f'{len(program.blocks)} blocks became {len(lowered.blocks)}')
+    for i, (before, after) in enumerate(zip(program.blocks, lowered.blocks)):
+        kind, kernels, count, condition = before
+        if (kind, count) != (after[0], after[2]):
+            problems.append(f'block {i}: {kind} x {count} became {after[0]} x {after[2]}')
+        operands = [(c.lhs, c.operator, c.rhs, c.value) for c in (condition, after[3]) if c is not None]
+        if len(operands) == 1 or (operands and operands[0] != operands[1]):
+            problems.append(f'block {i}: condition changed')
+        for old, new in zip(kernels, after[1]):
+            if [gate_to_record(gate) for gate in old.gates] != [gate_to_record(gate) for gate in new.gates]:
+                problems.append(f'block {i}: gates of kernel {old.kernel_name} changed')
+    return problems
+
+
+if __name__ == '__main__':
+    import argparse
+    import os
+    import tempfile
+
+    from session import get_platform
+
+    parser = argparse.ArgumentParser(description='Check that programs survive a save, load and lowering round trip.')
+    parser.add_argument('--qubits', type=int, default=3, help='number of qubits of the test program')
+    args = parser.parse_args()
+
+    # A program with every kind of block, conditioned gates and classical operations between registers
+    platform = get_platform()
+    test_program = RecordingProgram('round_trip', platform, args.qubits, 4)
+    first = RecordingKernel('first', platform, args.qubits, 4)
+    first.hadamard(0)
+    first.measure(0)
+    first.conditional_gate('x', [1], [0])
+    first.classical(RecordingCReg(0), RecordingOperation(1))
+    first.classical(RecordingCReg(2), RecordingOperation(RecordingCReg(0), '+', RecordingCReg(1)))
+    first.classical(RecordingCReg(3), RecordingOperation(RecordingCReg(2)))
+    body = RecordingKernel('body', platform, args.qubits, 4)
+    body.rx(2, 0.25)
+    body.classical(RecordingCReg(1), RecordingOperation(RecordingCReg(1), '+', RecordingCReg(0)))
+    test_program.add_kernel(first)
+    test_program.add_for(body, 3)
+    test_program.add_do_while(body, RecordingOperation(RecordingCReg(1), '<', RecordingCReg(2)))
+    test_program.add_if_else(first, body, RecordingOperation(RecordingCReg(0), '==', RecordingCReg(3)))
+
+    with tempfile.TemporaryDirectory() as directory:
+        differences = check_round_trip(test_program, platform, os.path.join(directory, 'round_trip.kwc'))
+    for difference in differences:
+        print('DIFFERENCE', difference)
+    print('round trip ok' if not differences else f'{len(differences)} differences')
+    raise SystemExit(1 if differences else 0)
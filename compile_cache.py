@@ -0,0 +1,191 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import openql as ql
+
+from profiling import span
+from recording import RecordingKernel, RecordingOperation
+
+# Directory holding one subdirectory of compiled artifacts per distinct program
+DEFAULT_CACHE_DIR = '.ql_cache'
+
+# The cache directory is trimmed back to this size (in bytes) after every new entry
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# OpenQL options that change what program.compile() writes; options unknown to the installed OpenQL are skipped
+COMPILER_OPTIONS = (
+    'output_dir',
+    'unique_output',
+    'optimize',
+    'scheduler',
+    'scheduler_uniform',
+    'scheduler_commute',
+    'decompose_toffoli',
+    'cz_mode',
+    'write_qasm_files',
+    'write_report_files',
+    'mapper',
+    'initialplace',
+)
+
+MANIFEST = 'manifest.json'
+
+
+def _compiler_options():
+    options = {}
+    for name in COMPILER_OPTIONS:
+        try:
+            options[name] = ql.get_option(name)
+        except Exception:
+            pass
+    return options
+
+
+def _param_key(param):
+    # Matrices of fused gates are hashed exactly rather than through their rounded repr
+    return param.tobytes().hex() if hasattr(param, 'tobytes') else repr(param)
+
+
+def program_key(program, options=None):
+    """
+    Computes the content hash of a program.
+
+    :param program: RecordingProgram whose kernels are all RecordingKernel instances.
+    :param options: Extra values that should be part of the key, for example compiler options not read by default.
+    :return: Hex digest, or None if part of the program was not recorded and the program cannot be described.
+    """
+    blocks = []
+    for kind, kernels, count, condition in program.blocks:
+        if not all(isinstance(kernel, RecordingKernel) for kernel in kernels):
+            return None
+        if condition is not None and not isinstance(condition, RecordingOperation):
+            return None
+        blocks.append({
+            'kind': kind,
+            'kernels': [{
+                'name': kernel.kernel_name,
+                'num_qubits': kernel.num_qubits,
+                'num_cregs': kernel.num_cregs,
+                'gates': [[gate.name, list(gate.qubits), _param_key(gate.param), gate.condition]
+                          for gate in kernel.gates],
+            } for kernel in kernels],
+            'count': count,
+            'condition': None if condition is None else [condition.lhs, condition.operator, condition.rhs,
+                                                          condition.value],
+        })
+    platform = program.platform_handle
+    description = {
+        'program': program.program_name,
+        'platform': [str(getattr(platform, 'name', '')), str(getattr(platform, 'config_file', ''))],
+        'num_qubits': program.num_qubits,
+        'num_cregs': program.num_cregs,
+        'blocks': blocks,
+        'options': _compiler_options(),
+        'extra': options or {},
+    }
+    return hashlib.sha256(json.dumps(description, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _entry_size(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def evict(cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, keep=None):
+    """
+    Removes the least recently used cache entries until the cache fits in max_bytes.
+
+    :param cache_dir: Cache directory.
+    :param max_bytes: Maximum total size of the cache.
+    :param keep: Key of an entry that must not be removed (the one just written).
+    """
+    if not os.path.isdir(cache_dir):
+        return
+    entries = []
+    for key in os.listdir(cache_dir):
+        manifest = os.path.join(cache_dir, key, MANIFEST)
+        if os.path.isfile(manifest):
+            entries.append((os.path.getmtime(manifest), key, _entry_size(os.path.join(cache_dir, key))))
+    total = sum(size for _, _, size in entries)
+    for _, key, size in sorted(entries):
+        if total <= max_bytes:
+            break
+        if key == keep:
+            continue
+        shutil.rmtree(os.path.join(cache_dir, key), ignore_errors=True)
+        total -= size
+
+
+def _restore(entry, output_dir):
+    with open(os.path.join(entry, MANIFEST)) as f:
+        files = json.load(f)['files']
+    for relative in files:
+        destination = os.path.join(output_dir, relative)
+        os.makedirs(os.path.dirname(destination) or '.', exist_ok=True)
+        shutil.copy2(os.path.join(entry, 'files', relative), destination)
+    # Touching the manifest marks the entry as recently used for eviction
+    os.utime(os.path.join(entry, MANIFEST))
+
+
+def _store(entry, scratch):
+    # Everything in the scratch directory was written by this compilation
+    files = [os.path.relpath(os.path.join(root, name), scratch)
+             for root, _, names in os.walk(scratch) for name in names]
+    temporary = f'{entry}.tmp{os.getpid()}'
+    shutil.rmtree(temporary, ignore_errors=True)
+    os.makedirs(temporary)
+    os.replace(scratch, os.path.join(temporary, 'files'))
+    with open(os.path.join(temporary, MANIFEST), 'w') as f:
+        json.dump({'files': files}, f)
+    try:
+        os.replace(temporary, entry)
+    except OSError:
+        # Another process stored the same entry first
+        shutil.rmtree(temporary, ignore_errors=True)
+
+
+def compile_cached(program, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, options=None):
+    """
+    Compiles a program, reusing the artifacts of an earlier compilation of the same program if there is one.
+
+    :param program: RecordingProgram built from RecordingKernel instances.
+    :param cache_dir: Directory where compiled artifacts are kept.
+    :param max_bytes: Maximum total size of the cache directory.
+    :param options: Extra values that should be part of the cache key.
+    :return: True if the artifacts came from the cache, False if program.compile() was run.
+    """
+    output_dir = ql.get_option('output_dir')
+    with span('compile_cached', 'compile', program=program.program_name) as info:
+        with span('program_key', 'compile'):
+            key = program_key(program, options)
+        if key is None:
+            # Part of the program was not recorded, so it cannot be identified safely
+            program.compile()
+            info['cached'] = False
+            return False
+        entry = os.path.join(cache_dir, key)
+        info['cached'] = os.path.isfile(os.path.join(entry, MANIFEST))
+        if info['cached']:
+            with span('restore', 'compile'):
+                _restore(entry, output_dir)
+            return True
+        # Compile into a directory of this call only, so the entry cannot pick up files that other compilations
+        # write to the output directory at the same time; the entry is then restored like a cache hit
+        os.makedirs(cache_dir, exist_ok=True)
+        scratch = tempfile.mkdtemp(prefix=f'{key}.out', dir=cache_dir)
+        try:
+            ql.set_option('output_dir', scratch)
+            try:
+                program.compile()
+            finally:
+                ql.set_option('output_dir', output_dir)
+            with span('store', 'compile'):
+                _store(entry, scratch)
+                _restore(entry, output_dir)
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+        with span('evict', 'compile'):
+            evict(cache_dir, max_bytes, keep=key)
+        return False
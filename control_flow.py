@@ -0,0 +1,187 @@
+import operator
+
+import numpy as np
+
+from gates import NON_UNITARY_GATES
+from profiling import span
+from statevector import apply_gate, zero_state
+
+# Operators a RecordingOperation can use
+OPERATORS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '>': operator.gt,
+    '<=': operator.le,
+    '>=': operator.ge,
+    '+': operator.add,
+    '-': operator.sub,
+    '&': operator.and_,
+    '|': operator.or_,
+    '^': operator.xor,
+}
+
+
+def evaluate(lhs, op, rhs, value, cregs):
+    """
+    Evaluates a recorded classical operation.
+
+    :param lhs: Index of the left-hand register, or None for a constant.
+    :param op: Operator string, or None for a copy or a constant.
+    :param rhs: Index of the right-hand register.
+    :param value: Constant value when lhs is None.
+    :param cregs: Current register values.
+    :return: Integer result (comparisons give 0 or 1).
+    """
+    if lhs is None:
+        return value
+    if op is None:
+        return cregs[lhs]
+    return int(OPERATORS[op](cregs[lhs], cregs[rhs]))
+
+
+def kernel_unitary(gates, num_qubits):
+    """
+    Builds the unitary matrix of a list of unitary gates.
+
+    Every basis state is pushed through the gates at once as a batch, so row i of the result is U|i>.
+
+    :param gates: Unitary gates.
+    :param num_qubits: Number of qubits.
+    :return: 2**num_qubits x 2**num_qubits matrix.
+    """
+    basis = np.eye(2 ** num_qubits, dtype=np.complex128)
+    for gate in gates:
+        apply_gate(basis, gate, num_qubits)
+    return basis.T
+
+
+class ProgramInterpreter:
+    """
+    Executes a RecordingProgram including its classical control flow.
+
+    The interpreter keeps a statevector and the values of the classical registers. Measurements collapse the
+    state and write their result to the register with the same index as the measured qubit. Long loops whose
+    body only contains unitary gates are not iterated: the body is turned into a matrix once and raised to the
+    number of iterations, so the run time grows only with the logarithm of the iteration count.
+    """
+
+    def __init__(self, program, rng=None, max_unitary_qubits=10, max_iterations=1000000):
+        """
+        :param program: RecordingProgram built from RecordingKernel instances.
+        :param rng: Optional numpy.random.Generator for measurement outcomes.
+        :param max_unitary_qubits: Largest number of qubits for which loop bodies are turned into a matrix.
+        :param max_iterations: Limit on do-while iterations, to stop loops whose condition never changes.
+        """
+        self.program = program
+        self.num_qubits = program.num_qubits
+        self.rng = rng or np.random.default_rng()
+        self.max_unitary_qubits = max_unitary_qubits
+        self.max_iterations = max_iterations
+        self.state = zero_state(self.num_qubits)
+        self.cregs = [0] * max(program.num_cregs, 1)
+        self.bregs = [0] * self.num_qubits  # Measurement results, read by conditioned gates
+        self._unitaries = {}
+
+    def run(self):
+        """
+        Runs the whole program.
+
+        :return: Tuple (final statevector, list of classical register values).
+        """
+        with span('interpret', 'simulate', program=self.program.program_name, num_qubits=self.num_qubits):
+            for kind, kernels, count, condition in self.program.blocks:
+                if kind == 'kernel':
+                    self.run_kernel(kernels[0])
+                elif kind == 'if_else':
+                    self.run_kernel(kernels[0] if self._condition(condition) else kernels[1])
+                elif kind == 'for':
+                    self.run_loop(kernels[0], count)
+                elif kind == 'do_while':
+                    self.run_do_while(kernels[0], condition)
+                else:
+                    raise ValueError(f"Unknown block kind '{kind}'.")
+        return self.state, self.cregs
+
+    def _condition(self, condition):
+        return bool(evaluate(condition.lhs, condition.operator, condition.rhs, condition.value, self.cregs))
+
+    def run_kernel(self, kernel):
+        """
+        Executes the gates of one kernel once.
+        """
+        for gate in kernel.gates:
+            if gate.name == 'measure':
+                self.bregs[gate.qubits[0]] = self.measure(gate.qubits[0])
+                self._write_creg(gate.qubits[0], self.bregs[gate.qubits[0]])
+            elif gate.name == 'prepz':
+                if self.measure(gate.qubits[0]):
+                    apply_gate(self.state, gate._replace(name='x'), self.num_qubits)
+            elif gate.name == 'classical':
+                destination, lhs, op, rhs, value = gate.param
+                self.cregs[destination] = evaluate(lhs, op, rhs, value, self.cregs)
+            elif gate.condition:
+                if all(self.bregs[breg] for breg in gate.condition):
+                    apply_gate(self.state, gate._replace(condition=None), self.num_qubits)
+            else:
+                apply_gate(self.state, gate, self.num_qubits)
+
+    def _write_creg(self, index, value):
+        if index < len(self.cregs):
+            self.cregs[index] = value
+
+    def measure(self, qubit):
+        """
+        Measures one qubit, collapsing the state.
+
+        :return: Measured bit.
+        """
+        view = self.state.reshape(2 ** qubit, 2, -1)
+        probability_one = float(np.sum(np.abs(view[:, 1, :]) ** 2))
+        bit = int(self.rng.random() < probability_one)
+        view[:, 1 - bit, :] = 0
+        view /= np.sqrt(probability_one if bit else 1 - probability_one)
+        return bit
+
+    def _is_unitary(self, kernel):
+        return not any(gate.name in NON_UNITARY_GATES or gate.condition for gate in kernel.gates)
+
+    def _use_matrix_power(self, kernel, count):
+        if count < 2 or self.num_qubits > self.max_unitary_qubits or not self._is_unitary(kernel):
+            return False
+        # Rough costs in units of one pass over the statevector: iterating applies every gate count times,
+        # the matrix route builds the matrix (one pass per basis state and gate) and squares it about
+        # log2(count) times (2**num_qubits passes per matrix product)
+        size = 2 ** self.num_qubits
+        iterate = count * len(kernel.gates)
+        matrix = size * len(kernel.gates) + 2 * size * size * int(np.ceil(np.log2(count)))
+        return matrix < iterate
+
+    def run_loop(self, kernel, count):
+        """
+        Executes a kernel count times, as a single matrix power when the body is unitary and that is cheaper.
+        """
+        if self._use_matrix_power(kernel, count):
+            if id(kernel) not in self._unitaries:
+                self._unitaries[id(kernel)] = kernel_unitary(kernel.gates, self.num_qubits)
+            self.state = np.linalg.matrix_power(self._unitaries[id(kernel)], count) @ self.state
+            return
+        for _ in range(count):
+            self.run_kernel(kernel)
+
+    def run_do_while(self, kernel, condition):
+        """
+        Executes a kernel once and then again as long as the condition holds.
+
+        A unitary body cannot change the registers the condition reads, so if the condition still holds after
+        the first pass the loop would never end.
+        """
+        self.run_kernel(kernel)
+        iterations = 1
+        while self._condition(condition):
+            if self._is_unitary(kernel):
+                raise RuntimeError("do-while loop with a unitary body and a true condition never ends.")
+            if iterations >= self.max_iterations:
+                raise RuntimeError(f"do-while loop did not end after {self.max_iterations} iterations.")
+            self.run_kernel(kernel)
+            iterations += 1
@@ -0,0 +1,225 @@
+import collections
+
+import numpy as np
+
+from gates import Gate
+from grover import ancillas_needed
+from recording import RecordingKernel
+
+# An oracle f: {0,1}^n -> {0,1} for the Deutsch-Jozsa algorithm. kind is one of ORACLE_KINDS:
+# - 'constant': value is f's constant value (0 or 1)
+# - 'parity': value is an integer mask, f(x) = parity(x & mask)
+# - 'truth_table': value is a sequence of 2**n bits, value[x] = f(x)
+# Inputs x are integers whose binary digits are the input qubits in order, qubit 0 first.
+Oracle = collections.namedtuple('Oracle', ['kind', 'value'])
+
+ORACLE_KINDS = ('constant', 'parity', 'truth_table')
+
+# Classification results
+CONSTANT, BALANCED, NEITHER = 0, 1, 2
+LABELS = ('constant', 'balanced', 'neither')
+
+# Number of ones in every byte value
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.int64)
+
+
+def parse_oracle(text):
+    """
+    Reads an oracle from the command line: 'constant:0', 'constant:1', 'parity:<mask>' or 'table:<bits>',
+    for example 'parity:3' or 'table:0110'.
+
+    :param text: Oracle description.
+    :return: Oracle.
+    """
+    kind, _, value = text.partition(':')
+    if kind == 'constant':
+        return Oracle('constant', int(value))
+    if kind == 'parity':
+        return Oracle('parity', int(value, 0))
+    if kind in ('table', 'truth_table'):
+        return Oracle('truth_table', tuple(int(bit) for bit in value))
+    raise ValueError(f"Unknown oracle '{text}', expected constant:<0|1>, parity:<mask> or table:<bits>.")
+
+
+def truth_tables(oracles, num_inputs):
+    """
+    Evaluates oracles on every input at once.
+
+    :param oracles: Sequence of Oracle.
+    :param num_inputs: Number of input qubits n.
+    :return: Boolean array of shape (len(oracles), 2**n); row i is the truth table of oracle i.
+    """
+    size = 2 ** num_inputs
+    inputs = np.arange(size, dtype=np.int64)
+    tables = np.zeros((len(oracles), size), dtype=bool)
+    masks = {}
+    for i, oracle in enumerate(oracles):
+        if oracle.kind == 'constant':
+            tables[i] = bool(oracle.value)
+        elif oracle.kind == 'parity':
+            if not 0 <= oracle.value < size:
+                raise ValueError(f"Parity mask {oracle.value} does not fit in {num_inputs} inputs.")
+            masks[i] = oracle.value
+        elif oracle.kind == 'truth_table':
+            if len(oracle.value) != size:
+                raise ValueError(f"A truth table for {num_inputs} inputs needs {size} entries.")
+            tables[i] = np.asarray(oracle.value, dtype=bool)
+        else:
+            raise ValueError(f"Unknown oracle kind '{oracle.kind}'.")
+    if masks:
+        # parity(x & mask) for all parity oracles and inputs in one pass, one bit of the mask at a time
+        rows = np.fromiter(masks, dtype=np.int64)
+        selected = inputs[np.newaxis, :] & np.fromiter(masks.values(), dtype=np.int64)[:, np.newaxis]
+        parity = np.zeros(selected.shape, dtype=np.int64)
+        for bit in range(num_inputs):
+            parity ^= selected >> bit
+        tables[rows] = parity & 1
+    return tables
+
+
+def count_ones(tables, chunk_size=1 << 14):
+    """
+    Counts the inputs on which every function is 1, on bit-packed truth tables.
+
+    :param tables: Boolean array of shape (functions, 2**n).
+    :param chunk_size: Number of functions packed at a time.
+    :return: int64 array with the number of ones of every function.
+    """
+    counts = np.empty(len(tables), dtype=np.int64)
+    for start in range(0, len(tables), chunk_size):
+        packed = np.packbits(tables[start:start + chunk_size], axis=1)
+        counts[start:start + chunk_size] = _POPCOUNT[packed].sum(axis=1)
+    return counts
+
+
+def zero_probability(tables):
+    """
+    Probability that the Deutsch-Jozsa circuit measures all input qubits as 0.
+
+    The amplitude of |0...0> is the mean of (-1)**f(x), so the probability is ((2**n - 2*ones) / 2**n)**2.
+
+    :param tables: Boolean array of shape (functions, 2**n).
+    :return: Array of probabilities.
+    """
+    size = tables.shape[1]
+    return ((size - 2 * count_ones(tables)) / size) ** 2
+
+
+def classify(tables):
+    """
+    Classifies many functions the way the Deutsch-Jozsa algorithm does.
+
+    :param tables: Boolean array of shape (functions, 2**n), for example from truth_tables().
+    :return: int8 array with CONSTANT, BALANCED or NEITHER for every function (NEITHER breaks the promise of the
+        algorithm: the circuit then measures |0...0> with a probability strictly between 0 and 1).
+    """
+    ones = count_ones(tables)
+    size = tables.shape[1]
+    labels = np.full(len(ones), NEITHER, dtype=np.int8)
+    labels[(ones == 0) | (ones == size)] = CONSTANT
+    labels[ones == size // 2] = BALANCED
+    return labels
+
+
+def outcome_distribution(tables):
+    """
+    Full measurement distribution of the Deutsch-Jozsa circuit for many functions.
+
+    The amplitude of outcome y is the Walsh-Hadamard transform of (-1)**f at y divided by 2**n, computed for all
+    functions at once with an in-place butterfly over the batch.
+
+    :param tables: Boolean array of shape (functions, 2**n).
+    :return: Array of shape (functions, 2**n) with the probability of every outcome.
+    """
+    amplitudes = 1 - 2 * np.asarray(tables, dtype=np.float64)
+    size = amplitudes.shape[1]
+    half = size // 2
+    while half:
+        view = amplitudes.reshape(len(amplitudes), -1, 2, half)
+        a = view[:, :, 0, :].copy()
+        view[:, :, 0, :] += view[:, :, 1, :]
+        view[:, :, 1, :] = a - view[:, :, 1, :]
+        half //= 2
+    return (amplitudes / size) ** 2
+
+
+def _anf(table):
+    # Algebraic normal form: f(x) = XOR over the monomials m with coefficient 1 of AND(x_i for i in m)
+    anf = np.array(table, dtype=bool)
+    half = len(anf) // 2
+    while half:
+        view = anf.reshape(-1, 2, half)
+        view[:, 1, :] ^= view[:, 0, :]
+        half //= 2
+    return anf
+
+
+def oracle_gates(num_inputs, oracle):
+    """
+    Gates of an oracle acting on n input qubits and the ancilla qubit n.
+
+    Constant and parity oracles use x and cnot gates on the ancilla. A truth table is applied as a phase oracle
+    (-1)**f(x) on the inputs (the ancilla is in |-> so both forms are equivalent): every monomial of f's
+    algebraic normal form becomes one mcz on the qubits of the monomial.
+
+    :param num_inputs: Number of input qubits n.
+    :param oracle: Oracle.
+    :return: List of gates.
+    """
+    ancilla = num_inputs
+    if oracle.kind == 'constant':
+        return [Gate('x', (ancilla,))] if oracle.value else []
+    if oracle.kind == 'parity':
+        bits = format(oracle.value, f'0{num_inputs}b')
+        if len(bits) != num_inputs:
+            raise ValueError(f"Parity mask {oracle.value} does not fit in {num_inputs} inputs.")
+        return [Gate('cnot', (i, ancilla)) for i, bit in enumerate(bits) if bit == '1']
+    if oracle.kind == 'truth_table':
+        gates = []
+        anf = _anf(truth_tables([oracle], num_inputs)[0])
+        # The constant monomial only adds a global phase
+        for monomial in np.flatnonzero(anf[1:]) + 1:
+            bits = format(int(monomial), f'0{num_inputs}b')
+            gates.append(Gate('mcz', tuple(i for i, bit in enumerate(bits) if bit == '1')))
+        return gates
+    raise ValueError(f"Unknown oracle kind '{oracle.kind}'.")
+
+
+def deutsch_jozsa_gates(num_inputs, oracle, measure=True):
+    """
+    Builds the gate list of the Deutsch-Jozsa algorithm for n inputs and one ancilla (qubit n).
+
+    :param num_inputs: Number of input qubits n.
+    :param oracle: Oracle.
+    :param measure: Whether to measure the input qubits at the end.
+    :return: List of gates.
+    """
+    ancilla = num_inputs
+    gates = [Gate('x', (ancilla,))]
+    gates += [Gate('h', (i,)) for i in range(num_inputs + 1)]
+    gates += oracle_gates(num_inputs, oracle)
+    gates += [Gate('h', (i,)) for i in range(num_inputs)]
+    if measure:
+        gates += [Gate('measure', (i,)) for i in range(num_inputs)]
+    return gates
+
+
+def build_deutsch_jozsa_kernel(platform, num_inputs, oracle, name='deutsch_jozsa'):
+    """
+    Creates a RecordingKernel running the Deutsch-Jozsa algorithm.
+
+    The kernel has n inputs, the ancilla and, for truth-table oracles with monomials of more than three
+    variables, the extra qubits the mcz decomposition needs; the recorded gates only use the first n + 1.
+
+    :param platform: ql.Platform to create the kernel for.
+    :param num_inputs: Number of input qubits n.
+    :param oracle: Oracle.
+    :param name: Name of the kernel.
+    :return: RecordingKernel.
+    """
+    gates = deutsch_jozsa_gates(num_inputs, oracle)
+    extra = max((ancillas_needed(len(gate.qubits)) for gate in gates if gate.name == 'mcz'), default=0)
+    ancillas = range(num_inputs + 1, num_inputs + 1 + extra)
+    kernel = RecordingKernel(name, platform, num_inputs + 1 + extra)
+    kernel.add_gates(gates, ancillas)
+    return kernel
@@ -0,0 +1,178 @@
+import argparse
+import collections
+
+import numpy as np
+
+from circuit import Circuit
+from gates import Gate
+from optimizer import DIAGONAL_GATES
+from scheduler import simulate_layers
+from stabilizer import StabilizerSimulator, is_clifford
+
+# Ways to compare two circuits: 'stabilizer' compares the Clifford tableaux (exact, Clifford circuits only),
+# 'unitary' pushes every basis state through both circuits (exact, 2**n states), 'probes' a few random states
+# (probabilistic: circuits that differ pass only with probability zero); 'auto' picks the cheapest exact one
+METHODS = ('auto', 'stabilizer', 'unitary', 'probes')
+
+# Largest number of qubits for which 'auto' builds the full unitary instead of using random probes
+UNITARY_MAX_QUBITS = 8
+
+DEFAULT_PROBES = 4
+
+# Largest deviation of an amplitude that still counts as equal
+DEFAULT_TOLERANCE = 1e-8
+
+# Outcome of a check: the method used and the largest amplitude deviation after aligning the global phase
+# (0 or 1 for the stabilizer method); detail says why circuits differ before simulating, else it is None
+Equivalence = collections.namedtuple('Equivalence', ['equivalent', 'method', 'error', 'detail'])
+
+
+def _gate_list(circuit):
+    if isinstance(circuit, Circuit):
+        return circuit.gates()
+    return list(getattr(circuit, 'gates', circuit))
+
+
+def defer_measurements(gates):
+    """
+    Moves the measurements of a circuit to its end, so it can be compared as a unitary.
+
+    A measurement can be deferred when later gates only use the measured qubit as a control, that is through
+    gates that are diagonal on it (cz, rz, ...) or as the control of a cnot or toffoli: the measurement commutes
+    with them. A Pauli X or Z conditioned on the measurement result becomes a cnot or cz controlled by the
+    measured qubit; a gate conditioned on a bit register that was never written never acts and is dropped.
+    Leading prepz operations are dropped like in statevector.split_terminal_measurements().
+
+    :param gates: Recorded gates.
+    :return: Tuple (unitary gates, measured qubits in the order they were first measured).
+    :raises ValueError: If a measurement cannot be deferred.
+    """
+    unitary = []
+    measured = []
+    touched = set()
+    for gate in gates:
+        if gate.name == 'measure':
+            if gate.qubits[0] not in measured:
+                measured.append(gate.qubits[0])
+            continue
+        if gate.name == 'prepz':
+            if gate.qubits[0] in touched or gate.qubits[0] in measured:
+                raise ValueError(f"prepz on qubit {gate.qubits[0]} after it was used cannot be deferred.")
+            continue
+        if gate.condition:
+            if gate.name not in ('x', 'z') or len(gate.condition) != 1:
+                raise ValueError(f"Gate '{gate.name}' conditioned on {list(gate.condition)} cannot be deferred.")
+            if gate.condition[0] not in measured:
+                continue
+            gate = Gate('cnot' if gate.name == 'x' else 'cz', (gate.condition[0],) + gate.qubits)
+        for position, qubit in enumerate(gate.qubits):
+            if qubit not in measured:
+                continue
+            control = gate.name in ('cnot', 'toffoli') and position < len(gate.qubits) - 1
+            if gate.name not in DIAGONAL_GATES and not control:
+                raise ValueError(f"Gate '{gate.name}' acts on qubit {qubit} after it was measured, "
+                                 f"not as a control; the measurement cannot be deferred.")
+        touched.update(gate.qubits)
+        unitary.append(gate)
+    return unitary, measured
+
+
+def _tableau(gates, num_qubits):
+    # Starting from the identity tableau the rows become the images of the X and Z of every qubit
+    tableau = StabilizerSimulator(num_qubits, max_random=0).run(gates).tableau
+    rows = 2 * num_qubits
+    return tableau.x[:rows], tableau.z[:rows], tableau.signs[:rows, 0]
+
+
+def _inputs(num_qubits, ancillas, probes, rng):
+    """
+    States both circuits are applied to: all basis states (probes=None) or random states, with the ancillas in |0>.
+    """
+    indices = np.arange(2 ** num_qubits)
+    mask = sum(1 << (num_qubits - 1 - qubit) for qubit in ancillas)
+    free = indices[(indices & mask) == 0]
+    if probes is None:
+        states = np.zeros((len(free), 2 ** num_qubits), dtype=np.complex128)
+        states[np.arange(len(free)), free] = 1
+        return states
+    states = np.zeros((probes, 2 ** num_qubits), dtype=np.complex128)
+    states[:, free] = rng.normal(size=(probes, len(free))) + 1j * rng.normal(size=(probes, len(free)))
+    return states / np.linalg.norm(states, axis=1, keepdims=True)
+
+
+def _deviation(out_a, out_b):
+    """
+    Largest amplitude difference between two batches of output states after removing one global phase.
+    """
+    overlap = np.vdot(out_a, out_b)
+    phase = overlap / abs(overlap) if abs(overlap) > 0 else 1
+    return float(np.abs(out_b - phase * out_a).max())
+
+
+def check_equivalence(a, b, num_qubits=None, method='auto', ancillas=(), probes=DEFAULT_PROBES,
+                      tolerance=DEFAULT_TOLERANCE, rng=None):
+    """
+    Checks whether two circuits implement the same operation up to a global phase.
+
+    Measurements are first deferred to the end (see defer_measurements()); the circuits must then measure the
+    same qubits in the same order and their unitary parts must agree. Agreement of the unitaries is sufficient
+    for equivalent measurement results, so a circuit and its optimized version always pass.
+
+    :param a: Gate list, RecordingKernel or Circuit.
+    :param b: Gate list, RecordingKernel or Circuit.
+    :param num_qubits: Optional number of qubits of the kernels. Qubits after the last one either circuit uses
+        are left out, since both circuits act on them as the identity (unused mcz ancillas cost nothing).
+    :param method: One of METHODS. 'auto' uses the stabilizer tableaux when both circuits are Clifford circuits
+        (and no ancillas are given), the full unitary up to UNITARY_MAX_QUBITS and random probes beyond.
+    :param ancillas: Qubits that start in |0>; the circuits are only compared on such inputs. The stabilizer
+        method ignores this and compares the whole operation.
+    :param probes: Number of random states for the 'probes' method.
+    :param tolerance: Largest amplitude deviation that counts as equal.
+    :param rng: Optional numpy.random.Generator for the probes.
+    :return: Equivalence.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown method '{method}', expected one of {METHODS}.")
+    gates_a, measured_a = defer_measurements(_gate_list(a))
+    gates_b, measured_b = defer_measurements(_gate_list(b))
+    qubits = [qubit for gate in gates_a + gates_b for qubit in gate.qubits] + measured_a + measured_b
+    used = max(qubits, default=-1) + 1
+    num_qubits = used if num_qubits is None else min(num_qubits, used)
+    ancillas = [qubit for qubit in ancillas if qubit < num_qubits]
+    if method == 'auto':
+        if not ancillas and is_clifford(gates_a) and is_clifford(gates_b):
+            method = 'stabilizer'
+        else:
+            method = 'unitary' if num_qubits - len(ancillas) <= UNITARY_MAX_QUBITS else 'probes'
+    if measured_a != measured_b:
+        return Equivalence(False, method, None, f'measured qubits differ: {measured_a} vs {measured_b}')
+    if method == 'stabilizer':
+        same = all(np.array_equal(x, y) for x, y in zip(_tableau(gates_a, num_qubits), _tableau(gates_b, num_qubits)))
+        return Equivalence(same, method, 0.0 if same else 1.0, None)
+    states = _inputs(num_qubits, ancillas, None if method == 'unitary' else probes, rng or np.random.default_rng())
+    out_a = simulate_layers(gates_a, num_qubits, state=states.copy())
+    out_b = simulate_layers(gates_b, num_qubits, state=states)
+    error = _deviation(out_a, out_b)
+    return Equivalence(error <= tolerance, method, error, None)
+
+
+if __name__ == '__main__':
+    from example_circuits import KERNEL_EXAMPLES
+    from optimizer import optimize
+
+    parser = argparse.ArgumentParser(description='Check that two example circuits are equivalent; with one example, '
+                                                 'check it against its optimized gate list.')
+    parser.add_argument('examples', nargs='+', choices=KERNEL_EXAMPLES, help='one or two examples')
+    parser.add_argument('--size', type=int, default=4, help='size of the examples')
+    parser.add_argument('--method', choices=METHODS, default='auto')
+    parser.add_argument('--probes', type=int, default=DEFAULT_PROBES, help='random states for --method probes')
+    args = parser.parse_args()
+
+    gates_a, qubits_a = KERNEL_EXAMPLES[args.examples[0]](args.size)
+    if len(args.examples) > 1:
+        gates_b, qubits_b = KERNEL_EXAMPLES[args.examples[1]](args.size)
+    else:
+        gates_b, qubits_b = optimize(gates_a)[0], qubits_a
+    result = check_equivalence(gates_a, gates_b, max(qubits_a, qubits_b), args.method, probes=args.probes)
+    print(result)
+    raise SystemExit(0 if result.equivalent else 1)
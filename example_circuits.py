@@ -0,0 +1,128 @@
+from gates import Gate
+from grover import ancillas_needed, grover_gates
+from recording import RecordingCReg, RecordingKernel, RecordingOperation, RecordingProgram
+
+# The circuits of the example scripts as functions of their size, so they can be built at any qubit count.
+# Gate-list builders return (gates, number of qubits of the OpenQL kernel).
+
+
+def deutsch_jozsa_gates(num_qubits):
+    """
+    Deutsch-Jozsa.py: num_qubits - 1 input qubits and one ancilla, with the balanced oracle
+    f(x) = x1 xor x2 xor ... (a cnot from every input to the ancilla).
+    """
+    ancilla = num_qubits - 1
+    gates = [Gate('x', (ancilla,))]
+    gates += [Gate('h', (i,)) for i in range(num_qubits)]
+    gates += [Gate('cnot', (i, ancilla)) for i in range(ancilla)]
+    gates += [Gate('h', (i,)) for i in range(ancilla)]
+    gates += [Gate('measure', (i,)) for i in range(ancilla)]
+    return gates, num_qubits
+
+
+def grover_v1_gates(num_qubits):
+    """
+    Groovers_algorithm.py: one oracle + diffusion pass in which the controlled operations are a single cnot
+    between the last two qubits.
+    """
+    qubits = range(num_qubits)
+    last = num_qubits - 1
+    phase = [Gate('h', (last,)), Gate('cnot', (last - 1, last)), Gate('h', (last,))]
+    gates = [Gate('h', (i,)) for i in qubits]
+    gates += [Gate('x', (i,)) for i in qubits] + phase + [Gate('x', (i,)) for i in qubits]
+    gates += [Gate('h', (i,)) for i in qubits]
+    gates += [Gate('x', (i,)) for i in qubits] + phase + [Gate('x', (i,)) for i in qubits]
+    gates += [Gate('h', (i,)) for i in qubits]
+    gates += [Gate('measure', (i,)) for i in qubits]
+    return gates, num_qubits
+
+
+def grover_v2_gates(num_qubits):
+    """
+    Grover_v2.py: Grover's algorithm with the optimal number of iterations, searching for 2**num_qubits - 1.
+    """
+    return grover_gates(num_qubits, [2 ** num_qubits - 1]), num_qubits + ancillas_needed(num_qubits)
+
+
+def teleportation_gates(chains):
+    """
+    Przykładowa_teleportacja.py (one chain) and Teleport_v2.py (two chains): qubit i is teleported to qubit
+    2*chains + i through qubit chains + i, with the x and z corrections conditioned on the measurement results.
+    """
+    gates = [Gate('prepz', (i,)) for i in range(3 * chains)]
+    for i in range(chains):
+        gates += [Gate('h', (chains + i,)), Gate('cnot', (chains + i, 2 * chains + i))]
+    for i in range(chains):
+        source, middle, target = i, chains + i, 2 * chains + i
+        gates += [Gate('cnot', (source, middle)), Gate('h', (source,)),
+                  Gate('measure', (source,)), Gate('measure', (middle,)),
+                  Gate('x', (target,), None, (middle,)), Gate('z', (target,), None, (source,))]
+    return gates, 3 * chains
+
+
+def lotto_gates(num_qubits):
+    """
+    lotto.py: prepz, Hadamard and measurement on every qubit.
+    """
+    gates = [Gate('prepz', (i,)) for i in range(num_qubits)]
+    gates += [Gate('h', (i,)) for i in range(num_qubits)]
+    gates += [Gate('measure', (i,)) for i in range(num_qubits)]
+    return gates, num_qubits
+
+
+# Example name -> function building the gate list from a size (the number of qubits, or for the
+# teleportation examples a number of qubits that is rounded down to whole chains)
+KERNEL_EXAMPLES = {
+    'deutsch_jozsa': lambda size: deutsch_jozsa_gates(max(size, 2)),
+    'grover_v1': lambda size: grover_v1_gates(max(size, 2)),
+    'grover_v2': lambda size: grover_v2_gates(max(size, 2)),
+    'teleportation': lambda size: teleportation_gates(max(size // 3, 1)),
+    'double_teleportation': lambda size: teleportation_gates(2 * max(size // 6, 1)),
+    'lotto': lambda size: lotto_gates(max(size, 1)),
+}
+
+EXAMPLES = tuple(KERNEL_EXAMPLES) + ('classic_flow_control',)
+
+
+def classic_flow_control_program(platform, num_qubits, loop_count=10):
+    """
+    classic_flow_control.py: if-else, for and do-while blocks acting on qubit 0 of num_qubits qubits.
+    """
+    num_cregs = 10
+    program = RecordingProgram('test_classical', platform, num_qubits, num_cregs)
+    rs1 = RecordingCReg(0)
+    rs2 = RecordingCReg(1)
+
+    def kernel(name, gate_name=None):
+        k = RecordingKernel(name, platform, num_qubits, num_cregs)
+        if gate_name:
+            k.gate(gate_name, [0])
+        return k
+
+    program.add_kernel(kernel('First'))
+    program.add_if_else(kernel('Thenpart', 'x'), kernel('Elsepart', 'y'), RecordingOperation(rs1, '==', rs2))
+    program.add_for(kernel('Loopbody', 'x'), loop_count)
+    program.add_kernel(kernel('Afterloop', 'y'))
+    program.add_do_while(kernel('Dowhileloopbody', 'x'), RecordingOperation(rs1, '<', rs2))
+    program.add_kernel(kernel('Afterdowhile', 'y'))
+    return program
+
+
+def build_program(example, platform, size):
+    """
+    Builds one example as a RecordingProgram.
+
+    :param example: Name from EXAMPLES.
+    :param platform: ql.Platform.
+    :param size: Size of the example (see KERNEL_EXAMPLES).
+    :return: RecordingProgram.
+    """
+    if example == 'classic_flow_control':
+        return classic_flow_control_program(platform, max(size, 1))
+    gates, num_qubits = KERNEL_EXAMPLES[example](size)
+    used = max(qubit for gate in gates for qubit in gate.qubits) + 1
+    kernel = RecordingKernel(example, platform, num_qubits)
+    kernel.add_gates(gates, ancillas=range(used, num_qubits))
+    program = RecordingProgram(example, platform, num_qubits)
+    program.add_kernel(kernel)
+    return program
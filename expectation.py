@@ -0,0 +1,133 @@
+import numpy as np
+
+from sampling import marginal_probabilities
+from scheduler import simulate_layers
+from statevector import DEFAULT_CHUNK_SIZE, simulate, zero_state
+
+# Single-qubit Pauli operators a Pauli string is made of, qubit 0 first
+PAULIS = 'IXYZ'
+
+# How a Pauli acts on a basis state: (P psi)[b] = factor[b] * psi[b ^ flip] for the bit b of its qubit
+_FACTORS = {'X': (1, 1), 'Y': (-1j, 1j), 'Z': (1, -1)}
+_FLIPS = 'XY'
+
+
+def final_state(gates, num_qubits, dtype=np.complex128, path=None, chunk_size=None):
+    """
+    Simulates a recorded circuit once and returns its state before the final measurements.
+
+    The queries of this module read this state instead of sampling shots, so their results are exact and
+    deterministic. Circuits with mid-circuit measurements have no single final state and are rejected.
+
+    :param gates: Recorded gates.
+    :param num_qubits: Number of qubits to simulate.
+    :param dtype: Complex dtype of the amplitudes.
+    :param path: Optional file in which the statevector is kept as a numpy.memmap.
+    :param chunk_size: Optional maximum number of amplitudes processed at a time.
+    :return: Statevector of length 2**num_qubits.
+    """
+    if path is None and chunk_size is None:
+        return simulate_layers(gates, num_qubits, dtype)
+    if path is not None and chunk_size is None:
+        chunk_size = DEFAULT_CHUNK_SIZE
+    return simulate(gates, num_qubits, state=zero_state(num_qubits, dtype, path), chunk_size=chunk_size)
+
+
+def outcome_probability(state, qubits, bits, num_qubits, chunk_size=None):
+    """
+    Exact probability that measuring the given qubits gives the given results.
+
+    :param state: Statevector.
+    :param qubits: Measured qubits.
+    :param bits: Results in the order of the qubits, as a bitstring such as '0110' or a sequence of 0/1.
+    :param num_qubits: Number of qubits of the state.
+    :param chunk_size: Optional maximum number of amplitudes read at a time, for memory-mapped states.
+    :return: Probability as a float.
+    """
+    qubits = list(qubits)
+    bits = [int(bit) for bit in bits]
+    if len(bits) != len(qubits):
+        raise ValueError(f"Expected {len(qubits)} results, got {len(bits)}.")
+    index = int(''.join(map(str, bits)) or '0', 2)
+    return float(marginal_probabilities(state, qubits, num_qubits, chunk_size)[index])
+
+
+def reduced_density_matrix(state, qubits, num_qubits):
+    """
+    Density matrix of a subset of qubits, with the other qubits traced out.
+
+    :param state: Statevector.
+    :param qubits: Qubits to keep, in the order of the rows of the matrix (first qubit most significant).
+    :param num_qubits: Number of qubits of the state.
+    :return: Complex array of shape (2**len(qubits), 2**len(qubits)).
+    """
+    qubits = list(qubits)
+    # Put the kept qubits first; the trace over the others is then a product of the rows with themselves
+    kept = np.moveaxis(state.reshape((2,) * num_qubits), qubits, range(len(qubits))).reshape(2 ** len(qubits), -1)
+    return kept @ kept.conj().T
+
+
+def parse_pauli(pauli, num_qubits=None):
+    """
+    Reads a Pauli string.
+
+    :param pauli: Dense string with one of PAULIS per qubit, qubit 0 first (for example 'ZZI'), or a dictionary
+        mapping qubit to Pauli (for example {0: 'Z', 5: 'X'}).
+    :param num_qubits: Optional number of qubits to check the qubits against.
+    :return: Dictionary mapping qubit to 'X', 'Y' or 'Z'; identities are left out.
+    """
+    items = pauli.items() if isinstance(pauli, dict) else enumerate(pauli)
+    terms = {}
+    for qubit, name in items:
+        name = name.upper()
+        if name not in PAULIS:
+            raise ValueError(f"Unknown Pauli '{name}', expected one of {PAULIS}.")
+        if num_qubits is not None and not 0 <= qubit < num_qubits:
+            raise ValueError(f"Qubit {qubit} out of range for a state of {num_qubits} qubits.")
+        if name != 'I':
+            terms[int(qubit)] = name
+    return terms
+
+
+def expectation(state, pauli, num_qubits, chunk_size=None):
+    """
+    Exact expectation value <psi|P|psi> of a Pauli string.
+
+    Strings of only Z and I are reduced to the marginal distribution of their qubits (so chunk_size works for
+    memory-mapped states). Other strings pair every amplitude with the one whose X/Y qubits are flipped, using a
+    reversed view of the state along those axes, so the state is read once and one temporary is created.
+
+    :param state: Statevector.
+    :param pauli: Pauli string (see parse_pauli()).
+    :param num_qubits: Number of qubits of the state.
+    :param chunk_size: Optional maximum number of amplitudes read at a time, for Z strings.
+    :return: Expectation value as a float in [-1, 1].
+    """
+    terms = parse_pauli(pauli, num_qubits)
+    if not terms:
+        return 1.0
+    qubits = sorted(terms)
+    if all(terms[qubit] == 'Z' for qubit in qubits):
+        probabilities = marginal_probabilities(state, qubits, num_qubits, chunk_size)
+        # Outcome i contributes with the sign of the parity of its bits
+        parity = np.zeros(len(probabilities), dtype=np.int64)
+        for j in range(len(qubits)):
+            parity ^= (np.arange(len(probabilities)) >> j) & 1
+        return float(np.dot(probabilities, 1 - 2 * parity))
+    view = state.reshape((2,) * num_qubits)
+    partner = np.flip(view, axis=[qubit for qubit in qubits if terms[qubit] in _FLIPS])
+    factor = np.ones((1,) * num_qubits, dtype=complex)
+    for qubit in qubits:
+        shape = [1] * num_qubits
+        shape[qubit] = 2
+        factor = factor * np.array(_FACTORS[terms[qubit]]).reshape(shape)
+    return float(np.vdot(view, factor * partner).real)
+
+
+def expectations(state, paulis, num_qubits, chunk_size=None):
+    """
+    Expectation values of several Pauli strings on the same state.
+
+    :return: List of floats, one per string.
+    """
+    return [expectation(state, pauli, num_qubits, chunk_size) for pauli in paulis]
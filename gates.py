@@ -0,0 +1,122 @@
+import collections
+import numpy as np
+
+# A single recorded gate: the OpenQL gate name, the qubits it acts on, an optional parameter
+# (the rotation angle for rx/ry/rz) and an optional condition: a tuple of bit registers that must all
+# hold 1 for the gate to act (measure(q) writes bit register q), used for feed-forward corrections
+Gate = collections.namedtuple('Gate', ['name', 'qubits', 'param', 'condition'], defaults=[None, None])
+
+# OpenQL accepts several spellings for the same gate; everything is stored under one name
+ALIASES = {
+    'hadamard': 'h',
+    'prep_z': 'prepz',
+    'cx': 'cnot',
+    'identity': 'i',
+}
+
+_SQRT_HALF = 1 / np.sqrt(2)
+
+# 2x2 matrices of the fixed single-qubit gates
+SINGLE_QUBIT_GATES = {
+    'i': np.array([[1, 0], [0, 1]], dtype=complex),
+    'h': np.array([[_SQRT_HALF, _SQRT_HALF], [_SQRT_HALF, -_SQRT_HALF]], dtype=complex),
+    'x': np.array([[0, 1], [1, 0]], dtype=complex),
+    'y': np.array([[0, -1j], [1j, 0]], dtype=complex),
+    'z': np.array([[1, 0], [0, -1]], dtype=complex),
+    's': np.array([[1, 0], [0, 1j]], dtype=complex),
+    'sdag': np.array([[1, 0], [0, -1j]], dtype=complex),
+    't': np.array([[1, 0], [0, np.exp(1j * np.pi / 4)]], dtype=complex),
+    'tdag': np.array([[1, 0], [0, np.exp(-1j * np.pi / 4)]], dtype=complex),
+}
+
+# Single-qubit rotations that take an angle
+ROTATION_GATES = ('rx', 'ry', 'rz')
+
+# A 'unitary' gate acts on one qubit and carries its 2x2 matrix as param (produced by the optimizer)
+UNITARY_GATE = 'unitary'
+
+# Gates acting on two or more qubits; 'mcz' flips the phase of the state in which all its qubits are |1>
+# and has no OpenQL equivalent, RecordingKernel.add_gates() lowers it to toffoli gates
+MULTI_QUBIT_GATES = ('cnot', 'cz', 'swap', 'toffoli', 'mcz')
+
+# Operations that are not unitary gates; 'classical' writes a classical register and acts on no qubits,
+# its param is (destination, lhs register, operator, rhs register, constant)
+NON_UNITARY_GATES = ('measure', 'prepz', 'classical')
+
+
+def canonical_name(name):
+    """
+    Returns the name under which a gate is recorded.
+
+    :param name: Gate name as passed to OpenQL.
+    :return: Lower-case canonical gate name.
+    """
+    name = name.lower()
+    return ALIASES.get(name, name)
+
+
+def rotation_matrix(name, angle):
+    """
+    Builds the 2x2 matrix of a rotation gate.
+
+    :param name: One of 'rx', 'ry' or 'rz'.
+    :param angle: Rotation angle in radians.
+    :return: 2x2 complex matrix.
+    """
+    c = np.cos(angle / 2)
+    s = np.sin(angle / 2)
+    if name == 'rx':
+        return np.array([[c, -1j * s], [-1j * s, c]], dtype=complex)
+    if name == 'ry':
+        return np.array([[c, -s], [s, c]], dtype=complex)
+    if name == 'rz':
+        return np.array([[np.exp(-1j * angle / 2), 0], [0, np.exp(1j * angle / 2)]], dtype=complex)
+    raise ValueError(f"Unknown rotation gate '{name}'.")
+
+
+def single_qubit_matrix(gate):
+    """
+    Returns the 2x2 matrix of a single-qubit gate, or None if the gate is not a single-qubit unitary.
+
+    :param gate: Gate to look up.
+    :return: 2x2 complex matrix or None.
+    """
+    if gate.name in SINGLE_QUBIT_GATES:
+        return SINGLE_QUBIT_GATES[gate.name]
+    if gate.name in ROTATION_GATES:
+        return rotation_matrix(gate.name, gate.param)
+    if gate.name == UNITARY_GATE:
+        return np.asarray(gate.param, dtype=complex)
+    return None
+
+
+def gate_to_record(gate):
+    """
+    Converts a gate to JSON-compatible values, for sending it to another process.
+
+    :param gate: Gate.
+    :return: List [name, qubits, param, condition]; a 'unitary' matrix becomes [[re, im], ...] per row.
+    """
+    param = gate.param
+    if isinstance(param, np.ndarray):
+        param = [[[value.real, value.imag] for value in row] for row in param.tolist()]
+    elif isinstance(param, tuple):
+        param = list(param)
+    return [gate.name, list(gate.qubits), param, list(gate.condition) if gate.condition else None]
+
+
+def gate_from_record(record):
+    """
+    Converts the output of gate_to_record() back to a Gate.
+
+    :param record: List [name, qubits, param, condition] (condition may be left out).
+    :return: Gate.
+    """
+    name, qubits, param, *rest = record
+    name = canonical_name(name)
+    if name == UNITARY_GATE:
+        param = np.array([[complex(re, im) for re, im in row] for row in param])
+    elif name == 'classical':
+        param = tuple(param)
+    condition = rest[0] if rest else None
+    return Gate(name, tuple(qubits), param, tuple(condition) if condition else None)
@@ -0,0 +1,187 @@
+import collections
+import functools
+import math
+
+import numpy as np
+
+from gates import Gate
+from recording import RecordingKernel
+
+
+# Results of batch_search(), one entry per query:
+# - found: most frequent outcome over the shots (the most probable outcome when no shots are drawn)
+# - success_probability: exact probability of measuring one of the query's marked states
+# - frequency: fraction of the shots that measured found (None when no shots are drawn)
+BatchResult = collections.namedtuple('BatchResult', ['found', 'success_probability', 'frequency'])
+
+
+def optimal_iterations(num_qubits, num_marked=1):
+    """
+    Number of Grover iterations that maximizes the probability of measuring a marked state.
+
+    :param num_qubits: Number of qubits of the search register.
+    :param num_marked: Number of marked states.
+    :return: floor(pi/4 * sqrt(N/M)) with N = 2**num_qubits and M = num_marked.
+    """
+    return int(math.floor(math.pi / 4 * math.sqrt(2 ** num_qubits / num_marked)))
+
+
+def ancillas_needed(num_qubits):
+    """
+    Number of ancilla qubits the OpenQL kernel needs to decompose the multi-controlled Z gates.
+
+    :param num_qubits: Number of qubits of the search register.
+    :return: Number of extra qubits.
+    """
+    return max(0, num_qubits - 3)
+
+
+@functools.lru_cache(maxsize=None)
+def diffusion_template(num_qubits):
+    """
+    Gates of the diffusion operator (inversion about the mean), built once per register size.
+
+    :param num_qubits: Number of qubits of the search register.
+    :return: Tuple of gates.
+    """
+    qubits = range(num_qubits)
+    return tuple(
+        [Gate('h', (i,)) for i in qubits]
+        + [Gate('x', (i,)) for i in qubits]
+        + [Gate('mcz', tuple(qubits))]
+        + [Gate('x', (i,)) for i in qubits]
+        + [Gate('h', (i,)) for i in qubits]
+    )
+
+
+def oracle_gates(num_qubits, marked):
+    """
+    Gates of the oracle that flips the phase of every marked state.
+
+    A state is given as an integer whose binary digits are the qubits in order, qubit 0 first.
+
+    :param num_qubits: Number of qubits of the search register.
+    :param marked: Marked states.
+    :return: List of gates.
+    """
+    gates = []
+    for value in marked:
+        if not 0 <= value < 2 ** num_qubits:
+            raise ValueError(f"Marked state {value} does not fit in {num_qubits} qubits.")
+        flips = [Gate('x', (i,)) for i, bit in enumerate(format(value, f'0{num_qubits}b')) if bit == '0']
+        gates += flips + [Gate('mcz', tuple(range(num_qubits)))] + flips
+    return gates
+
+
+def grover_gates(num_qubits, marked, iterations=None, measure=True):
+    """
+    Builds the full gate list of Grover's algorithm.
+
+    One iteration (oracle followed by the diffusion template) is built once and repeated, so the cost is
+    proportional to the number of gates and independent of how the iterations are constructed.
+
+    :param num_qubits: Number of qubits of the search register.
+    :param marked: Marked states.
+    :param iterations: Number of iterations; defaults to optimal_iterations().
+    :param measure: Whether to measure all qubits at the end.
+    :return: List of gates.
+    """
+    marked = sorted(set(marked))
+    if iterations is None:
+        iterations = optimal_iterations(num_qubits, len(marked))
+    iteration = oracle_gates(num_qubits, marked) + list(diffusion_template(num_qubits))
+    gates = [Gate('h', (i,)) for i in range(num_qubits)] + iteration * iterations
+    if measure:
+        gates += [Gate('measure', (i,)) for i in range(num_qubits)]
+    return gates
+
+
+def build_grover_kernel(platform, num_qubits, marked, iterations=None, name='grover', gates=None):
+    """
+    Creates a RecordingKernel running Grover's algorithm.
+
+    The kernel has num_qubits + ancillas_needed(num_qubits) qubits. Its recorded gates use only the first
+    num_qubits qubits, so it can be simulated with num_qubits qubits.
+
+    :param platform: ql.Platform to create the kernel for.
+    :param num_qubits: Number of qubits of the search register.
+    :param marked: Marked states.
+    :param iterations: Number of iterations; defaults to optimal_iterations().
+    :param name: Name of the kernel.
+    :param gates: Gate list to use instead of grover_gates(), for example an optimized copy of it.
+    :return: RecordingKernel.
+    """
+    if gates is None:
+        gates = grover_gates(num_qubits, marked, iterations)
+    ancillas = range(num_qubits, num_qubits + ancillas_needed(num_qubits))
+    kernel = RecordingKernel(name, platform, num_qubits + len(ancillas))
+    kernel.add_gates(gates, ancillas)
+    return kernel
+
+
+def batch_search(num_qubits, queries, iterations=None, shots=None, rng=None, max_amplitudes=1 << 22):
+    """
+    Simulates Grover's algorithm for many queries over the same register at once.
+
+    Every query only changes the oracle, so the gates are not built at all: the amplitudes of all queries are
+    kept as one real array of shape (queries, 2**n), the oracle negates the marked entries of every row and the
+    diffusion operator is applied in closed form as the reflection a -> 2 * mean(a) - a of every row (the gate
+    template does the same up to a global phase). Queries are processed in chunks of about max_amplitudes
+    amplitudes.
+
+    :param num_qubits: Number of qubits of the search register.
+    :param queries: Sequence of queries; each is a marked state or a sequence of marked states.
+    :param iterations: Number of iterations for every query; defaults to optimal_iterations() for the number of
+        marked states of each query.
+    :param shots: Optional number of shots to draw per query.
+    :param rng: Optional numpy.random.Generator.
+    :param max_amplitudes: Approximate number of amplitudes simulated at once.
+    :return: BatchResult of arrays with one entry per query.
+    """
+    rng = rng or np.random.default_rng()
+    size = 2 ** num_qubits
+    marked = [sorted(set(query)) if np.ndim(query) else [query] for query in queries]
+    for values in marked:
+        for value in values:
+            if not 0 <= value < size:
+                raise ValueError(f"Marked state {value} does not fit in {num_qubits} qubits.")
+    if iterations is None:
+        counts = np.array([optimal_iterations(num_qubits, len(values)) for values in marked], dtype=np.int64)
+    else:
+        counts = np.full(len(marked), iterations, dtype=np.int64)
+    found = np.empty(len(marked), dtype=np.int64)
+    success = np.empty(len(marked))
+    frequency = None if shots is None else np.empty(len(marked))
+    batch = max(1, max_amplitudes // size)
+    for first in range(0, len(marked), batch):
+        chunk = slice(first, min(first + batch, len(marked)))
+        rows = len(marked[chunk])
+        mask = np.zeros((rows, size), dtype=bool)
+        for row, values in enumerate(marked[chunk]):
+            mask[row, values] = True
+        states = np.full((rows, size), 1 / math.sqrt(size))
+        for step in range(counts[chunk].max(initial=0)):
+            # Queries that need fewer iterations than others in the chunk stop early
+            active = counts[chunk] > step
+            if not active.all():
+                states[active] = _grover_iteration(states[active], mask[active])
+            else:
+                _grover_iteration(states, mask)
+        probabilities = states ** 2
+        success[chunk] = np.where(mask, probabilities, 0).sum(axis=1)
+        if shots is None:
+            found[chunk] = probabilities.argmax(axis=1)
+        else:
+            histograms = rng.multinomial(shots, probabilities / probabilities.sum(axis=1, keepdims=True))
+            found[chunk] = histograms.argmax(axis=1)
+            frequency[chunk] = histograms[np.arange(rows), found[chunk]] / shots
+    return BatchResult(found, success, frequency)
+
+
+def _grover_iteration(states, mask):
+    # Oracle: flip the sign of the marked amplitudes; diffusion: reflect every row about its mean
+    np.negative(states, out=states, where=mask)
+    mean = states.mean(axis=1, keepdims=True)
+    states *= -1
+    states += 2 * mean
+    return states
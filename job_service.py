@@ -0,0 +1,200 @@
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import os
+
+import session
+from parallel import CircuitJob, compile_job, init_worker, job_from_kernel, simulate_job
+
+# Jobs accepted but not yet started; submit() waits while the queue is full
+DEFAULT_MAX_PENDING = 64
+
+
+class JobService:
+    """
+    Runs circuit jobs concurrently from asyncio code.
+
+    Jobs wait in a bounded queue and are taken by a fixed number of runners. Compilation runs on a pool of worker
+    processes, because OpenQL options are global to a process, and simulation runs on a thread pool, where NumPy
+    releases the GIL for the large array operations. The compilation and the simulation of a job run at the same
+    time (the simulator does not need the compiled output), and so do the stages of different jobs:
+
+        async with JobService() as service:
+            future = await service.submit(kernel, shots=1000)
+            result = await future
+
+    A result is the dictionary of parallel.run_job().
+    """
+
+    def __init__(self, max_pending=DEFAULT_MAX_PENDING, compile_workers=None, simulate_workers=None,
+                 output_dir=session.DEFAULT_OUTPUT_DIR, log_level=None):
+        """
+        :param max_pending: Number of jobs that may wait for a runner before submit() blocks.
+        :param compile_workers: Number of compiler processes; defaults to the number of CPUs.
+        :param simulate_workers: Number of simulator threads; defaults to the number of CPUs.
+        :param output_dir: Directory for the compiled output.
+        :param log_level: OpenQL log level in the compiler processes.
+        """
+        self.max_pending = max_pending
+        self.compile_workers = compile_workers or os.cpu_count()
+        self.simulate_workers = simulate_workers or os.cpu_count()
+        self.output_dir = output_dir
+        self.log_level = log_level
+        self._queue = None
+        self._runners = []
+        self._compile_executor = None
+        self._simulate_executor = None
+
+    async def start(self):
+        """
+        Starts the executors and the runners; called by async with.
+        """
+        self._queue = asyncio.Queue(self.max_pending)
+        self._compile_executor = concurrent.futures.ProcessPoolExecutor(
+            self.compile_workers, initializer=init_worker, initargs=(self.output_dir, self.log_level))
+        self._simulate_executor = concurrent.futures.ThreadPoolExecutor(self.simulate_workers)
+        # Enough runners to keep both executors busy
+        self._runners = [asyncio.create_task(self._run()) for _ in range(self.compile_workers + self.simulate_workers)]
+
+    async def close(self):
+        """
+        Finishes the submitted jobs, then stops the runners and the executors.
+        """
+        await self._queue.join()
+        for runner in self._runners:
+            runner.cancel()
+        await asyncio.gather(*self._runners, return_exceptions=True)
+        self._runners = []
+        self._compile_executor.shutdown()
+        self._simulate_executor.shutdown()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def submit(self, job, shots=1000, compile=True):
+        """
+        Queues a job, waiting while max_pending jobs are already waiting.
+
+        :param job: CircuitJob, or a RecordingKernel that is turned into one with the given shots and compile.
+        :param shots: Number of shots to simulate for a kernel; 0 to only compile.
+        :param compile: Whether a kernel is compiled.
+        :return: asyncio.Future that is resolved with the result of the job, or with the error it raised.
+        """
+        if not isinstance(job, CircuitJob):
+            job = job_from_kernel(job, shots, compile)
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((job, future))
+        return future
+
+    async def gather(self, jobs, shots=1000, compile=True):
+        """
+        Submits many jobs and waits for all of them.
+
+        :param jobs: Iterable of CircuitJob or RecordingKernel.
+        :return: List of results in the same order as the jobs.
+        """
+        futures = [await self.submit(job, shots, compile) for job in jobs]
+        return await asyncio.gather(*futures)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job, future = await self._queue.get()
+            try:
+                stages = []
+                if job.compile:
+                    stages.append(loop.run_in_executor(self._compile_executor, compile_job, job))
+                if job.shots:
+                    stages.append(loop.run_in_executor(self._simulate_executor, simulate_job, job))
+                outcomes = await asyncio.gather(*stages)
+                result = {'name': job.name}
+                if job.compile:
+                    result['cached'] = outcomes.pop(0)
+                if job.shots:
+                    result['counts'] = outcomes.pop(0)
+                if not future.cancelled():
+                    future.set_result(result)
+            except Exception as error:  # The error belongs to the job; the runner keeps going
+                if not future.cancelled():
+                    future.set_exception(error)
+            finally:
+                self._queue.task_done()
+
+
+async def _handle_connection(service, reader, writer):
+    # Jobs of one connection are submitted as soon as they are read and answered in the order they were sent
+    answers = asyncio.Queue()
+
+    async def respond():
+        while True:
+            future = await answers.get()
+            if future is None:
+                return
+            try:
+                result = await future
+            except Exception as error:
+                result = {'error': f'{type(error).__name__}: {error}'}
+            writer.write((json.dumps(result) + '\n').encode())
+            await writer.drain()
+
+    responder = asyncio.create_task(respond())
+    try:
+        async for line in reader:
+            if not line.strip():
+                continue
+            try:
+                future = await service.submit(session.job_from_record(json.loads(line)))
+            except Exception as error:  # A malformed job is answered with its error
+                future = asyncio.get_running_loop().create_future()
+                future.set_exception(error)
+            await answers.put(future)
+    finally:
+        await answers.put(None)
+        await responder
+        writer.close()
+
+
+async def serve(path, max_pending=DEFAULT_MAX_PENDING, compile_workers=None, simulate_workers=None,
+                output_dir=session.DEFAULT_OUTPUT_DIR, log_level=None):
+    """
+    Runs a JobService behind a Unix socket until cancelled.
+
+    The protocol is the one of session.serve(), so session.submit() is the client: every line is one job (see
+    session.job_from_record()) and is answered by one JSON line, in the order of the jobs of the connection. Unlike
+    session.serve() the jobs of all connections run concurrently, and a connection that sends jobs faster than
+    they run is slowed down by the bounded queue.
+
+    :param path: File name of the socket; an existing socket file is replaced.
+    """
+    if os.path.exists(path):
+        os.unlink(path)
+    async with JobService(max_pending, compile_workers, simulate_workers, output_dir, log_level) as service:
+        server = await asyncio.start_unix_server(lambda reader, writer: _handle_connection(service, reader, writer),
+                                                 path)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            os.unlink(path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Service that compiles and simulates circuit jobs concurrently.')
+    parser.add_argument('socket', help='socket file to listen on; send jobs with session.py SOCKET --submit JOBS')
+    parser.add_argument('--max-pending', type=int, default=DEFAULT_MAX_PENDING, help='jobs queued before clients wait')
+    parser.add_argument('--compile-workers', type=int, help='number of compiler processes')
+    parser.add_argument('--simulate-workers', type=int, help='number of simulator threads')
+    parser.add_argument('--output-dir', default=session.DEFAULT_OUTPUT_DIR, help='directory for the compiled output')
+    parser.add_argument('--log-level', help=f'OpenQL log level (default {session.DEFAULT_LOG_LEVEL})')
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args.socket, args.max_pending, args.compile_workers, args.simulate_workers,
+                          args.output_dir, args.log_level))
+    except KeyboardInterrupt:
+        pass
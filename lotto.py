@@ -1,16 +1,21 @@
 import openql as ql
-import random
-
-# Initialize the OpenQL framework
-ql.initialize()
-
-# Set the directory for output files
-ql.set_option('output_dir', 'output')
-# Set the logging level to display informational messages
-ql.set_option('log_level', 'LOG_INFO')
-
-# Define a quantum computing platform with a name and specify no configuration file
-platform = ql.Platform('my_platform', 'none')
+import argparse
+from batch_input import read_records, write_record
+from circuit import Circuit
+from lotto_draws import QuantumLottoDrawer
+from session import get_platform
+
+# Read the command line; without tickets the script asks for the numbers interactively
+parser = argparse.ArgumentParser(description='Quantum Lotto.')
+parser.add_argument('--ticket', action='append', default=[],
+                    help='six comma-separated numbers, may be given several times')
+parser.add_argument('--input', help="JSONL or CSV file with one ticket per line, '-' for stdin")
+parser.add_argument('--format', choices=['jsonl', 'csv'], help='format of the input file')
+args = parser.parse_args()
+batch_mode = bool(args.ticket or args.input)
+
+# Get the platform shared by all scripts (see session.get_platform() for the OpenQL settings)
+platform = get_platform()
 
 # Define the number of qubits needed for the quantum program
 num_qubits = 6  # We are using 6 qubits to represent random numbers for the Lotto game
@@ -18,20 +23,20 @@ num_qubits = 6  # We are using 6 qubits to represent random numbers for the Lott
 # Create a quantum program named 'quantum_lotto' for the defined platform
 program = ql.Program('quantum_lotto', platform, num_qubits)
 
-# Create the quantum kernel for the Lotto simulation
-kernel = ql.Kernel('lotto', platform, num_qubits)
+# Describe the Lotto circuit; every step acts on all qubits at once
+circuit = Circuit(num_qubits, 'lotto')
 
 # Step 1: Initialize all qubits to the |0⟩ state
-for i in range(num_qubits):
-    kernel.prepz(i)  # Prepare each qubit i in the zero state
+circuit.layer('prepz')  # Prepare every qubit in the zero state
 
 # Step 2: Apply Hadamard gate to put qubits into superposition
-for i in range(num_qubits):
-    kernel.gate('h', [i])  # Apply Hadamard gate to qubit i to create a superposition
+circuit.layer('h')  # Apply a Hadamard gate to every qubit to create a superposition
 
 # Step 3: Measure the qubits to get a random number
-for i in range(num_qubits):
-    kernel.measure(i)  # Measure each qubit i to collapse its state and get a random bit
+circuit.layer('measure')  # Measure every qubit to collapse its state and get a random bit
+
+# Create the quantum kernel for the Lotto simulation from the circuit
+kernel = circuit.kernel(platform)  # Only this step adds the gates to OpenQL
 
 # Add the kernel to the program
 program.add_kernel(kernel)
@@ -39,18 +44,16 @@ program.add_kernel(kernel)
 # Compile the quantum program
 program.compile()
 
-print("Compiled quantum Lotto program.")
+if not batch_mode:
+    print("Compiled quantum Lotto program.")  # Batch mode keeps stdout for the JSON results
 
-# Simulate running the compiled quantum program (hypothetical execution)
-# Normally, this would be run on a quantum simulator or quantum hardware
+# Simulate the compiled lotto kernel once; the drawer samples its measurement outcomes in large
+# buffered blocks and turns them into numbers between 1 and 49
+drawer = QuantumLottoDrawer(kernel.gates, num_qubits)
 
 # Function to generate random Lotto numbers using quantum principles
 def generate_quantum_lotto_numbers():
-    random_numbers = set()
-    while len(random_numbers) < 6:  # Ensure we get 6 unique random numbers
-        random_number = random.randint(1, 49)  # Generate a random number between 1 and 49
-        random_numbers.add(random_number)  # Add the number to the set (duplicates are automatically handled)
-    return list(random_numbers)
+    return drawer.draw(1)[0].tolist()  # Draw one ticket of 6 unique numbers from the simulated measurements
 
 # Function to get user input for their chosen Lotto numbers
 def get_user_lotto_numbers():
@@ -68,21 +71,63 @@ def get_user_lotto_numbers():
             print("Invalid input. Please enter a valid number.")  # Handle non-integer inputs
     return list(user_numbers)
 
-# Get user-chosen numbers
-user_lotto_numbers = get_user_lotto_numbers()
-print("Your chosen numbers are:", user_lotto_numbers)
-
-# Generate quantum random numbers for the Lotto draw
-quantum_lotto_numbers = generate_quantum_lotto_numbers()
-print("Quantum Lotto Numbers are:", quantum_lotto_numbers)
-
-# Compare user numbers with quantum numbers
-matched_numbers = set(user_lotto_numbers).intersection(set(quantum_lotto_numbers))
-print("Matched Numbers:", matched_numbers)
-print(f"You have {len(matched_numbers)} matched numbers.")
-
-# Determine the result based on the number of matches
-if len(matched_numbers) == 6:
-    print("Congratulations! You've won the Lotto!")  # User wins if all 6 numbers match
+# Function to check that a ticket has 6 unique numbers between 1 and 49
+# A ticket is a list of numbers or a {"numbers": [...]} object
+def validate_ticket(ticket):
+    if isinstance(ticket, dict):
+        if 'numbers' not in ticket:
+            raise ValueError(f"A ticket record needs a 'numbers' field, got {ticket}.")
+        ticket = ticket['numbers']
+    try:
+        numbers = [int(number) for number in ticket]
+    except (TypeError, ValueError):
+        raise ValueError(f"A ticket needs 6 unique numbers between 1 and 49, got {ticket}.")
+    if len(numbers) != 6 or len(set(numbers)) != 6 or not all(1 <= number <= 49 for number in numbers):
+        raise ValueError(f"A ticket needs 6 unique numbers between 1 and 49, got {numbers}.")
+    return numbers
+
+# Function to read the tickets of a batch run
+# Tickets come from --ticket first and then from --input; input records may be JSON lists,
+# {"numbers": [...]} objects or CSV rows
+def batch_tickets():
+    for ticket in args.ticket:
+        yield ticket.split(',')
+    if args.input:
+        for record in read_records(args.input, args.format):
+            yield record  # Checked by validate_ticket() like the tickets from the command line
+
+if batch_mode:
+    # Batch mode: draw once per ticket in this process and stream one JSON line per ticket
+    for ticket in batch_tickets():
+        try:
+            user_lotto_numbers = validate_ticket(ticket)
+        except ValueError as error:
+            write_record({'ticket': ticket, 'error': str(error)})  # Report invalid tickets and continue
+            continue
+        quantum_lotto_numbers = generate_quantum_lotto_numbers()
+        matched_numbers = set(user_lotto_numbers).intersection(quantum_lotto_numbers)
+        write_record({
+            'ticket': user_lotto_numbers,
+            'draw': quantum_lotto_numbers,
+            'matched': sorted(matched_numbers),
+            'won': len(matched_numbers) == 6,
+        })
 else:
-    print("Better luck next time!")  # User loses if fewer than 6 numbers match
+    # Get user-chosen numbers
+    user_lotto_numbers = get_user_lotto_numbers()
+    print("Your chosen numbers are:", user_lotto_numbers)
+
+    # Generate quantum random numbers for the Lotto draw
+    quantum_lotto_numbers = generate_quantum_lotto_numbers()
+    print("Quantum Lotto Numbers are:", quantum_lotto_numbers)
+
+    # Compare user numbers with quantum numbers
+    matched_numbers = set(user_lotto_numbers).intersection(set(quantum_lotto_numbers))
+    print("Matched Numbers:", matched_numbers)
+    print(f"You have {len(matched_numbers)} matched numbers.")
+
+    # Determine the result based on the number of matches
+    if len(matched_numbers) == 6:
+        print("Congratulations! You've won the Lotto!")  # User wins if all 6 numbers match
+    else:
+        print("Better luck next time!")  # User loses if fewer than 6 numbers match
@@ -0,0 +1,106 @@
+import numpy as np
+
+from sampling import measurement_distribution
+
+
+class QuantumLottoDrawer:
+    """
+    Draws Lotto numbers from simulated measurements of the lotto kernel.
+
+    The kernel is simulated once. Measurement outcomes are then drawn in large blocks into a buffer and
+    consumed from there, and every outcome is mapped to a number by rejection sampling: outcomes above the
+    highest number are thrown away. Rejection keeps the numbers equally likely only if the kernel's outcomes
+    are (as for the lotto kernel, a Hadamard on every qubit); any other kernel is sampled from its own
+    distribution, so its numbers are drawn with the relative probabilities of their outcomes.
+    """
+
+    def __init__(self, gates, num_qubits, highest=49, pool_size=1 << 20, rng=None):
+        """
+        :param gates: Recorded gates of the lotto kernel.
+        :param num_qubits: Number of qubits of the kernel.
+        :param highest: Highest Lotto number; numbers are drawn from 1..highest.
+        :param pool_size: Number of measurement outcomes generated per refill of the buffer.
+        :param rng: Optional numpy.random.Generator.
+        """
+        self.probabilities, measured = measurement_distribution(gates, num_qubits)
+        if 2 ** len(measured) < highest:
+            raise ValueError(f"{len(measured)} measured qubits cannot represent numbers up to {highest}.")
+        self.highest = highest
+        self.pool_size = pool_size
+        self.rng = rng or np.random.default_rng()
+        # A Hadamard layer followed by measurement gives every outcome the same probability; outcomes can then
+        # be drawn as plain random integers, which is much faster than sampling a general distribution
+        self.uniform = np.allclose(self.probabilities, 1 / len(self.probabilities))
+        self._pool = np.empty(0, dtype=np.int64)
+        self._position = 0
+
+    def outcomes(self, count):
+        """
+        Takes measurement outcomes from the buffer, refilling it when it runs out.
+
+        :param count: Number of outcomes.
+        :return: int64 array of outcome indices.
+        """
+        parts = []
+        while count > 0:
+            if self._position == len(self._pool):
+                size = max(self.pool_size, count)
+                if self.uniform:
+                    self._pool = self.rng.integers(0, len(self.probabilities), size=size)
+                else:
+                    self._pool = self.rng.choice(len(self.probabilities), size=size, p=self.probabilities)
+                self._position = 0
+            part = self._pool[self._position:self._position + count]
+            self._position += len(part)
+            count -= len(part)
+            parts.append(part)
+        return np.concatenate(parts) if len(parts) != 1 else parts[0]
+
+    def draw(self, tickets, numbers=6, chunk_size=1 << 18):
+        """
+        Draws many tickets of unique numbers.
+
+        Each ticket gets a row of candidate outcomes that is scanned column by column for all tickets at once.
+        Outcomes above the highest number and numbers the ticket already has are rejected; the numbers seen
+        so far are kept as a bit mask per ticket. The rare tickets that are still incomplete at the end of
+        the row are drawn again.
+
+        :param tickets: Number of tickets.
+        :param numbers: Numbers per ticket.
+        :param chunk_size: Number of tickets processed at once, which bounds the memory used.
+        :return: Array of shape (tickets, numbers) with values in 1..highest, in the order they were drawn.
+        """
+        if numbers > self.highest:
+            raise ValueError(f"Cannot draw {numbers} unique numbers from 1..{self.highest}.")
+        if self.highest > 63:
+            raise ValueError("The bit mask of drawn numbers supports numbers up to 63.")
+        if np.count_nonzero(self.probabilities[:self.highest]) < numbers:
+            raise ValueError(f"The kernel measures fewer than {numbers} different numbers in 1..{self.highest}.")
+        result = np.empty((tickets, numbers), dtype=np.int64)
+        for start in range(0, tickets, chunk_size):
+            stop = min(start + chunk_size, tickets)
+            result[start:stop] = self._draw_chunk(stop - start, numbers)
+        return result
+
+    def _draw_chunk(self, tickets, numbers):
+        # Enough candidates per row that retries are rare: expected need is a bit over numbers / acceptance rate
+        acceptance = self.highest / len(self.probabilities)
+        candidates_per_row = int(np.ceil(1.5 * numbers / acceptance)) + 2
+        # Bit of every candidate value in the mask of seen numbers; rejected values get no bit
+        bits = np.left_shift(np.uint64(1), np.arange(len(self.probabilities) + 1, dtype=np.uint64))
+        bits[self.highest + 1:] = 0
+        result = np.empty((tickets, numbers), dtype=np.int64)
+        pending = np.arange(tickets)
+        while len(pending):
+            values = self.outcomes(len(pending) * candidates_per_row).reshape(len(pending), -1) + 1
+            seen = np.zeros(len(pending), dtype=np.uint64)
+            count = np.zeros(len(pending), dtype=np.int64)
+            for column in values.T:
+                bit = bits[column]
+                accept = ((seen & bit) == 0) & (bit != 0) & (count < numbers)
+                rows = np.flatnonzero(accept)
+                result[pending[rows], count[rows]] = column[rows]
+                seen[rows] |= bit[rows]
+                count[rows] += 1
+            pending = pending[count < numbers]
+        return result
@@ -0,0 +1,486 @@
+import collections
+
+import numpy as np
+
+from gates import Gate, SINGLE_QUBIT_GATES, single_qubit_matrix
+from profiling import span
+from sampling import counts_from_bits, counts_from_probabilities
+from statevector import apply_gate, apply_matrix, zero_state
+
+# Error rates of a noisy device. After every gate each qubit the gate acts on goes through a depolarizing channel
+# (probability depolarizing for single-qubit gates and two_qubit_depolarizing, which defaults to depolarizing, for
+# gates on several qubits) and then an amplitude-damping channel with decay probability amplitude_damping.
+# Every measurement result is flipped with probability readout_error. measure and prepz get no gate noise.
+NoiseModel = collections.namedtuple('NoiseModel',
+                                    ['depolarizing', 'two_qubit_depolarizing', 'amplitude_damping', 'readout_error'],
+                                    defaults=[0.0, None, 0.0, 0.0])
+
+# Engines sample_noisy_counts() can use; 'auto' picks the density matrix when it is cheaper than the trajectories
+METHODS = ('auto', 'density_matrix', 'trajectories')
+
+# Largest register simulated as a density matrix by 'auto' (4**12 amplitudes take 256 MiB)
+DENSITY_MATRIX_MAX_QUBITS = 12
+
+# Projectors on |0> and |1>: the Kraus operators of a measurement
+_PROJECTORS = (np.array([[1, 0], [0, 0]], dtype=complex), np.array([[0, 0], [0, 1]], dtype=complex))
+
+# Kraus operators of prepz: whatever was measured, the qubit ends up in |0>
+_RESET = (_PROJECTORS[0], np.array([[0, 1], [0, 0]], dtype=complex))
+
+
+def depolarizing_kraus(probability):
+    """
+    Kraus operators of the single-qubit depolarizing channel, which applies x, y or z each with probability p/3.
+    """
+    return ([np.sqrt(1 - probability) * SINGLE_QUBIT_GATES['i']]
+            + [np.sqrt(probability / 3) * SINGLE_QUBIT_GATES[name] for name in ('x', 'y', 'z')])
+
+
+def amplitude_damping_kraus(gamma):
+    """
+    Kraus operators of the amplitude-damping channel, which lets |1> decay to |0> with probability gamma.
+    """
+    return [np.array([[1, 0], [0, np.sqrt(1 - gamma)]], dtype=complex),
+            np.array([[0, np.sqrt(gamma)], [0, 0]], dtype=complex)]
+
+
+def gate_noise(gate, noise):
+    """
+    Channels applied to every qubit of a gate after it.
+
+    :param gate: Recorded unitary gate.
+    :param noise: NoiseModel.
+    :return: List of channels, each a list of 2x2 Kraus operators.
+    """
+    depolarizing = noise.depolarizing
+    if len(gate.qubits) > 1 and noise.two_qubit_depolarizing is not None:
+        depolarizing = noise.two_qubit_depolarizing
+    channels = []
+    if depolarizing:
+        channels.append(depolarizing_kraus(depolarizing))
+    if noise.amplitude_damping:
+        channels.append(amplitude_damping_kraus(noise.amplitude_damping))
+    return channels
+
+
+def _with_final_measurements(gates, num_qubits):
+    # Like the other simulators, a circuit without measurements is measured on all qubits at the end
+    if any(gate.name == 'measure' for gate in gates):
+        return gates
+    return list(gates) + [Gate('measure', (qubit,)) for qubit in range(num_qubits)]
+
+
+class DensityMatrixSimulator:
+    """
+    Exact simulation of a noisy circuit on density matrices.
+
+    A density matrix rho of n qubits is stored as a statevector of 2n qubits (qubit q of the rows is qubit q,
+    qubit q of the columns is qubit n + q), so U rho U^dagger is the gate U on the first n qubits followed by
+    conj(U) on the last n, and the statevector routines do the work. Like the BranchingSimulator, the state is
+    split per recorded measurement result when a later gate touches the qubit or reads the result; branches are
+    not normalized (the trace of a branch is its probability). Memory grows as 4**n, independent of the shots.
+    """
+
+    def __init__(self, num_qubits, noise=None, state=None, dtype=np.complex128, tolerance=1e-12):
+        """
+        :param num_qubits: Number of qubits.
+        :param noise: NoiseModel; defaults to no noise.
+        :param state: Optional initial pure statevector; defaults to |00...0>.
+        :param dtype: Complex dtype of the amplitudes when no state is given.
+        :param tolerance: Branches whose probability is below this are dropped.
+        """
+        if state is None:
+            state = zero_state(num_qubits, dtype)
+        self.num_qubits = num_qubits
+        self.noise = noise or NoiseModel()
+        self.tolerance = tolerance
+        self.states = np.outer(state, np.conj(state)).reshape(1, -1)  # Shape (branches, 4**num_qubits)
+        self.outcomes = np.zeros((1, 0), dtype=np.int8)  # Recorded results, -1 if not split yet
+        self.measured = []  # Qubit of every measurement, in the order they were made
+        self._pending = {}  # Qubit -> measurement that has not been split yet
+        self._bregs = {}  # Bit register -> measurement that last wrote it
+
+    def run(self, gates):
+        """
+        Applies a list of recorded gates.
+
+        :return: self.
+        """
+        for gate in gates:
+            self.apply(gate)
+        return self
+
+    def apply(self, gate):
+        """
+        Applies one recorded gate, measurement or reset, followed by the gate noise, to every branch.
+        """
+        if gate.name == 'measure':
+            qubit = gate.qubits[0]
+            self._resolve(qubit)
+            self._pending[qubit] = self._bregs[qubit] = len(self.measured)
+            self.measured.append(qubit)
+            self.outcomes = np.concatenate([self.outcomes, np.full((len(self.outcomes), 1), -1, np.int8)], axis=1)
+            return
+        if gate.name == 'prepz':
+            self._resolve(gate.qubits[0])
+            self.states = self._channel(self.states, _RESET, gate.qubits[0])
+            return
+        for qubit in gate.qubits:
+            self._resolve(qubit)
+        if not gate.condition:
+            self.states = self._gate(self.states, gate)
+            return
+        # Bit registers that were never written hold 0, so the gate does not act anywhere
+        if not all(breg in self._bregs for breg in gate.condition):
+            return
+        for breg in gate.condition:
+            self._resolve(self.measured[self._bregs[breg]])
+        active = np.all(self.outcomes[:, [self._bregs[breg] for breg in gate.condition]] == 1, axis=1)
+        if active.any():
+            self.states[active] = self._gate(self.states[active], gate._replace(condition=None))
+
+    def _gate(self, states, gate):
+        n = self.num_qubits
+        matrix = single_qubit_matrix(gate)
+        apply_gate(states, gate, 2 * n)
+        if matrix is not None:
+            apply_matrix(states, matrix.conj(), gate.qubits[0] + n, 2 * n)
+        else:
+            # The multi-qubit gates are real, so conj(U) is U on the column qubits
+            apply_gate(states, gate._replace(qubits=tuple(q + n for q in gate.qubits)), 2 * n)
+        for kraus in gate_noise(gate, self.noise):
+            for qubit in gate.qubits:
+                states = self._channel(states, kraus, qubit)
+        return states
+
+    def _channel(self, states, kraus, qubit):
+        """
+        Applies the channel rho -> sum K rho K^dagger to one qubit of every branch.
+        """
+        result = np.zeros_like(states)
+        for operator in kraus:
+            term = states.copy()
+            apply_matrix(term, operator, qubit, 2 * self.num_qubits)
+            apply_matrix(term, operator.conj(), qubit + self.num_qubits, 2 * self.num_qubits)
+            result += term
+        return result
+
+    def _project(self, states, qubit, value):
+        term = states.copy()
+        apply_matrix(term, _PROJECTORS[value], qubit, 2 * self.num_qubits)
+        apply_matrix(term, _PROJECTORS[value], qubit + self.num_qubits, 2 * self.num_qubits)
+        return term
+
+    def _resolve(self, qubit):
+        """
+        Splits the pending measurement of a qubit, if any, into one branch per recorded result.
+
+        With a readout error e the branch that recorded 0 holds (1 - e) P0 rho P0 + e P1 rho P1, and the other
+        one the rest, so the number of branches only depends on the recorded results.
+        """
+        column = self._pending.pop(qubit, None)
+        if column is None:
+            return
+        error = self.noise.readout_error
+        zero = self._project(self.states, qubit, 0)
+        one = self._project(self.states, qubit, 1)
+        states = np.concatenate([(1 - error) * zero + error * one, error * zero + (1 - error) * one])
+        outcomes = np.concatenate([self.outcomes, self.outcomes])
+        outcomes[:, column] = np.repeat([0, 1], len(self.states))
+        keep = self.probabilities_of(states) > self.tolerance
+        self.states = np.ascontiguousarray(states[keep])
+        self.outcomes = outcomes[keep]
+
+    def probabilities_of(self, states):
+        """
+        Probability (trace) of every branch of a batch of vectorized density matrices.
+        """
+        size = 2 ** self.num_qubits
+        return states.reshape(len(states), size, size).diagonal(axis1=1, axis2=2).real.sum(axis=1)
+
+    def density_matrices(self):
+        """
+        The branch density matrices, not normalized.
+
+        :return: Array of shape (branches, 2**num_qubits, 2**num_qubits).
+        """
+        size = 2 ** self.num_qubits
+        return self.states.reshape(len(self.states), size, size)
+
+    def outcome_distribution(self):
+        """
+        Distribution of the recorded results of all measurements, including readout errors.
+
+        :return: Array of length 2**len(self.measured); index i is the outcome whose binary digits give the
+            recorded results in the order the measurements were made.
+        """
+        n = self.num_qubits
+        count = len(self.states)
+        num_measurements = len(self.measured)
+        columns = sorted(self._pending.values())
+        qubits = [self.measured[column] for column in columns]
+        # Distribution of the pending measurements inside every branch, from the diagonal of the density matrix
+        diagonal = np.maximum(self.density_matrices().diagonal(axis1=1, axis2=2).real, 0)
+        others = tuple(1 + q for q in range(n) if q not in qubits)
+        marginal = diagonal.reshape((count,) + (2,) * n).sum(axis=others)
+        order = sorted(qubits)
+        marginal = marginal.transpose([0] + [1 + order.index(q) for q in qubits])
+        error = self.noise.readout_error
+        for axis in range(1, marginal.ndim):
+            marginal = (1 - error) * marginal + error * np.flip(marginal, axis=axis)
+        marginal = marginal.reshape(count, 2 ** len(qubits))
+        # Outcome index of every (branch, pending result) pair
+        weights = 1 << (num_measurements - 1 - np.arange(num_measurements))
+        base = np.where(self.outcomes > 0, weights, 0).sum(axis=1)
+        results = np.arange(2 ** len(qubits))
+        offsets = np.zeros(len(results), dtype=np.int64)
+        for j, column in enumerate(columns):
+            offsets += ((results >> (len(qubits) - 1 - j)) & 1) * weights[column]
+        distribution = np.zeros(2 ** num_measurements)
+        np.add.at(distribution, (base[:, None] + offsets[None, :]).reshape(-1), marginal.reshape(-1))
+        return distribution / distribution.sum()
+
+
+def _sample_kraus(states, kraus, qubit, num_qubits, rng):
+    """
+    Applies a channel to a batch of trajectories: every state picks one Kraus operator K with probability
+    <psi|K^dagger K|psi> and is replaced by K psi, normalized.
+
+    :param states: Array of shape (shots, 2**num_qubits), updated in place.
+    :param kraus: Kraus operators.
+    :param qubit: Qubit the channel acts on.
+    :param num_qubits: Number of qubits.
+    :param rng: numpy.random.Generator.
+    :return: Index of the operator every trajectory picked.
+    """
+    shots = len(states)
+    products = [operator.conj().T @ operator for operator in kraus]
+    if all(np.allclose(product, product[0, 0] * np.eye(2)) for product in products):
+        # Mixtures of unitaries (depolarizing) pick an operator independently of the state
+        probabilities = np.broadcast_to([product[0, 0].real for product in products], (shots, len(kraus)))
+    else:
+        view = states.reshape(shots, 2 ** qubit, 2, -1)
+        reduced = np.einsum('saib,sajb->sij', view.conj(), view)
+        probabilities = np.stack([np.einsum('ij,sij->s', product, reduced).real for product in products], axis=1)
+    cumulative = np.cumsum(probabilities, axis=1)
+    draws = rng.random(shots) * cumulative[:, -1]
+    chosen = np.minimum((draws[:, None] >= cumulative).sum(axis=1), len(kraus) - 1)
+    for k, operator in enumerate(kraus):
+        rows = chosen == k
+        # A multiple of the identity leaves the normalized state unchanged
+        if not rows.any() or np.allclose(operator, operator[0, 0] * np.eye(2)):
+            continue
+        selected = apply_matrix(np.ascontiguousarray(states[rows]), operator, qubit, num_qubits)
+        selected /= np.sqrt(probabilities[rows, k])[:, None]
+        states[rows] = selected
+    return chosen
+
+
+class TrajectorySimulator:
+    """
+    Monte Carlo simulation of a noisy circuit with one pure state per shot.
+
+    Every shot follows its own trajectory: a channel applies one of its Kraus operators, chosen at random with
+    the probability it has for that state, and a measurement projects the state on the result it drew. All shots
+    are updated together as one batch of statevectors, so memory grows as shots * 2**n instead of 4**n.
+    """
+
+    def __init__(self, num_qubits, shots, noise=None, rng=None, dtype=np.complex128):
+        """
+        :param num_qubits: Number of qubits.
+        :param shots: Number of trajectories.
+        :param noise: NoiseModel; defaults to no noise.
+        :param rng: Optional numpy.random.Generator.
+        :param dtype: Complex dtype of the amplitudes.
+        """
+        self.num_qubits = num_qubits
+        self.noise = noise or NoiseModel()
+        self.rng = rng or np.random.default_rng()
+        self.states = np.zeros((shots, 2 ** num_qubits), dtype=dtype)
+        self.states[:, 0] = 1
+        self.bits = np.zeros((shots, 0), dtype=np.uint8)  # Recorded result of every measurement of every shot
+        self.measured = []  # Qubit of every measurement
+        self._bregs = {}  # Bit register -> index of the measurement that last wrote it
+
+    def run(self, gates):
+        """
+        Applies a list of recorded gates.
+
+        :return: self.
+        """
+        for gate in gates:
+            self.apply(gate)
+        return self
+
+    def apply(self, gate):
+        """
+        Applies one recorded gate, measurement or reset, followed by the gate noise, to every trajectory.
+        """
+        qubit = gate.qubits[0] if gate.qubits else None
+        if gate.name == 'measure':
+            results = _sample_kraus(self.states, _PROJECTORS, qubit, self.num_qubits, self.rng)
+            flips = self.rng.random(len(results)) < self.noise.readout_error
+            self._bregs[qubit] = len(self.measured)
+            self.measured.append(qubit)
+            self.bits = np.concatenate([self.bits, (results ^ flips).astype(np.uint8)[:, None]], axis=1)
+            return
+        if gate.name == 'prepz':
+            _sample_kraus(self.states, _RESET, qubit, self.num_qubits, self.rng)
+            return
+        if not gate.condition:
+            self._gate(self.states, gate)
+            return
+        if not all(breg in self._bregs for breg in gate.condition):
+            return
+        active = np.all(self.bits[:, [self._bregs[breg] for breg in gate.condition]] == 1, axis=1)
+        if active.any():
+            states = np.ascontiguousarray(self.states[active])
+            self._gate(states, gate._replace(condition=None))
+            self.states[active] = states
+
+    def _gate(self, states, gate):
+        apply_gate(states, gate, self.num_qubits)
+        for kraus in gate_noise(gate, self.noise):
+            for qubit in gate.qubits:
+                _sample_kraus(states, kraus, qubit, self.num_qubits, self.rng)
+
+
+def density_matrix_distribution(gates, num_qubits, noise=None, dtype=np.complex128):
+    """
+    Exact distribution of the recorded measurement results of a noisy circuit.
+
+    :param gates: Recorded gates.
+    :param num_qubits: Number of qubits to simulate.
+    :param noise: NoiseModel.
+    :param dtype: Complex dtype of the amplitudes.
+    :return: Tuple (probabilities, measured qubits), with one bit per measurement; a circuit without
+        measurements is measured on all qubits.
+    """
+    with span('density_matrix_distribution', 'simulate', num_qubits=num_qubits, gates=len(gates)):
+        simulator = DensityMatrixSimulator(num_qubits, noise, dtype=dtype)
+        simulator.run(_with_final_measurements(gates, num_qubits))
+        return simulator.outcome_distribution(), simulator.measured
+
+
+def sample_trajectories(gates, num_qubits, shots, noise=None, rng=None, dtype=np.complex128,
+                        max_amplitudes=1 << 22):
+    """
+    Samples a noisy circuit with Monte Carlo trajectories, in batches of shots.
+
+    :param gates: Recorded gates.
+    :param num_qubits: Number of qubits to simulate.
+    :param shots: Number of shots.
+    :param noise: NoiseModel.
+    :param rng: Optional numpy.random.Generator.
+    :param dtype: Complex dtype of the amplitudes.
+    :param max_amplitudes: Approximate number of amplitudes (over all shots of a batch) simulated at once.
+    :return: Tuple (uint8 array of shape (shots, measurements), measured qubits).
+    """
+    rng = rng or np.random.default_rng()
+    gates = _with_final_measurements(gates, num_qubits)
+    measured = [gate.qubits[0] for gate in gates if gate.name == 'measure']
+    batch = max(1, max_amplitudes // 2 ** num_qubits)
+    bits = [np.zeros((0, len(measured)), dtype=np.uint8)]
+    for first in range(0, shots, batch):
+        simulator = TrajectorySimulator(num_qubits, min(batch, shots - first), noise, rng, dtype).run(gates)
+        bits.append(simulator.bits)
+    return np.concatenate(bits), measured
+
+
+def select_method(num_qubits, shots, method='auto'):
+    """
+    Chooses the noisy simulation engine.
+
+    The density matrix costs 4**n per operation and the trajectories shots * 2**n, so 'auto' takes the density
+    matrix while 2**n is at most the number of shots (and n at most DENSITY_MATRIX_MAX_QUBITS).
+
+    :param num_qubits: Number of qubits.
+    :param shots: Number of shots.
+    :param method: One of METHODS.
+    :return: 'density_matrix' or 'trajectories'.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown noise simulation method '{method}', expected one of {METHODS}.")
+    if method == 'auto':
+        small = num_qubits <= DENSITY_MATRIX_MAX_QUBITS and 2 ** num_qubits <= shots
+        return 'density_matrix' if small else 'trajectories'
+    return method
+
+
+def sample_noisy_counts(gates, num_qubits, shots, noise, method='auto', rng=None, dtype=np.complex128,
+                        max_amplitudes=1 << 22):
+    """
+    Runs many shots of a recorded circuit on a noisy device and returns the histogram of recorded results.
+
+    :param gates: Recorded gates (for example RecordingKernel.gates).
+    :param num_qubits: Number of qubits to simulate.
+    :param shots: Number of shots.
+    :param noise: NoiseModel.
+    :param method: One of METHODS.
+    :param rng: Optional numpy.random.Generator.
+    :param dtype: Complex dtype of the amplitudes.
+    :param max_amplitudes: Batch size of the trajectories, in amplitudes.
+    :return: Dictionary mapping bitstring (one bit per measurement, in order) to count.
+    """
+    method = select_method(num_qubits, shots, method)
+    with span('sample_noisy_counts', 'simulate', method=method, num_qubits=num_qubits, gates=len(gates), shots=shots):
+        if method == 'density_matrix':
+            probabilities, measured = density_matrix_distribution(gates, num_qubits, noise, dtype)
+            return counts_from_probabilities(probabilities, len(measured), shots, rng)
+        bits, _ = sample_trajectories(gates, num_qubits, shots, noise, rng, dtype, max_amplitudes)
+        return counts_from_bits(bits)
+
+
+# The six eigenstates of x, y and z; averaging over them gives the same fidelity as averaging over all states
+_CARDINAL_STATES = np.array([[1, 0], [0, 1], [1, 1], [1, -1], [1, 1j], [1, -1j]]) / np.sqrt([1, 1, 2, 2, 2, 2])[:, None]
+
+
+def noisy_teleportation_fidelity(gates, num_qubits, pairs, noise=None):
+    """
+    Average fidelity with which a teleportation circuit transfers states on a noisy device.
+
+    Like branching.teleportation_fidelity() the leading prepz operations are skipped and the input is placed on
+    the source qubits, but the circuit is run on the density-matrix simulator and the inputs are the six
+    eigenstates of x, y and z, which give the exact average over all input states.
+
+    :param gates: Recorded gates of the teleportation circuit.
+    :param num_qubits: Number of qubits.
+    :param pairs: (source, target) qubit pairs, one per teleported state.
+    :param noise: NoiseModel.
+    :return: Array with the average fidelity of every pair.
+    """
+    start = next((i for i, gate in enumerate(gates) if gate.name != 'prepz'), len(gates))
+    sources = {source for source, _ in pairs}
+    fidelities = np.zeros(len(pairs))
+    for vector in _CARDINAL_STATES:
+        state = np.ones(1, dtype=np.complex128)
+        for qubit in range(num_qubits):
+            state = np.kron(state, vector if qubit in sources else [1, 0])
+        simulator = DensityMatrixSimulator(num_qubits, noise, state).run(gates[start:])
+        rho = simulator.density_matrices()
+        for i, (_, target) in enumerate(pairs):
+            view = rho.reshape(len(rho), 2 ** target, 2, -1, 2 ** target, 2, 2 ** (num_qubits - target - 1))
+            reduced = np.einsum('baiyajy->ij', view)
+            fidelities[i] += np.vdot(vector, reduced @ vector).real
+    return fidelities / len(_CARDINAL_STATES)
+
+
+def add_noise_arguments(parser):
+    """
+    Adds the options of a NoiseModel and the simulation method to an argparse parser.
+    """
+    parser.add_argument('--depolarizing', type=float, default=0.0, help='depolarizing probability per gate qubit')
+    parser.add_argument('--two-qubit-depolarizing', type=float, help='depolarizing probability after multi-qubit gates')
+    parser.add_argument('--amplitude-damping', type=float, default=0.0, help='decay probability per gate qubit')
+    parser.add_argument('--readout-error', type=float, default=0.0, help='probability that a result is flipped')
+    parser.add_argument('--noise-method', choices=METHODS, default='auto', help='engine for noisy simulation')
+
+
+def noise_from_args(args):
+    """
+    Builds the NoiseModel given on the command line.
+
+    :return: NoiseModel, or None if all error rates are zero.
+    """
+    noise = NoiseModel(args.depolarizing, args.two_qubit_depolarizing, args.amplitude_damping, args.readout_error)
+    return noise if any(noise) else None
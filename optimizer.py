@@ -0,0 +1,254 @@
+import collections
+
+import numpy as np
+
+from gates import Gate, ROTATION_GATES, SINGLE_QUBIT_GATES, rotation_matrix, single_qubit_matrix
+
+# Gate that undoes each gate when applied to the same qubits
+INVERSES = {
+    'i': 'i', 'h': 'h', 'x': 'x', 'y': 'y', 'z': 'z',
+    's': 'sdag', 'sdag': 's', 't': 'tdag', 'tdag': 't',
+    'cnot': 'cnot', 'cz': 'cz', 'swap': 'swap', 'toffoli': 'toffoli', 'mcz': 'mcz',
+}
+
+# Gates whose qubits can be given in any order
+SYMMETRIC_GATES = ('cz', 'swap', 'mcz')
+
+# Gates that are diagonal in the computational basis; they all commute with each other
+DIAGONAL_GATES = ('i', 'z', 's', 'sdag', 't', 'tdag', 'rz', 'cz', 'mcz')
+
+# Single-qubit gates that commute with X, and so with the target of a cnot or toffoli
+X_AXIS_GATES = ('i', 'x', 'rx')
+
+# Operations nothing is moved across
+BARRIERS = ('measure', 'prepz', 'classical')
+
+OptimizationReport = collections.namedtuple('OptimizationReport',
+                                            ['gates_before', 'gates_after', 'counts_before', 'counts_after'])
+
+
+def _same_qubits(a, b):
+    if a.name in SYMMETRIC_GATES:
+        return sorted(a.qubits) == sorted(b.qubits)
+    if a.name in ('cnot', 'toffoli'):
+        return sorted(a.qubits[:-1]) == sorted(b.qubits[:-1]) and a.qubits[-1] == b.qubits[-1]
+    return a.qubits == b.qubits
+
+
+def is_inverse(a, b):
+    """
+    Tells whether gate b undoes gate a.
+
+    :param a: First gate.
+    :param b: Second gate.
+    :return: True if a followed by b is the identity.
+    """
+    if a.condition != b.condition:
+        return False
+    if a.name in ('rx', 'ry', 'rz') and a.name == b.name:
+        return a.qubits == b.qubits and np.isclose(abs(np.cos((a.param + b.param) / 2)), 1)
+    return INVERSES.get(a.name) == b.name and _same_qubits(a, b)
+
+
+def _controls_and_target(gate):
+    if gate.name in ('cnot', 'toffoli'):
+        return gate.qubits[:-1], gate.qubits[-1]
+    return None, None
+
+
+def commutes(a, b):
+    """
+    Tells whether two gates can be exchanged without changing the circuit.
+
+    Only simple, always-valid rules are used: gates on different qubits, diagonal gates, diagonal gates on
+    the control of a cnot, X-axis gates on its target, and cnots that share only controls or only targets.
+
+    :param a: First gate.
+    :param b: Second gate.
+    :return: True if the gates are known to commute.
+    """
+    # A gate conditioned on a measurement result stays after that measurement
+    for first, second in ((a, b), (b, a)):
+        if first.condition and second.name == 'measure' and second.qubits[0] in first.condition:
+            return False
+    if a.name in BARRIERS or b.name in BARRIERS:
+        return not set(a.qubits) & set(b.qubits) and 'classical' not in (a.name, b.name)
+    shared = set(a.qubits) & set(b.qubits)
+    if not shared:
+        return True
+    if a.name in DIAGONAL_GATES and b.name in DIAGONAL_GATES:
+        return True
+    for first, second in ((a, b), (b, a)):
+        controls, target = _controls_and_target(first)
+        if controls is None:
+            continue
+        if len(second.qubits) == 1:
+            qubit = second.qubits[0]
+            if qubit in controls and second.name in DIAGONAL_GATES:
+                return True
+            if qubit == target and second.name in X_AXIS_GATES:
+                return True
+            return False
+        other_controls, other_target = _controls_and_target(second)
+        if other_controls is not None:
+            # Controls may be shared, targets may be shared, but no qubit may be a control of one and
+            # the target of the other
+            return target not in other_controls and other_target not in controls
+        if second.name in DIAGONAL_GATES:
+            return target not in second.qubits
+        return False
+    return False
+
+
+def cancel_inverses(gates, window=1000):
+    """
+    Removes pairs of gates that undo each other, also when they are separated by gates they commute with.
+
+    For every gate the output built so far is searched backwards, skipping gates it commutes with, for a gate
+    that it undoes. Removals cascade: when an inner pair disappears, the outer gates become neighbours.
+
+    :param gates: Gate list.
+    :param window: Maximum number of earlier gates looked at for each gate.
+    :return: New gate list.
+    """
+    out = []
+    for gate in gates:
+        j = len(out) - 1
+        limit = max(-1, j - window)
+        cancelled = False
+        while j > limit:
+            previous = out[j]
+            if previous is not None:
+                if is_inverse(previous, gate):
+                    out[j] = None
+                    cancelled = True
+                    break
+                if not commutes(previous, gate):
+                    break
+            j -= 1
+        if not cancelled:
+            out.append(gate)
+    return [gate for gate in out if gate is not None]
+
+
+def _equal_up_to_phase(a, b):
+    # |<a, b>| is 2 exactly when the matrices agree up to a phase; it falls short by the square of the error, so
+    # the tolerance must be tight for nearby gates (such as a small rz after an s) not to count as equal
+    overlap = np.vdot(a, b)
+    return np.isclose(abs(overlap), 2, rtol=0, atol=1e-12)
+
+
+def _rotation(matrix):
+    """
+    Finds a rotation gate equal to a 2x2 unitary up to a global phase.
+
+    :return: Tuple (name, angle), or None if the matrix is not a rotation about the x, y or z axis.
+    """
+    # Up to a phase the matrix is cos(a/2) I - i sin(a/2) P for the Pauli P of the rotation axis
+    identity = np.trace(matrix) / 2
+    for name in ROTATION_GATES:
+        component = 1j * np.trace(SINGLE_QUBIT_GATES[name[1]] @ matrix) / 2
+        reference = identity if abs(identity) > abs(component) else component
+        if abs(reference) < 1e-9:
+            continue
+        phase = reference / abs(reference)
+        angle = 2 * np.arctan2((component / phase).real, (identity / phase).real)
+        if _equal_up_to_phase(matrix, rotation_matrix(name, angle)):
+            return name, float(angle)
+    return None
+
+
+def _single_gate(matrix, qubit):
+    """
+    A list with the one OpenQL gate equal to a 2x2 unitary up to a phase (empty for the identity), or None.
+    """
+    for name, named in SINGLE_QUBIT_GATES.items():
+        if _equal_up_to_phase(matrix, named):
+            return [] if name == 'i' else [Gate(name, qubit)]
+    rotation = _rotation(matrix)
+    if rotation is not None:
+        return [Gate(rotation[0], qubit, rotation[1])]
+    return None
+
+
+def _fused_gates(run):
+    """
+    The shortest replacement of a run of single-qubit gates made of named and rotation gates: one gate (none for
+    the identity), else two gates one of which is a named gate, else the run itself. Products that are no OpenQL
+    gate are not emitted as 'unitary' gates, because lowering them as a decomposed ql.Unitary gives longer
+    compiled output than the run.
+    """
+    if len(run) == 1:
+        return run
+    matrix = np.eye(2, dtype=complex)
+    for gate in run:
+        matrix = single_qubit_matrix(gate) @ matrix
+    qubit = run[0].qubits
+    fused = _single_gate(matrix, qubit)
+    if fused is not None or len(run) == 2:
+        return run if fused is None else fused
+    for name, named in SINGLE_QUBIT_GATES.items():
+        if name == 'i':
+            continue
+        # matrix = rest @ named (the named gate first) or named @ rest (the named gate last)
+        rest = _single_gate(matrix @ named.conj().T, qubit)
+        if rest is not None:
+            return [Gate(name, qubit)] + rest
+        rest = _single_gate(named.conj().T @ matrix, qubit)
+        if rest is not None:
+            return rest + [Gate(name, qubit)]
+    return run
+
+
+def fuse_single_qubit_gates(gates):
+    """
+    Replaces every run of single-qubit gates on the same qubit by one gate.
+
+    The run's 2x2 product is emitted as a named gate when it equals one up to a global phase, as an rx, ry or
+    rz gate when it is a rotation about one axis and dropped when it is the identity. Longer runs whose product
+    is a named gate combined with such a gate become those two gates; other runs are kept as they are, so the
+    output only contains gates OpenQL has. Gates on other qubits between the gates of a run do not break it.
+
+    :param gates: Gate list.
+    :return: New gate list.
+    """
+    out = []
+    pending = {}
+
+    def flush(qubit):
+        run = pending.pop(qubit, None)
+        if run:
+            out.extend(_fused_gates(run))
+
+    for gate in gates:
+        if len(gate.qubits) == 1 and not gate.condition and single_qubit_matrix(gate) is not None:
+            pending.setdefault(gate.qubits[0], []).append(gate)
+            continue
+        if gate.name == 'classical':
+            for qubit in sorted(pending):
+                flush(qubit)
+        for qubit in gate.qubits:
+            flush(qubit)
+        out.append(gate)
+    for qubit in sorted(pending):
+        flush(qubit)
+    return out
+
+
+def optimize(gates, fuse=True):
+    """
+    Runs the cancellation and fusion passes over a gate list.
+
+    :param gates: Gate list (for example RecordingKernel.gates).
+    :param fuse: Whether to fuse single-qubit gates.
+    :return: Tuple (optimized gate list, OptimizationReport with gate counts per name before and after).
+    """
+    gates = list(gates)
+    optimized = cancel_inverses(gates)
+    if fuse:
+        # Fusing can create new inverse pairs next to multi-qubit gates, so cancel once more afterwards
+        optimized = cancel_inverses(fuse_single_qubit_gates(optimized))
+    report = OptimizationReport(len(gates), len(optimized),
+                                dict(collections.Counter(gate.name for gate in gates)),
+                                dict(collections.Counter(gate.name for gate in optimized)))
+    return optimized, report
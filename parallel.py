@@ -0,0 +1,146 @@
+import argparse
+import collections
+import concurrent.futures
+import os
+
+import session
+from batch_input import write_record
+from compile_cache import compile_cached, program_key
+from recording import RecordingKernel, RecordingProgram
+from sampling import sample_counts
+
+# One independent circuit to compile and/or simulate. Kernels themselves cannot be sent to another process,
+# so a job carries the recorded gate list and the worker rebuilds the kernel from it.
+# num_qubits is the size of the OpenQL kernel (including ancillas); shots=0 skips the simulation.
+CircuitJob = collections.namedtuple('CircuitJob', ['name', 'num_qubits', 'gates', 'shots', 'compile', 'num_cregs'],
+                                    defaults=[1000, True, 0])
+
+
+def job_from_kernel(kernel, shots=1000, compile=True):
+    """
+    Describes a RecordingKernel as a job that can be sent to a worker process.
+
+    :param kernel: RecordingKernel.
+    :param shots: Number of shots to simulate; 0 to only compile.
+    :param compile: Whether the worker compiles the kernel.
+    :return: CircuitJob.
+    """
+    return CircuitJob(kernel.kernel_name, kernel.num_qubits, list(kernel.gates), shots, compile, kernel.num_cregs)
+
+
+def init_worker(output_dir, log_level):
+    """
+    Initializer of worker processes: sets up the OpenQL session and platform before the first job.
+    """
+    session.initialize(output_dir, log_level)
+    session.get_platform()
+
+
+def validate_job_name(name):
+    """
+    Checks that a job name can be used as the name of its output directory and program.
+
+    Names come from clients of the socket services, so a name that is empty, contains a path separator or is
+    '.' or '..' would let OpenQL write outside the output directory.
+
+    :return: The name.
+    :raises ValueError: If the name is not a plain file name.
+    """
+    if not isinstance(name, str) or name in ('', '.', '..') or any(c in name for c in ('/', '\\', '\0')):
+        raise ValueError(f"Job name {name!r} is not a plain file name.")
+    return name
+
+
+def _used_qubits(gates):
+    return max((qubit for gate in gates for qubit in gate.qubits), default=-1) + 1
+
+
+def compile_job(job):
+    """
+    Compiles one job in the current process.
+
+    Each job compiles into its own subdirectory of the session's output directory, named after the job and its
+    cache key (see compile_cache.program_key()), so jobs running at the same time only share a directory when
+    they compile the same program and write the same files.
+
+    :param job: CircuitJob.
+    :return: Whether the compiled output came from the cache.
+    """
+    validate_job_name(job.name)
+    platform = session.get_platform()
+    kernel = RecordingKernel(job.name, platform, job.num_qubits, job.num_cregs)
+    kernel.add_gates(job.gates, ancillas=range(_used_qubits(job.gates), job.num_qubits))
+    program = RecordingProgram(job.name, platform, job.num_qubits, job.num_cregs)
+    program.add_kernel(kernel)
+    output_dir = session.output_dir()
+    session.set_option('output_dir', os.path.join(output_dir, f'{job.name}-{program_key(program)[:16]}'))
+    try:
+        return compile_cached(program)
+    finally:
+        session.set_option('output_dir', output_dir)
+
+
+def simulate_job(job):
+    """
+    Simulates one job on the qubits its gates use.
+
+    :param job: CircuitJob.
+    :return: Histogram of the measured bitstrings.
+    """
+    return sample_counts(job.gates, _used_qubits(job.gates), job.shots)
+
+
+def run_job(job):
+    """
+    Compiles and simulates one job in the current process.
+
+    :param job: CircuitJob.
+    :return: Dictionary with the job name, whether the compiled output came from the cache and the counts.
+    """
+    result = {'name': job.name}
+    if job.compile:
+        result['cached'] = compile_job(job)
+    if job.shots:
+        result['counts'] = simulate_job(job)
+    return result
+
+
+def run_parallel(jobs, max_workers=None, output_dir='output', log_level='LOG_WARNING'):
+    """
+    Runs independent jobs on a pool of worker processes.
+
+    Every worker initializes OpenQL and creates its platform once and reuses it for all of its jobs.
+
+    :param jobs: Iterable of CircuitJob.
+    :param max_workers: Number of worker processes; defaults to the number of CPUs.
+    :param output_dir: Directory for the compiled output.
+    :param log_level: OpenQL log level in the workers.
+    :return: List of results in the same order as the jobs.
+    """
+    jobs = list(jobs)
+    max_workers = max_workers or os.cpu_count()
+    with concurrent.futures.ProcessPoolExecutor(max_workers, initializer=init_worker,
+                                                initargs=(output_dir, log_level)) as executor:
+        # Small jobs are sent in chunks so the inter-process overhead does not dominate
+        chunksize = max(1, len(jobs) // (4 * max_workers))
+        return list(executor.map(run_job, jobs, chunksize=chunksize))
+
+
+if __name__ == '__main__':
+    from grover import ancillas_needed, grover_gates
+
+    parser = argparse.ArgumentParser(description='Run a sweep of Grover searches on several cores.')
+    parser.add_argument('targets', nargs='+', type=int, help='target values to search for')
+    parser.add_argument('--qubits', type=int, default=10, help='size of the search register')
+    parser.add_argument('--shots', type=int, default=1000, help='number of shots per target')
+    parser.add_argument('--workers', type=int, help='number of worker processes')
+    parser.add_argument('--no-compile', action='store_true', help='only simulate')
+    args = parser.parse_args()
+
+    jobs = [CircuitJob(f'grover_{target}', args.qubits + ancillas_needed(args.qubits),
+                       grover_gates(args.qubits, [target]), args.shots, not args.no_compile)
+            for target in args.targets]
+    for target, result in zip(args.targets, run_parallel(jobs, args.workers)):
+        counts = result.get('counts')
+        best = max(counts, key=counts.get) if counts else None
+        write_record({'target': target, 'found': best and int(best, 2), 'frequency': best and counts[best] / args.shots})
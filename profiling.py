@@ -0,0 +1,166 @@
+import collections
+import contextlib
+import json
+import os
+import sys
+import time
+
+# One timed region: start and duration in seconds since the profiler started, args are free-form details
+Event = collections.namedtuple('Event', ['name', 'category', 'start', 'duration', 'args'])
+
+# Profiler that span() and count() report to; None when nothing is being profiled
+_active = None
+
+
+class Profiler:
+    """
+    Collects timers and counters from the instrumented parts of the repository.
+
+    Kernel construction (RecordingKernel.add_gates), compilation (RecordingProgram.compile and the stages of
+    compile_cache.compile_cached) and simulation (sampling.sample_counts, sampling.measurement_distribution,
+    noise.sample_noisy_counts, noise.density_matrix_distribution and the ProgramInterpreter) report spans while a
+    profiler is active:
+
+        with Profiler() as profiler:
+            ...
+        profiler.write_chrome_trace('trace.json')
+
+    Without an active profiler the instrumentation only costs a function call per span.
+    """
+
+    def __init__(self):
+        self.events = []
+        self.counters = collections.Counter()
+        self._origin = time.perf_counter()
+        self._previous = None
+
+    def __enter__(self):
+        global _active
+        self._previous = _active
+        _active = self
+        return self
+
+    def __exit__(self, *exc_info):
+        global _active
+        _active = self._previous
+
+    def record(self, name, category, start, duration, args=None):
+        """
+        Adds a finished span; start is a time.perf_counter() value.
+        """
+        self.events.append(Event(name, category, start - self._origin, duration, args or {}))
+
+    def summary(self):
+        """
+        Total time and number of calls of every span name, slowest first.
+
+        :return: Dictionary mapping name to {'calls': int, 'total_s': float}.
+        """
+        totals = {}
+        for event in self.events:
+            entry = totals.setdefault(event.name, {'calls': 0, 'total_s': 0.0})
+            entry['calls'] += 1
+            entry['total_s'] += event.duration
+        return dict(sorted(totals.items(), key=lambda item: -item[1]['total_s']))
+
+    def print_summary(self, stream=None):
+        """
+        Prints the summary and the counters as a table, to stderr by default.
+        """
+        stream = stream or sys.stderr
+        for name, entry in self.summary().items():
+            stream.write(f"{name:<32} {entry['calls']:>8} calls {entry['total_s']:>12.6f} s\n")
+        for name, value in sorted(self.counters.items()):
+            stream.write(f"{name:<32} {value:>8}\n")
+
+    def chrome_trace(self):
+        """
+        The events in the Chrome trace event format, viewable in chrome://tracing or Perfetto.
+        """
+        pid = os.getpid()
+        events = [{'name': event.name, 'cat': event.category, 'ph': 'X', 'pid': pid, 'tid': 0,
+                   'ts': event.start * 1e6, 'dur': event.duration * 1e6, 'args': event.args}
+                  for event in self.events]
+        end = max((event['ts'] + event['dur'] for event in events), default=0)
+        events += [{'name': name, 'ph': 'C', 'pid': pid, 'tid': 0, 'ts': end, 'args': {'value': value}}
+                   for name, value in self.counters.items()]
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write_chrome_trace(self, path):
+        """
+        Writes chrome_trace() as JSON.
+        """
+        with open(path, 'w') as f:
+            json.dump(self.chrome_trace(), f, default=str)
+
+
+def active():
+    """
+    The active Profiler, or None.
+    """
+    return _active
+
+
+@contextlib.contextmanager
+def span(name, category='', **args):
+    """
+    Times a region of code for the active profiler.
+
+    :param name: Name of the region.
+    :param category: Group of the region, for example 'construct', 'compile' or 'simulate'.
+    :param args: Details stored with the event; the body may add more to the yielded dictionary.
+    :return: Context manager yielding the args dictionary.
+    """
+    profiler = _active
+    if profiler is None:
+        yield args
+        return
+    start = time.perf_counter()
+    try:
+        yield args
+    finally:
+        profiler.record(name, category, start, time.perf_counter() - start, args)
+
+
+def count(name, value=1):
+    """
+    Adds to a counter of the active profiler.
+    """
+    if _active is not None:
+        _active.counters[name] += value
+
+
+def circuit_stats(gates):
+    """
+    Size of a recorded circuit.
+
+    The depth is the number of layers when every gate starts as soon as its qubits (and, for conditioned gates,
+    the measurements it reads) are free; measure and prepz count as layers, 'classical' operations do not.
+
+    :param gates: Recorded gates.
+    :return: Dictionary with 'gates', 'gate_counts', 'depth' and 'num_qubits' (number of qubits used).
+    """
+    counts = collections.Counter()
+    levels = {}
+    bregs = {}
+    depth = 0
+    for gate in gates:
+        counts[gate.name] += 1
+        if not gate.qubits:
+            continue
+        level = 1 + max([levels.get(q, 0) for q in gate.qubits] + [bregs.get(b, 0) for b in gate.condition or ()])
+        for qubit in gate.qubits:
+            levels[qubit] = level
+        if gate.name == 'measure':
+            bregs[gate.qubits[0]] = level
+        depth = max(depth, level)
+    return {'gates': sum(counts.values()), 'gate_counts': dict(counts), 'depth': depth, 'num_qubits': len(levels)}
+
+
+def output_bytes(path):
+    """
+    Total size of the files below a directory, 0 if it does not exist.
+
+    :param path: Directory, for example the OpenQL output directory.
+    """
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
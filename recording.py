@@ -0,0 +1,324 @@
+import os
+import shutil
+import tempfile
+
+import openql as ql
+
+from gates import Gate, ROTATION_GATES, canonical_name
+from profiling import active, circuit_stats, output_bytes, span
+
+
+class RecordingKernel(ql.Kernel):
+    """
+    A ql.Kernel that keeps its own copy of every gate added to it.
+
+    OpenQL does not give back the gates of a kernel, so the simulators in this repository work on the
+    list recorded here instead. The kernel is otherwise a normal ql.Kernel and can be added to a program
+    and compiled as usual.
+    """
+
+    def __init__(self, name, platform, num_qubits, num_cregs=0):
+        """
+        :param name: Name of the kernel.
+        :param platform: ql.Platform the kernel is created for.
+        :param num_qubits: Number of qubits.
+        :param num_cregs: Number of classical registers.
+        """
+        if num_cregs:
+            super().__init__(name, platform, num_qubits, num_cregs)
+        else:
+            super().__init__(name, platform, num_qubits)
+        self.kernel_name = name
+        self.num_qubits = num_qubits
+        self.num_cregs = num_cregs
+        self.gates = []  # List of Gate tuples in the order they were added
+
+    def _record(self, name, qubits, param=None, condition=None):
+        self.gates.append(Gate(canonical_name(name), tuple(qubits), param, condition))
+
+    def gate(self, name, qubits, *args, **kwargs):
+        angle = kwargs.get('angle', args[1] if len(args) > 1 else None)
+        condstring = kwargs.get('condstring', args[3] if len(args) > 3 else 'COND_ALWAYS')
+        condregs = kwargs.get('condregs', args[4] if len(args) > 4 else [])
+        self._record(name, qubits, angle if canonical_name(name) in ROTATION_GATES else None,
+                     _condition(condstring, condregs))
+        return super().gate(name, qubits, *args, **kwargs)
+
+    def conditional_gate(self, name, qubits, bregs, angle=0.0):
+        """
+        Adds a gate that only acts when all the given bit registers hold 1, for example a teleportation
+        correction that depends on a measurement result (measure(q) writes bit register q).
+
+        :param name: Gate name.
+        :param qubits: Qubits the gate acts on.
+        :param bregs: One or two bit registers.
+        :param angle: Rotation angle for rx/ry/rz.
+        """
+        condstring = 'COND_UNARY' if len(bregs) == 1 else 'COND_AND'
+        return self.gate(name, list(qubits), 0, angle, [], condstring, list(bregs))
+
+    def hadamard(self, qubit):
+        self._record('h', [qubit])
+        return super().hadamard(qubit)
+
+    def x(self, qubit):
+        self._record('x', [qubit])
+        return super().x(qubit)
+
+    def y(self, qubit):
+        self._record('y', [qubit])
+        return super().y(qubit)
+
+    def z(self, qubit):
+        self._record('z', [qubit])
+        return super().z(qubit)
+
+    def s(self, qubit):
+        self._record('s', [qubit])
+        return super().s(qubit)
+
+    def sdag(self, qubit):
+        self._record('sdag', [qubit])
+        return super().sdag(qubit)
+
+    def t(self, qubit):
+        self._record('t', [qubit])
+        return super().t(qubit)
+
+    def tdag(self, qubit):
+        self._record('tdag', [qubit])
+        return super().tdag(qubit)
+
+    def rx(self, qubit, angle):
+        self._record('rx', [qubit], angle)
+        return super().rx(qubit, angle)
+
+    def ry(self, qubit, angle):
+        self._record('ry', [qubit], angle)
+        return super().ry(qubit, angle)
+
+    def rz(self, qubit, angle):
+        self._record('rz', [qubit], angle)
+        return super().rz(qubit, angle)
+
+    def cnot(self, control, target):
+        self._record('cnot', [control, target])
+        return super().cnot(control, target)
+
+    def cz(self, control, target):
+        self._record('cz', [control, target])
+        return super().cz(control, target)
+
+    def toffoli(self, control_a, control_b, target):
+        self._record('toffoli', [control_a, control_b, target])
+        return super().toffoli(control_a, control_b, target)
+
+    def prepz(self, qubit):
+        self._record('prepz', [qubit])
+        return super().prepz(qubit)
+
+    def measure(self, qubit):
+        self._record('measure', [qubit])
+        return super().measure(qubit)
+
+    def classical(self, destination, operation):
+        """
+        Records a classical operation writing to a register; the operation must be a RecordingOperation.
+        """
+        self.gates.append(Gate('classical', (), (destination.index, operation.lhs, operation.operator,
+                                                 operation.rhs, operation.value)))
+        return super().classical(destination, operation)
+
+    def add_gates(self, gates, ancillas=()):
+        """
+        Records a list of gates and adds them to the underlying ql.Kernel.
+
+        Gates are recorded exactly as given. 'mcz' gates, which OpenQL does not have, are emitted as
+        h + a chain of toffoli gates + h; with more than three qubits the chain needs len(qubits) - 3
+        ancilla qubits in |0>, which are returned to |0> afterwards. 'unitary' gates are emitted as a
+        decomposed ql.Unitary. Gates with a condition are emitted as conditional OpenQL gates.
+
+        :param gates: Gates to add.
+        :param ancillas: Free qubits of this kernel that mcz decompositions may use.
+        """
+        with span('add_gates', 'construct', kernel=self.kernel_name) as info:
+            start = len(self.gates)
+            for gate in gates:
+                self.gates.append(gate)
+                if gate.condition:
+                    if gate.name in ('mcz', 'unitary'):
+                        raise ValueError(f"Gate '{gate.name}' cannot be conditioned on measurement results in OpenQL.")
+                    super().gate(gate.name, list(gate.qubits), 0, gate.param or 0.0, [],
+                                 'COND_UNARY' if len(gate.condition) == 1 else 'COND_AND', list(gate.condition))
+                elif gate.name == 'classical':
+                    # The operands were recorded by classical(); rebuild the register and operation objects
+                    destination, lhs, operator, rhs, value = gate.param
+                    if lhs is None:
+                        operation = RecordingOperation(value)
+                    else:
+                        operation = RecordingOperation(RecordingCReg(lhs), operator,
+                                                       None if rhs is None else RecordingCReg(rhs))
+                    super().classical(RecordingCReg(destination), operation)
+                elif gate.name == 'mcz':
+                    self._lower_mcz(gate.qubits, list(ancillas))
+                elif gate.name == 'unitary':
+                    unitary = ql.Unitary(f'{self.kernel_name}_unitary{len(self.gates)}',
+                                         [complex(value) for value in gate.param.flatten()])
+                    unitary.decompose()
+                    super().gate(unitary, list(gate.qubits))
+                elif gate.param is not None:
+                    super().gate(gate.name, list(gate.qubits), 0, gate.param)
+                else:
+                    super().gate(gate.name, list(gate.qubits))
+            info['gates'] = len(self.gates) - start
+
+    def _lower_mcz(self, qubits, ancillas):
+        *controls, target = qubits
+        if not controls:
+            super().gate('z', [target])
+            return
+        if len(controls) == 1:
+            super().gate('cz', [controls[0], target])
+            return
+        if len(ancillas) < len(controls) - 2:
+            raise ValueError(f"mcz on {len(qubits)} qubits needs {len(controls) - 2} ancilla qubits.")
+        # Multi-controlled X between two Hadamards on the target; the controls are combined
+        # pairwise into the ancillas, the last toffoli writes to the target and the rest is undone
+        chain = []
+        if len(controls) > 2:
+            chain.append([controls[0], controls[1], ancillas[0]])
+            for i in range(2, len(controls) - 1):
+                chain.append([controls[i], ancillas[i - 2], ancillas[i - 1]])
+        last = [controls[-1], ancillas[len(controls) - 3], target] if len(controls) > 2 else controls + [target]
+        super().gate('h', [target])
+        for toffoli_qubits in chain:
+            super().gate('toffoli', toffoli_qubits)
+        super().gate('toffoli', last)
+        for toffoli_qubits in reversed(chain):
+            super().gate('toffoli', toffoli_qubits)
+        super().gate('h', [target])
+
+
+def _condition(condstring, condregs):
+    """
+    Converts an OpenQL gate condition to the condition of a recorded Gate.
+    """
+    if condstring == 'COND_ALWAYS':
+        return None
+    if (condstring, len(condregs)) in (('COND_UNARY', 1), ('COND_AND', 2)):
+        return tuple(condregs)
+    raise ValueError(f"Condition {condstring} on bit registers {list(condregs)} cannot be recorded.")
+
+
+class RecordingProgram(ql.Program):
+    """
+    A ql.Program that keeps the structure it was built from.
+
+    Every call that adds kernels is stored in self.blocks as a tuple (kind, kernels, count, condition), where
+    kind is 'kernel', 'if_else', 'for' or 'do_while'. Together with RecordingKernel this gives a complete
+    description of the program that other tools (compile cache, simulators) can inspect.
+    """
+
+    def __init__(self, name, platform, num_qubits, num_cregs=0):
+        """
+        :param name: Name of the program.
+        :param platform: ql.Platform the program is created for.
+        :param num_qubits: Number of qubits.
+        :param num_cregs: Number of classical registers.
+        """
+        if num_cregs:
+            super().__init__(name, platform, num_qubits, num_cregs)
+        else:
+            super().__init__(name, platform, num_qubits)
+        self.program_name = name
+        self.platform_handle = platform
+        self.num_qubits = num_qubits
+        self.num_cregs = num_cregs
+        self.blocks = []
+
+    def compile(self, *args, **kwargs):
+        """
+        Compiles the program. While a profiling.Profiler is active the compilation is timed and reported with
+        the size of the recorded circuit and the number of bytes written to the output directory.
+        """
+        if active() is None:
+            return super().compile(*args, **kwargs)
+        gates = [gate for kernel in self.kernels for gate in getattr(kernel, 'gates', ())]
+        output_dir = ql.get_option('output_dir')
+        # Compile into a directory of this call only, so files that other compilations write to the output
+        # directory at the same time are not counted; the files are then moved to the output directory
+        os.makedirs(output_dir, exist_ok=True)
+        scratch = tempfile.mkdtemp(prefix='.compile', dir=output_dir)
+        try:
+            ql.set_option('output_dir', scratch)
+            try:
+                with span('program.compile', 'compile', program=self.program_name, **circuit_stats(gates)) as info:
+                    result = super().compile(*args, **kwargs)
+            finally:
+                ql.set_option('output_dir', output_dir)
+            info['output_bytes'] = output_bytes(scratch)
+            for root, _, names in os.walk(scratch):
+                for name in names:
+                    destination = os.path.join(output_dir, os.path.relpath(os.path.join(root, name), scratch))
+                    os.makedirs(os.path.dirname(destination), exist_ok=True)
+                    os.replace(os.path.join(root, name), destination)
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+        return result
+
+    def add_kernel(self, kernel):
+        self.blocks.append(('kernel', (kernel,), None, None))
+        return super().add_kernel(kernel)
+
+    def add_if_else(self, then_kernel, else_kernel, operation):
+        self.blocks.append(('if_else', (then_kernel, else_kernel), None, operation))
+        return super().add_if_else(then_kernel, else_kernel, operation)
+
+    def add_for(self, kernel, count):
+        self.blocks.append(('for', (kernel,), count, None))
+        return super().add_for(kernel, count)
+
+    def add_do_while(self, kernel, operation):
+        self.blocks.append(('do_while', (kernel,), None, operation))
+        return super().add_do_while(kernel, operation)
+
+    @property
+    def kernels(self):
+        """
+        All kernels of the program in the order they were added.
+        """
+        return [kernel for _, kernels, _, _ in self.blocks for kernel in kernels]
+
+
+class RecordingCReg(ql.CReg):
+    """
+    A ql.CReg that remembers its index.
+    """
+
+    def __init__(self, index):
+        super().__init__(index)
+        self.index = index
+
+
+class RecordingOperation(ql.Operation):
+    """
+    A ql.Operation that remembers its operands.
+
+    It is either a binary operation on two classical registers (a comparison such as '==' or '<', or an
+    arithmetic/bitwise operation such as '+' or '&'), a copy of one register, or an integer constant.
+    """
+
+    def __init__(self, lhs, operator=None, rhs=None):
+        """
+        :param lhs: Left-hand RecordingCReg, or an integer constant when operator is not given.
+        :param operator: Operation as a string, for example '==', '<' or '+'.
+        :param rhs: Right-hand RecordingCReg.
+        """
+        if operator is None:
+            super().__init__(lhs)
+        else:
+            super().__init__(lhs, operator, rhs)
+        self.lhs = lhs.index if isinstance(lhs, RecordingCReg) else None
+        self.value = None if isinstance(lhs, RecordingCReg) else int(lhs)
+        self.operator = operator
+        self.rhs = rhs.index if rhs is not None else None
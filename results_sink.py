@@ -0,0 +1,207 @@
+import struct
+
+import numpy as np
+
+# Shot files start with a 16-byte header: the magic bytes, the number of bits per shot and a reserved word.
+# The header is followed by blocks, each written in one call: the number of shots in the block (uint64) and the
+# packed shots stored by column, all first words of the block, then all second words, and so on. Every shot
+# is packed into ceil(bits / 64) little-endian uint64 words; measurement result 0 is the most significant bit
+# of word 0, so sorting the words sorts the shots like their bitstrings.
+MAGIC = b'KWSHOTS\x01'
+_HEADER = struct.Struct('<8sII')
+_COUNT = struct.Struct('<Q')
+
+# Shots buffered by a ShotWriter before a block is written (1 MiB of packed words for up to 64 bits)
+DEFAULT_BUFFER_SHOTS = 1 << 17
+
+
+def words_per_shot(num_bits):
+    """
+    Number of uint64 words a packed shot of num_bits results takes.
+    """
+    return max(1, -(-num_bits // 64))
+
+
+def pack_bits(bits):
+    """
+    Packs measurement results into uint64 words.
+
+    :param bits: Array of 0/1 values of shape (shots, num_bits).
+    :return: uint64 array of shape (shots, words_per_shot(num_bits)).
+    """
+    bits = np.asarray(bits, dtype=np.uint8)
+    words = words_per_shot(bits.shape[1])
+    packed = np.zeros((len(bits), 8 * words), dtype=np.uint8)
+    packed[:, :-(-bits.shape[1] // 8)] = np.packbits(bits, axis=1)
+    return packed.view('>u8').astype(np.uint64)
+
+
+def unpack_bits(words, num_bits):
+    """
+    Inverse of pack_bits().
+
+    :param words: uint64 array of shape (shots, words).
+    :param num_bits: Number of results per shot.
+    :return: uint8 array of shape (shots, num_bits).
+    """
+    packed = np.ascontiguousarray(words, dtype='>u8').view(np.uint8)
+    return np.unpackbits(packed, axis=1, count=num_bits)
+
+
+def pack_outcomes(outcomes, num_bits):
+    """
+    Packs outcome indices (as drawn by sampling.sample_shots()) without expanding them to bits.
+
+    :param outcomes: Integer array; the binary digits of outcome i are the num_bits results, first result first.
+    :param num_bits: Number of results per shot, at most 64.
+    :return: uint64 array of shape (shots, 1).
+    """
+    if num_bits > 64:
+        raise ValueError("Outcome indices hold at most 64 results; use pack_bits() for wider shots.")
+    outcomes = np.asarray(outcomes, dtype=np.uint64)
+    return (outcomes << np.uint64(64 - num_bits) if num_bits else outcomes * np.uint64(0))[:, np.newaxis]
+
+
+class ShotWriter:
+    """
+    Streams shots to a packed binary file with buffered bulk writes.
+
+    Shots are collected in a preallocated buffer of packed words and written as one block when it is full,
+    so the cost per shot is a few bytes of memory traffic and no Python objects.
+    """
+
+    def __init__(self, path, num_bits, buffer_shots=DEFAULT_BUFFER_SHOTS):
+        """
+        :param path: File to create; it is overwritten.
+        :param num_bits: Number of measurement results per shot.
+        :param buffer_shots: Number of shots collected before a block is written.
+        """
+        self.path = path
+        self.num_bits = num_bits
+        self.words = words_per_shot(num_bits)
+        self.shots = 0
+        self._buffer = np.empty((buffer_shots, self.words), dtype=np.uint64)
+        self._size = 0
+        self._file = open(path, 'wb')
+        self._file.write(_HEADER.pack(MAGIC, num_bits, 0))
+
+    def write_bits(self, bits):
+        """
+        Appends shots given as results, an array of shape (shots, num_bits).
+        """
+        self.write_packed(pack_bits(bits))
+
+    def write_outcomes(self, outcomes):
+        """
+        Appends shots given as outcome indices (see pack_outcomes()).
+        """
+        self.write_packed(pack_outcomes(outcomes, self.num_bits))
+
+    def write_packed(self, words):
+        """
+        Appends packed shots, a uint64 array of shape (shots, words).
+        """
+        capacity = len(self._buffer)
+        start = 0
+        while start < len(words):
+            take = min(capacity - self._size, len(words) - start)
+            self._buffer[self._size:self._size + take] = words[start:start + take]
+            self._size += take
+            start += take
+            if self._size == capacity:
+                self.flush()
+        self.shots += len(words)
+
+    def flush(self):
+        """
+        Writes the buffered shots as one block.
+        """
+        if self._size:
+            self._file.write(_COUNT.pack(self._size))
+            self._file.write(np.ascontiguousarray(self._buffer[:self._size].T).astype('<u8').tobytes())
+            self._size = 0
+        self._file.flush()
+
+    def close(self):
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_header(stream):
+    """
+    Reads the header of a shot file.
+
+    :return: Number of bits per shot.
+    """
+    magic, num_bits, _ = _HEADER.unpack(stream.read(_HEADER.size))
+    if magic != MAGIC:
+        raise ValueError("Not a shot file.")
+    return num_bits
+
+
+def read_shots(path, packed=False):
+    """
+    Reads a shot file back one block at a time; only one block is in memory at once.
+
+    :param path: Shot file written by a ShotWriter.
+    :param packed: If true, yield the packed uint64 words instead of the results.
+    :return: Generator of arrays of shape (shots, words) if packed, else uint8 arrays of shape (shots, num_bits).
+    """
+    with open(path, 'rb') as stream:
+        num_bits = read_header(stream)
+        words = words_per_shot(num_bits)
+        while True:
+            head = stream.read(_COUNT.size)
+            if not head:
+                return
+            count, = _COUNT.unpack(head)
+            block = np.fromfile(stream, dtype='<u8', count=count * words).reshape(words, count).T
+            yield block if packed else unpack_bits(block, num_bits)
+
+
+def count_shots(path):
+    """
+    Builds the histogram of a shot file, block by block.
+
+    :param path: Shot file.
+    :return: Dictionary mapping bitstring to count.
+    """
+    with open(path, 'rb') as stream:
+        num_bits = read_header(stream)
+    totals = {}
+    for block in read_shots(path, packed=True):
+        # Shots of one word are counted as plain integers; wider shots as raw bytes, which np.unique sorts quickly
+        keys = block[:, 0] if block.shape[1] == 1 else np.ascontiguousarray(block).view(f'V{8 * block.shape[1]}')[:, 0]
+        values, counts = np.unique(keys, return_counts=True)
+        for value, count in zip(values.tolist(), counts.tolist()):
+            totals[value] = totals.get(value, 0) + count
+    if not totals:
+        return {}
+    if isinstance(next(iter(totals)), int):
+        rows = np.array(list(totals), dtype=np.uint64)[:, np.newaxis]
+    else:
+        rows = np.frombuffer(b''.join(totals), dtype=np.uint64).reshape(len(totals), -1)
+    bits = unpack_bits(rows, num_bits) + ord('0')
+    return {row.tobytes().decode(): count for row, count in zip(bits, totals.values())}
+
+
+def write_samples(writer, probabilities, shots, rng=None, chunk_size=DEFAULT_BUFFER_SHOTS):
+    """
+    Draws shots from an outcome distribution and streams them to a ShotWriter in chunks.
+
+    :param writer: ShotWriter whose num_bits matches the distribution (len(probabilities) == 2**num_bits).
+    :param probabilities: Probability of every outcome index.
+    :param shots: Number of shots.
+    :param rng: Optional numpy.random.Generator.
+    :param chunk_size: Number of shots drawn at a time.
+    """
+    rng = rng or np.random.default_rng()
+    for start in range(0, shots, chunk_size):
+        writer.write_outcomes(rng.choice(len(probabilities), size=min(chunk_size, shots - start), p=probabilities))
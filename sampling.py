@@ -0,0 +1,157 @@
+import numpy as np
+
+from branching import needs_branching, simulate_branches
+from profiling import span
+from scheduler import simulate_layers
+from stabilizer import is_clifford, sample_measurements
+from statevector import DEFAULT_CHUNK_SIZE, simulate, split_terminal_measurements, zero_state
+
+# Simulators sample_counts() can use; 'auto' picks the stabilizer simulator for Clifford circuits
+BACKENDS = ('auto', 'statevector', 'stabilizer')
+
+
+def marginal_probabilities(state, qubits, num_qubits, chunk_size=None):
+    """
+    Computes the probability distribution of a subset of qubits of a statevector.
+
+    :param state: Statevector of length 2**num_qubits.
+    :param qubits: Qubits to keep, in the order they should appear in the outcome bitstrings.
+    :param num_qubits: Number of qubits of the state.
+    :param chunk_size: Optional maximum number of amplitudes read at a time, for memory-mapped states.
+    :return: Array of length 2**len(qubits); index i is the outcome whose binary digits give the qubits in order.
+    """
+    if chunk_size is None or state.size <= chunk_size:
+        probabilities = (np.abs(state) ** 2).reshape((2,) * num_qubits)
+        others = tuple(q for q in range(num_qubits) if q not in qubits)
+        # Sum in double precision, so complex64 states still give probabilities that add up to 1
+        marginal = probabilities.sum(axis=others, dtype=np.float64)
+    else:
+        # Contiguous chunks of 2**suffix amplitudes: the qubits before the suffix have fixed values in a chunk
+        suffix = min(num_qubits, chunk_size.bit_length() - 1)
+        first = num_qubits - suffix
+        marginal = np.zeros((2,) * len(qubits))
+        others = tuple(q - first for q in range(first, num_qubits) if q not in qubits)
+        for i, chunk in enumerate(state.reshape(-1, 2 ** suffix)):
+            partial = (np.abs(chunk) ** 2).reshape((2,) * suffix).sum(axis=others, dtype=np.float64)
+            marginal[tuple((i >> (first - 1 - q)) & 1 if q < first else slice(None) for q in sorted(qubits))] += partial
+    # The remaining axes are in increasing qubit order; put them in the requested order
+    order = sorted(qubits)
+    marginal = marginal.transpose([order.index(q) for q in qubits])
+    marginal = marginal.reshape(-1)
+    return marginal / marginal.sum()
+
+
+def measurement_distribution(gates, num_qubits, dtype=np.complex128, path=None, chunk_size=None):
+    """
+    Simulates a recorded circuit once and returns the distribution of its measurement outcomes.
+
+    Circuits with mid-circuit measurements or gates conditioned on measurement results are run on the branching
+    simulator; their outcomes have one bit per measurement, so a qubit measured twice appears twice.
+
+    :param gates: Recorded gates (for example RecordingKernel.gates).
+    :param num_qubits: Number of qubits to simulate.
+    :param dtype: Complex dtype of the amplitudes; np.complex64 halves the memory.
+    :param path: Optional file in which the statevector is kept as a numpy.memmap, for states larger than memory.
+    :param chunk_size: Optional maximum number of amplitudes processed at a time; defaults to
+        statevector.DEFAULT_CHUNK_SIZE when path is given.
+    :return: Tuple (probabilities, measured qubits). If the circuit has no measurements all qubits are measured.
+    """
+    with span('measurement_distribution', 'simulate', num_qubits=num_qubits, gates=len(gates)):
+        if needs_branching(gates):
+            branches = simulate_branches(gates, num_qubits, dtype=dtype)
+            return branches.outcome_distribution(), branches.measured
+        _, measured = split_terminal_measurements(gates)
+        if not measured:
+            measured = list(range(num_qubits))
+        if path is None and chunk_size is None:
+            # In memory the circuit is applied layer by layer, with the single-qubit gates of a layer combined
+            state = simulate_layers(gates, num_qubits, dtype)
+        else:
+            if path is not None and chunk_size is None:
+                chunk_size = DEFAULT_CHUNK_SIZE
+            state = simulate(gates, num_qubits, state=zero_state(num_qubits, dtype, path), chunk_size=chunk_size)
+        return marginal_probabilities(state, measured, num_qubits, chunk_size), measured
+
+
+def sample_shots(gates, num_qubits, shots, rng=None):
+    """
+    Draws many shots of a recorded circuit from a single simulation.
+
+    :param gates: Recorded gates.
+    :param num_qubits: Number of qubits to simulate.
+    :param shots: Number of shots.
+    :param rng: Optional numpy.random.Generator.
+    :return: Tuple (outcomes, measured qubits); outcomes is an int64 array with one outcome index per shot.
+    """
+    rng = rng or np.random.default_rng()
+    probabilities, measured = measurement_distribution(gates, num_qubits)
+    return rng.choice(len(probabilities), size=shots, p=probabilities), measured
+
+
+def counts_from_probabilities(probabilities, width, shots, rng=None):
+    """
+    Draws a histogram of shots from a probability vector in one vectorized call.
+
+    :param probabilities: Probability of every outcome index.
+    :param width: Number of bits in an outcome.
+    :param shots: Number of shots.
+    :param rng: Optional numpy.random.Generator.
+    :return: Dictionary mapping bitstring to count, for outcomes that occurred.
+    """
+    rng = rng or np.random.default_rng()
+    counts = rng.multinomial(shots, probabilities)
+    return {format(int(i), f'0{width}b'): int(counts[i]) for i in np.flatnonzero(counts)}
+
+
+def counts_from_bits(bits):
+    """
+    Builds a histogram from sampled measurement results.
+
+    :param bits: uint8 array of shape (shots, measurements).
+    :return: Dictionary mapping bitstring to count.
+    """
+    rows, counts = np.unique(bits, axis=0, return_counts=True)
+    return {(row + ord('0')).tobytes().decode(): int(count) for row, count in zip(rows, counts)}
+
+
+def select_backend(gates, backend='auto'):
+    """
+    Chooses the simulator for a recorded circuit.
+
+    :param gates: Recorded gates.
+    :param backend: One of BACKENDS.
+    :return: 'stabilizer' or 'statevector'.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend '{backend}', expected one of {BACKENDS}.")
+    if backend == 'auto':
+        return 'stabilizer' if is_clifford(gates) else 'statevector'
+    return backend
+
+
+def sample_counts(gates, num_qubits, shots, rng=None, backend='auto', dtype=np.complex128, path=None,
+                  chunk_size=None):
+    """
+    Runs many shots of a recorded circuit and returns the histogram of outcomes.
+
+    The circuit is simulated once; all shots are then drawn together. Circuits made only of Clifford gates,
+    measurements and resets run on the stabilizer simulator, whose cost grows polynomially with the number of
+    qubits; the others are simulated as a statevector.
+
+    :param gates: Recorded gates (for example RecordingKernel.gates).
+    :param num_qubits: Number of qubits to simulate.
+    :param shots: Number of shots.
+    :param rng: Optional numpy.random.Generator.
+    :param backend: One of BACKENDS.
+    :param dtype: Complex dtype of the statevector simulator.
+    :param path: Optional memory-mapped file for the statevector (see measurement_distribution()).
+    :param chunk_size: Optional maximum number of amplitudes the statevector simulator processes at a time.
+    :return: Dictionary mapping bitstring (measured qubits in measurement order) to count.
+    """
+    backend = select_backend(gates, backend)
+    with span('sample_counts', 'simulate', backend=backend, num_qubits=num_qubits, gates=len(gates), shots=shots):
+        if backend == 'stabilizer':
+            bits, _ = sample_measurements(gates, num_qubits, shots, rng)
+            return counts_from_bits(bits)
+        probabilities, measured = measurement_distribution(gates, num_qubits, dtype, path, chunk_size)
+        return counts_from_probabilities(probabilities, len(measured), shots, rng)
@@ -0,0 +1,176 @@
+import numpy as np
+
+from gates import single_qubit_matrix
+from optimizer import commutes
+from statevector import apply_gate, apply_matrix, split_terminal_measurements, zero_state
+
+# Scheduling policies: 'asap' starts every gate as early as possible, 'alap' as late as possible
+POLICIES = ('asap', 'alap')
+
+# Largest range of neighbouring qubits whose single-qubit gates apply_layer() combines into one matrix
+DEFAULT_MAX_BLOCK = 4
+
+
+def _asap_levels(gates):
+    """
+    Assigns every gate the earliest layer it can run in.
+
+    A gate must come after every earlier gate on a shared qubit that it does not commute with (see
+    optimizer.commutes()), a conditioned gate after the measurement that wrote its bit register and a
+    measurement after the conditioned gates that read the register it overwrites. Gates it commutes with may
+    end up in a later layer. A measurement is never put in an earlier layer than the measurement before it, so
+    the layers keep the order of the measurement results. Two gates in one layer never share a qubit, and a
+    'classical' operation gets a layer of its own that nothing is moved across.
+
+    :param gates: Recorded gates.
+    :return: List with the layer (starting at 1) of every gate.
+    """
+    levels = []
+    placed = {}  # Qubit -> list of (level, running maximum of the levels, gate) in circuit order
+    busy = {}  # Qubit -> set of occupied levels
+    written = {}  # Bit register -> level of the last measurement writing it
+    read = {}  # Bit register -> highest level of a gate conditioned on it
+    measured = 0  # Level of the last measurement
+    floor = 0  # Level of the last 'classical' operation
+    depth = 0
+    for gate in gates:
+        if not gate.qubits:
+            depth = floor = depth + 1
+            levels.append(depth)
+            continue
+        bound = floor
+        for qubit in gate.qubits:
+            entries = placed.get(qubit, ())
+            # Walk back while an earlier gate could still be above the bound
+            for i in range(len(entries) - 1, -1, -1):
+                level, highest, other = entries[i]
+                if highest <= bound:
+                    break
+                if level > bound and not commutes(other, gate):
+                    bound = level
+        for breg in gate.condition or ():
+            bound = max(bound, written.get(breg, 0))
+        if gate.name == 'measure':
+            # The same layer as the previous measurement is allowed, since a layer keeps the circuit order
+            bound = max(bound, read.get(gate.qubits[0], 0), measured - 1)
+        level = bound + 1
+        while any(level in busy.get(qubit, ()) for qubit in gate.qubits):
+            level += 1
+        for qubit in gate.qubits:
+            entries = placed.setdefault(qubit, [])
+            entries.append((level, max(level, entries[-1][1] if entries else 0), gate))
+            busy.setdefault(qubit, set()).add(level)
+        for breg in gate.condition or ():
+            read[breg] = max(read.get(breg, 0), level)
+        if gate.name == 'measure':
+            written[gate.qubits[0]] = level
+            measured = level
+        levels.append(level)
+        depth = max(depth, level)
+    return levels
+
+
+def schedule(gates, policy='asap'):
+    """
+    Groups a gate list into layers of gates on disjoint qubits that can run at the same time.
+
+    Running the layers one after the other (the gates of a layer in any order) gives the same circuit.
+
+    :param gates: Recorded gates.
+    :param policy: One of POLICIES.
+    :return: List of layers, each a list of gates in circuit order.
+    """
+    if policy not in POLICIES:
+        raise ValueError(f"Unknown scheduling policy '{policy}', expected one of {POLICIES}.")
+    gates = list(gates)
+    if policy == 'alap':
+        # As late as possible is as soon as possible on the reversed circuit, whose dependencies are the same
+        levels = _asap_levels(gates[::-1])[::-1]
+        depth = max(levels, default=0)
+        levels = [depth + 1 - level for level in levels]
+    else:
+        levels = _asap_levels(gates)
+    layers = [[] for _ in range(max(levels, default=0))]
+    for gate, level in zip(gates, levels):
+        layers[level - 1].append(gate)
+    return layers
+
+
+def depth(gates):
+    """
+    Number of layers of the as-soon-as-possible schedule of a gate list.
+    """
+    return max(_asap_levels(list(gates)), default=0)
+
+
+def scheduled_gates(gates, policy='asap'):
+    """
+    The gates in the order of their layers, for emitting an already scheduled kernel.
+    """
+    return [gate for layer in schedule(gates, policy) for gate in layer]
+
+
+def _kron(matrices):
+    result = np.ones((1, 1), dtype=complex)
+    for matrix in matrices:
+        result = np.kron(result, matrix)
+    return result
+
+
+def apply_layer(state, layer, num_qubits, max_block=DEFAULT_MAX_BLOCK, chunk_size=None):
+    """
+    Applies one layer of unitary gates to the state, in place.
+
+    The single-qubit gates of neighbouring qubits are combined into one matrix on a range of up to max_block
+    qubits (the Kronecker product of the gates, with identities for the qubits in between) and applied in a
+    single pass over the state, instead of one pass per gate. The other gates are applied one by one.
+
+    :param state: Contiguous statevector (or batch of statevectors).
+    :param layer: Gates on disjoint qubits, for example one layer of schedule().
+    :param num_qubits: Number of qubits of the state.
+    :param max_block: Largest number of qubits combined into one matrix.
+    :param chunk_size: Optional maximum number of amplitudes processed at a time; gates are then not combined,
+        so no temporary array as large as the state is needed.
+    :return: The updated state.
+    """
+    singles = {}
+    for gate in layer:
+        matrix = None if gate.condition or chunk_size is not None else single_qubit_matrix(gate)
+        if matrix is None:
+            apply_gate(state, gate, num_qubits, chunk_size)
+        else:
+            singles[gate.qubits[0]] = matrix
+    qubits = sorted(singles)
+    while qubits:
+        first = qubits[0]
+        block = [q for q in qubits if q < first + max_block]
+        qubits = qubits[len(block):]
+        if len(block) == 1:
+            apply_matrix(state, singles[first], first, num_qubits)
+            continue
+        last = block[-1]
+        matrix = _kron([singles.get(q, np.eye(2)) for q in range(first, last + 1)]).astype(state.dtype)
+        view = state.reshape(-1, 2 ** (last - first + 1), 2 ** (num_qubits - last - 1))
+        view[...] = np.matmul(matrix, view)
+    return state
+
+
+def simulate_layers(gates, num_qubits, dtype=np.complex128, state=None, max_block=DEFAULT_MAX_BLOCK,
+                    chunk_size=None):
+    """
+    Like statevector.simulate(), but applies the circuit one layer at a time with apply_layer().
+
+    :param gates: Recorded gates.
+    :param num_qubits: Number of qubits to simulate.
+    :param dtype: Complex dtype of the amplitudes.
+    :param state: Optional initial statevector, updated in place; defaults to |00...0>.
+    :param max_block: Largest number of qubits combined into one matrix.
+    :param chunk_size: Optional maximum number of amplitudes processed at a time.
+    :return: Final statevector before the terminal measurements.
+    """
+    unitary, _ = split_terminal_measurements(gates)
+    if state is None:
+        state = zero_state(num_qubits, dtype)
+    for layer in schedule(unitary):
+        apply_layer(state, layer, num_qubits, max_block, chunk_size)
+    return state
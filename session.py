@@ -0,0 +1,186 @@
+import argparse
+import json
+import os
+import socket
+import socketserver
+
+# Log level used when none is given; the KWANTY_LOG_LEVEL environment variable overrides it, for example
+# KWANTY_LOG_LEVEL=LOG_INFO to see the compiler's progress messages again
+DEFAULT_LOG_LEVEL = 'LOG_WARNING'
+
+DEFAULT_OUTPUT_DIR = 'output'
+
+# State of the OpenQL session of this process. This module imports openql only in initialize(), so a process that
+# only submits jobs to a worker (submit()) does not load it; modules that build kernels, such as recording, need
+# openql when they are imported
+_ql = None
+_options = {}
+_platforms = {}
+
+
+def set_option(name, value):
+    """
+    Sets an OpenQL option, skipping the call when it already has that value.
+    """
+    if _ql is None:
+        initialize()
+    if _options.get(name) != value:
+        _ql.set_option(name, value)
+        _options[name] = value
+
+
+def initialize(output_dir=DEFAULT_OUTPUT_DIR, log_level=None):
+    """
+    Initializes OpenQL once per process; later calls only change the options that differ.
+
+    :param output_dir: Directory for the compiled output.
+    :param log_level: OpenQL log level; defaults to $KWANTY_LOG_LEVEL or DEFAULT_LOG_LEVEL.
+    """
+    global _ql
+    if _ql is None:
+        import openql
+        openql.initialize()
+        _ql = openql
+    set_option('output_dir', output_dir)
+    set_option('log_level', log_level or os.environ.get('KWANTY_LOG_LEVEL', DEFAULT_LOG_LEVEL))
+
+
+def output_dir():
+    """
+    Output directory of the session.
+    """
+    if _ql is None:
+        initialize()
+    return _options['output_dir']
+
+
+def get_platform(name='my_platform', config='none'):
+    """
+    Returns the platform with the given name and configuration, creating it (and the session) on first use.
+
+    The example scripts all get their platform here, so OpenQL is initialized once per process. Unless
+    initialize() was called first, the session writes compiled files to DEFAULT_OUTPUT_DIR ('output') and only logs
+    warnings; set KWANTY_LOG_LEVEL=LOG_INFO to see the compiler's progress messages.
+
+    :param name: Platform name.
+    :param config: Platform configuration file, or 'none'.
+    :return: ql.Platform shared by all callers in this process.
+    """
+    if _ql is None:
+        initialize()
+    key = (name, config)
+    if key not in _platforms:
+        _platforms[key] = _ql.Platform(name, config)
+    return _platforms[key]
+
+
+def job_from_record(record):
+    """
+    Reads a job sent to the worker: a JSON object with the CircuitJob fields, gates given by gate_to_record().
+
+    Instead of 'gates' a job may give 'circuit_file', the path of a single-kernel file written by
+    circuit_format.save(); the worker then memory-maps the circuit instead of receiving it over the socket.
+
+    :param record: Decoded JSON object.
+    :return: parallel.CircuitJob.
+    :raises ValueError: If the record has neither gates nor a circuit file, or its name is not a plain file name.
+    """
+    from gates import gate_from_record
+    from parallel import CircuitJob, validate_job_name
+
+    if not isinstance(record, dict) or ('gates' not in record and 'circuit_file' not in record):
+        raise ValueError("A job must be a JSON object with 'gates' or 'circuit_file'.")
+    if 'gates' in record and 'name' not in record:
+        raise ValueError("A job with 'gates' needs a 'name'.")
+    name = record.get('name')
+    num_qubits = record.get('num_qubits')
+    num_cregs = record.get('num_cregs', 0)
+    if 'circuit_file' in record:
+        import circuit_format
+
+        loaded = circuit_format.load(record['circuit_file'])
+        if len(loaded.kernels) != 1:
+            raise ValueError(f"{record['circuit_file']} has {len(loaded.kernels)} kernels, a job runs one.")
+        gates = loaded.kernels[0].gates
+        name = name or loaded.program_name
+        num_qubits = num_qubits or loaded.kernels[0].num_qubits
+        num_cregs = num_cregs or loaded.num_cregs
+    else:
+        name = record['name']
+        gates = [gate_from_record(gate) for gate in record['gates']]
+    validate_job_name(name)
+    num_qubits = num_qubits or max((q for gate in gates for q in gate.qubits), default=-1) + 1
+    return CircuitJob(name, num_qubits, gates, record.get('shots', 1000), record.get('compile', True), num_cregs)
+
+
+class _JobHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        from parallel import run_job
+
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                result = run_job(job_from_record(record))
+            except Exception as error:  # Report the failure to the client and keep serving
+                result = {'error': f'{type(error).__name__}: {error}'}
+            self.wfile.write((json.dumps(result) + '\n').encode())
+            self.wfile.flush()
+
+
+def serve(path, output_dir=DEFAULT_OUTPUT_DIR, log_level=None):
+    """
+    Runs a long-lived worker that accepts circuit jobs on a Unix socket.
+
+    OpenQL and the platform are initialized once, before the first connection. Every line a client sends is one
+    job (see job_from_record()) and is answered by one JSON line with the result of parallel.run_job(). Jobs are
+    run one at a time because OpenQL options are global to the process.
+
+    :param path: File name of the socket; an existing socket file is replaced.
+    :param output_dir: Directory for the compiled output.
+    :param log_level: OpenQL log level.
+    """
+    initialize(output_dir, log_level)
+    get_platform()
+    if os.path.exists(path):
+        os.unlink(path)
+    with socketserver.UnixStreamServer(path, _JobHandler) as server:
+        try:
+            server.serve_forever()
+        finally:
+            os.unlink(path)
+
+
+def submit(path, records):
+    """
+    Sends jobs to a worker started with serve() and yields its answers in order.
+
+    :param path: Socket file of the worker.
+    :param records: Iterable of job objects (see job_from_record()).
+    :return: Generator of result dictionaries.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(path)
+        stream = connection.makefile('rw')
+        for record in records:
+            stream.write(json.dumps(record) + '\n')
+            stream.flush()
+            yield json.loads(stream.readline())
+
+
+if __name__ == '__main__':
+    from batch_input import read_records, write_record
+
+    parser = argparse.ArgumentParser(description='Long-lived OpenQL worker that runs circuit jobs sent over a socket.')
+    parser.add_argument('socket', help='socket file to listen on, or to send to with --submit')
+    parser.add_argument('--submit', metavar='JOBS', help="send the jobs of a JSONL file ('-' for stdin) to a worker")
+    parser.add_argument('--output-dir', default=DEFAULT_OUTPUT_DIR, help='directory for the compiled output')
+    parser.add_argument('--log-level', help=f'OpenQL log level (default {DEFAULT_LOG_LEVEL})')
+    args = parser.parse_args()
+
+    if args.submit:
+        for result in submit(args.socket, read_records(args.submit, 'jsonl')):
+            write_record(result)
+    else:
+        serve(args.socket, args.output_dir, args.log_level)
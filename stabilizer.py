@@ -0,0 +1,250 @@
+import numpy as np
+
+from gates import Gate
+from statevector import split_terminal_measurements
+
+# Gates the tableau simulator supports; all of them map Pauli operators to Pauli operators
+CLIFFORD_GATES = ('i', 'h', 'x', 'y', 'z', 's', 'sdag', 'cnot', 'cz', 'swap')
+
+# Gates that may be conditioned on a measurement result; they only change the signs of the tableau
+PAULI_GATES = ('i', 'x', 'y', 'z')
+
+
+def is_clifford(gates):
+    """
+    Tells whether a recorded circuit can be run on the stabilizer simulator.
+
+    :param gates: Recorded gates.
+    :return: True if every gate is a Clifford gate, measure or prepz, and every conditioned gate is a Pauli
+        gate conditioned on a single bit register.
+    """
+    for gate in gates:
+        if gate.name not in CLIFFORD_GATES and gate.name not in ('measure', 'prepz'):
+            return False
+        if gate.condition and (gate.name not in PAULI_GATES or len(gate.condition) != 1):
+            return False
+    return True
+
+
+class StabilizerTableau:
+    """
+    Aaronson-Gottesman stabilizer tableau with symbolic measurement results.
+
+    Rows 0..n-1 are the destabilizers, rows n..2n-1 the stabilizers and row 2n is scratch space. Each row is a
+    Pauli operator given by its x and z bits and its sign. The sign is not stored as a bit but as an affine
+    function of the random measurement results: column 0 of self.signs is the constant term and column k the
+    coefficient of the k-th random result. Every Clifford gate keeps signs affine, so a single pass over the
+    circuit describes the results of all shots, which are then drawn at once by sample().
+    """
+
+    def __init__(self, num_qubits, max_random=None):
+        """
+        :param num_qubits: Number of qubits; the state starts as |00...0>.
+        :param max_random: Maximum number of random measurement results; defaults to num_qubits.
+        """
+        n = num_qubits
+        self.num_qubits = n
+        self.x = np.zeros((2 * n + 1, n), dtype=bool)
+        self.z = np.zeros((2 * n + 1, n), dtype=bool)
+        self.x[np.arange(n), np.arange(n)] = True
+        self.z[np.arange(n, 2 * n), np.arange(n)] = True
+        self.signs = np.zeros((2 * n + 1, 1 + (num_qubits if max_random is None else max_random)), dtype=bool)
+        self.num_random = 0
+
+    def _flip(self, rows, value=None):
+        # Adds value (an affine function, or the constant 1 when None) to the signs of the selected rows
+        if value is None:
+            self.signs[rows, 0] ^= True
+        else:
+            self.signs[rows] ^= value
+
+    def h(self, qubit):
+        self._flip(self.x[:, qubit] & self.z[:, qubit])
+        self.x[:, qubit], self.z[:, qubit] = self.z[:, qubit].copy(), self.x[:, qubit].copy()
+
+    def s(self, qubit):
+        self._flip(self.x[:, qubit] & self.z[:, qubit])
+        self.z[:, qubit] ^= self.x[:, qubit]
+
+    def sdag(self, qubit):
+        self._flip(self.x[:, qubit] & ~self.z[:, qubit])
+        self.z[:, qubit] ^= self.x[:, qubit]
+
+    def pauli(self, name, qubit, value=None):
+        """
+        Applies x, y or z, optionally only when the affine function value is 1.
+        """
+        if name == 'x':
+            self._flip(self.z[:, qubit], value)
+        elif name == 'z':
+            self._flip(self.x[:, qubit], value)
+        elif name == 'y':
+            self._flip(self.x[:, qubit] ^ self.z[:, qubit], value)
+
+    def cnot(self, control, target):
+        x, z = self.x, self.z
+        self._flip(x[:, control] & z[:, target] & ~(x[:, target] ^ z[:, control]))
+        x[:, target] ^= x[:, control]
+        z[:, control] ^= z[:, target]
+
+    def cz(self, qubit_a, qubit_b):
+        self.h(qubit_b)
+        self.cnot(qubit_a, qubit_b)
+        self.h(qubit_b)
+
+    def swap(self, qubit_a, qubit_b):
+        self.cnot(qubit_a, qubit_b)
+        self.cnot(qubit_b, qubit_a)
+        self.cnot(qubit_a, qubit_b)
+
+    def _rowsum(self, rows, source):
+        """
+        Multiplies the Pauli operators of the given rows by the operator of the source row.
+        """
+        x1, z1 = self.x[source], self.z[source]
+        x2, z2 = self.x[rows].astype(np.int64), self.z[rows].astype(np.int64)
+        # Exponent of i picked up by multiplying the single-qubit Paulis (Aaronson-Gottesman function g)
+        g = np.where(x1 & z1, z2 - x2, np.where(x1, z2 * (2 * x2 - 1), np.where(z1, x2 * (1 - 2 * z2), 0)))
+        phase = g.sum(axis=1) % 4 == 2
+        signs = self.signs[rows] ^ self.signs[source]
+        signs[:, 0] ^= phase
+        self.signs[rows] = signs
+        self.x[rows] ^= x1
+        self.z[rows] ^= z1
+
+    def measure(self, qubit):
+        """
+        Measures a qubit in the computational basis.
+
+        :return: The result as an affine function of the random results (a boolean vector like a sign).
+        """
+        n = self.num_qubits
+        anticommuting = np.flatnonzero(self.x[n:2 * n, qubit])
+        if len(anticommuting):
+            # The result is random: it becomes a new random variable
+            p = n + anticommuting[0]
+            rows = np.flatnonzero(self.x[:2 * n, qubit])
+            rows = rows[rows != p]
+            if len(rows):
+                self._rowsum(rows, p)
+            self.x[p - n], self.z[p - n], self.signs[p - n] = self.x[p], self.z[p], self.signs[p]
+            self.x[p] = False
+            self.z[p] = False
+            self.z[p, qubit] = True
+            self.num_random += 1
+            self.signs[p] = False
+            self.signs[p, self.num_random] = True
+            return self.signs[p].copy()
+        # The result is determined by the stabilizers: collect it in the scratch row
+        scratch = 2 * n
+        self.x[scratch] = False
+        self.z[scratch] = False
+        self.signs[scratch] = False
+        for i in np.flatnonzero(self.x[:n, qubit]):
+            self._rowsum([scratch], i + n)
+        return self.signs[scratch].copy()
+
+    def reset(self, qubit):
+        """
+        Returns a qubit to |0>: a measurement followed by an x applied when the result was 1.
+        """
+        self.pauli('x', qubit, self.measure(qubit))
+
+
+class StabilizerSimulator:
+    """
+    Runs a Clifford circuit with measurements, resets and Pauli corrections on a StabilizerTableau.
+
+    The cost per gate is O(num_qubits) and per measurement O(num_qubits**2), independent of the number of shots,
+    so circuits with hundreds of qubits can be sampled.
+    """
+
+    def __init__(self, num_qubits, max_random=None):
+        """
+        :param num_qubits: Number of qubits.
+        :param max_random: Maximum number of random measurement results (at most one per measure or prepz).
+        """
+        self.tableau = StabilizerTableau(num_qubits, max_random)
+        self.num_qubits = num_qubits
+        self.results = []  # Affine function of every measurement result, in order
+        self.measured = []  # Qubit of every measurement
+        self._bregs = {}  # Bit register -> index of the measurement that last wrote it
+
+    def run(self, gates):
+        """
+        Applies a list of recorded gates.
+
+        :return: self.
+        """
+        for gate in gates:
+            self.apply(gate)
+        return self
+
+    def apply(self, gate):
+        """
+        Applies one recorded gate, measurement or reset.
+        """
+        tableau = self.tableau
+        qubits = gate.qubits
+        if gate.name == 'measure':
+            self._bregs[qubits[0]] = len(self.results)
+            self.results.append(tableau.measure(qubits[0]))
+            self.measured.append(qubits[0])
+        elif gate.name == 'prepz':
+            tableau.reset(qubits[0])
+        elif gate.condition:
+            if gate.name not in PAULI_GATES or len(gate.condition) != 1:
+                raise ValueError(f"Conditioned gate '{gate.name}' cannot be simulated on a stabilizer tableau.")
+            # A register that was never written holds 0
+            if gate.condition[0] in self._bregs:
+                tableau.pauli(gate.name, qubits[0], self.results[self._bregs[gate.condition[0]]])
+        elif gate.name in PAULI_GATES:
+            tableau.pauli(gate.name, qubits[0])
+        elif gate.name in ('h', 's', 'sdag'):
+            getattr(tableau, gate.name)(qubits[0])
+        elif gate.name in ('cnot', 'cz', 'swap'):
+            getattr(tableau, gate.name)(*qubits)
+        else:
+            raise ValueError(f"Gate '{gate.name}' cannot be simulated on a stabilizer tableau.")
+
+    def sample(self, shots, rng=None):
+        """
+        Draws the results of all measurements for many shots at once.
+
+        :param shots: Number of shots.
+        :param rng: Optional numpy.random.Generator.
+        :return: uint8 array of shape (shots, measurements).
+        """
+        rng = rng or np.random.default_rng()
+        if not self.results:
+            return np.zeros((shots, 0), dtype=np.uint8)
+        functions = np.array(self.results, dtype=np.int64)[:, :1 + self.tableau.num_random]
+        random = rng.integers(0, 2, size=(shots, self.tableau.num_random), dtype=np.int64)
+        return ((functions[:, 0] + random @ functions[:, 1:].T) & 1).astype(np.uint8)
+
+
+def sample_measurements(gates, num_qubits, shots, rng=None):
+    """
+    Samples a Clifford circuit on the stabilizer simulator.
+
+    Measurements are reported like the statevector simulators do: without mid-circuit measurements every qubit
+    is reported once in the order it was first measured (all qubits if nothing is measured); otherwise there is
+    one result per measurement.
+
+    :param gates: Recorded gates; is_clifford(gates) must be true.
+    :param num_qubits: Number of qubits.
+    :param shots: Number of shots.
+    :param rng: Optional numpy.random.Generator.
+    :return: Tuple (uint8 array of shape (shots, len(measured)), measured qubits).
+    """
+    try:
+        _, terminal = split_terminal_measurements(gates)
+    except ValueError:
+        terminal = None
+    if terminal is not None:
+        # Measuring a qubit again without touching it repeats the result, so keep the first measurement only
+        gates = [gate for gate in gates if gate.name != 'measure']
+        gates += [Gate('measure', (qubit,)) for qubit in terminal or range(num_qubits)]
+    resets = sum(gate.name in ('measure', 'prepz') for gate in gates)
+    simulator = StabilizerSimulator(num_qubits, resets).run(gates)
+    return simulator.sample(shots, rng), simulator.measured
@@ -0,0 +1,312 @@
+import numpy as np
+
+from gates import SINGLE_QUBIT_GATES, single_qubit_matrix
+
+# Conventions used by every simulator in this repository:
+# - a state of n qubits is a complex array of length 2**n, optionally with leading batch axes (..., 2**n)
+# - qubit 0 is the most significant bit of the basis index, so the index written in binary with n digits
+#   reads qubit 0, qubit 1, ..., qubit n-1 from left to right (the same order as the bit lists printed by the scripts)
+# - a state that does not fit in memory can live in a numpy.memmap file (zero_state(path=...)); gates are then
+#   applied in chunks of at most chunk_size amplitudes so that no temporary array is as large as the state
+
+# Chunk size used for memory-mapped states when none is given: 2**20 amplitudes (16 MiB of complex128)
+DEFAULT_CHUNK_SIZE = 1 << 20
+
+
+def zero_state(num_qubits, dtype=np.complex128, path=None):
+    """
+    Creates the |00...0> state.
+
+    :param num_qubits: Number of qubits.
+    :param dtype: Complex dtype of the amplitudes; np.complex64 halves the memory of np.complex128.
+    :param path: Optional file in which the amplitudes are stored as a numpy.memmap; it is overwritten.
+    :return: Statevector of length 2**num_qubits.
+    """
+    if path is None:
+        state = np.zeros(2 ** num_qubits, dtype=dtype)
+    else:
+        # A new memmap file reads as zeros, and the file system only allocates the pages that get written
+        state = np.memmap(path, dtype=dtype, mode='w+', shape=(2 ** num_qubits,))
+    state[0] = 1
+    return state
+
+
+def _split(state, qubits, num_qubits):
+    """
+    Returns a view of the state in which each of the given qubits has its own axis of length 2.
+
+    The view has shape (batch, 2**q0, 2, 2**(q1-q0-1), 2, ..., rest) for the sorted qubits q0 < q1 < ...,
+    so the axis of the j-th sorted qubit is 2*j + 2. Only a handful of axes are created, independent of num_qubits.
+
+    :param state: Contiguous statevector (or batch of statevectors).
+    :param qubits: Qubits that need their own axis.
+    :param num_qubits: Number of qubits of the state.
+    :return: Tuple (view, axes) where axes maps each qubit to its axis in the view.
+    """
+    shape = [-1]
+    axes = {}
+    previous = -1
+    for j, qubit in enumerate(sorted(qubits)):
+        shape += [2 ** (qubit - previous - 1), 2]
+        axes[qubit] = 2 * j + 2
+        previous = qubit
+    shape.append(2 ** (num_qubits - previous - 1))
+    if not state.flags.c_contiguous:
+        raise ValueError("The statevector must be contiguous to be updated in place.")
+    return state.reshape(shape), axes
+
+
+def _blocks(view, chunk_size):
+    """
+    Cuts a split view into blocks of about chunk_size amplitudes or fewer.
+
+    Blocks are taken along axis 1 (the qubits before the first gate qubit), where each block is one contiguous
+    range of memory; only if a single index of that axis is still too large is the last axis cut as well.
+
+    :param view: View returned by _split.
+    :param chunk_size: Maximum block size, or None for a single block.
+    :return: Generator of views.
+    """
+    if chunk_size is None or view.size <= chunk_size:
+        yield view
+        return
+    outer = view.shape[1]
+    per_outer = view.size // outer
+    if per_outer <= chunk_size:
+        step = chunk_size // per_outer
+        for start in range(0, outer, step):
+            yield view[:, start:start + step]
+        return
+    last = view.shape[-1]
+    step = max(1, chunk_size // (per_outer // last))
+    for i in range(outer):
+        for start in range(0, last, step):
+            yield view[:, i:i + 1, ..., start:start + step]
+
+
+def _index(ndim, fixed):
+    """
+    Builds an index tuple selecting one value on some axes and everything on the others.
+
+    :param ndim: Number of axes of the indexed array.
+    :param fixed: Dictionary mapping axis to the value (0 or 1) selected on it.
+    :return: Index tuple that keeps all axes (so the result is always a view).
+    """
+    index = [slice(None)] * ndim
+    for axis, value in fixed.items():
+        index[axis] = slice(value, value + 1)
+    return tuple(index)
+
+
+def _apply_on_axis(view, matrix, axis, fixed=None):
+    """
+    Applies a 2x2 matrix in place along one axis of a split view.
+
+    :param view: View returned by _split.
+    :param matrix: 2x2 matrix.
+    :param axis: Axis of the target qubit.
+    :param fixed: Optional dictionary of control axes that must be 1 for the matrix to act.
+    """
+    fixed = dict(fixed or {})
+    a0 = view[_index(view.ndim, {**fixed, axis: 0})]
+    a1 = view[_index(view.ndim, {**fixed, axis: 1})]
+    m00, m01, m10, m11 = matrix[0, 0], matrix[0, 1], matrix[1, 0], matrix[1, 1]
+    if m01 == 0 and m10 == 0:
+        # Diagonal gates (z, s, t, rz, ...) only rescale the amplitudes
+        if m00 != 1:
+            a0 *= m00
+        if m11 != 1:
+            a1 *= m11
+    elif m00 == 0 and m11 == 0:
+        # Anti-diagonal gates (x, y) swap the two halves
+        old = a0.copy()
+        a0[...] = a1
+        if m01 != 1:
+            a0 *= m01
+        a1[...] = old
+        if m10 != 1:
+            a1 *= m10
+    else:
+        old = a0.copy()
+        a0 *= m00
+        a0 += m01 * a1
+        a1 *= m11
+        a1 += m10 * old
+
+
+def apply_matrix(state, matrix, qubit, num_qubits, chunk_size=None):
+    """
+    Applies a single-qubit matrix to one qubit of the state, in place.
+
+    :param state: Statevector (or batch of statevectors) of shape (..., 2**num_qubits).
+    :param matrix: 2x2 matrix; it does not need to be unitary.
+    :param qubit: Qubit the matrix acts on.
+    :param num_qubits: Number of qubits of the state.
+    :param chunk_size: Optional maximum number of amplitudes processed at a time.
+    :return: The updated state.
+    """
+    view, axes = _split(state, [qubit], num_qubits)
+    for block in _blocks(view, chunk_size):
+        _apply_on_axis(block, matrix, axes[qubit])
+    return state
+
+
+def apply_controlled(state, matrix, controls, target, num_qubits, chunk_size=None):
+    """
+    Applies a single-qubit matrix to the target qubit on the part of the state where all controls are |1>.
+
+    :param state: Statevector (or batch of statevectors).
+    :param matrix: 2x2 matrix applied to the target.
+    :param controls: Control qubits.
+    :param target: Target qubit.
+    :param num_qubits: Number of qubits of the state.
+    :param chunk_size: Optional maximum number of amplitudes processed at a time.
+    :return: The updated state.
+    """
+    view, axes = _split(state, list(controls) + [target], num_qubits)
+    for block in _blocks(view, chunk_size):
+        _apply_on_axis(block, matrix, axes[target], {axes[c]: 1 for c in controls})
+    return state
+
+
+def apply_phase_flip(state, qubits, num_qubits, chunk_size=None):
+    """
+    Multiplies by -1 every amplitude in which all the given qubits are |1> (z, cz or mcz).
+
+    :param state: Statevector (or batch of statevectors).
+    :param qubits: Qubits that must all be |1>.
+    :param num_qubits: Number of qubits of the state.
+    :param chunk_size: Optional maximum number of amplitudes processed at a time.
+    :return: The updated state.
+    """
+    if len(qubits) <= 3:
+        view, axes = _split(state, qubits, num_qubits)
+        for block in _blocks(view, chunk_size):
+            block[_index(block.ndim, {axes[q]: 1 for q in qubits})] *= -1
+        return state
+    if chunk_size is not None and state.size > chunk_size:
+        # Cut the state into contiguous chunks of 2**suffix amplitudes; the qubits before the suffix are fixed
+        # within a chunk, so only chunks in which they are all |1> change, on the remaining (suffix) qubits
+        suffix = min(num_qubits, chunk_size.bit_length() - 1)
+        prefix = [q for q in qubits if q < num_qubits - suffix]
+        rest = [q - (num_qubits - suffix) for q in qubits if q >= num_qubits - suffix]
+        chunks = state.reshape(-1, 2 ** suffix)
+        for i in range(len(chunks)):
+            # Rows of a batch of states repeat the same sequence of prefixes
+            if all((i >> (num_qubits - suffix - 1 - q)) & 1 for q in prefix):
+                apply_phase_flip(chunks[i], rest, suffix)
+        return state
+    # With many qubits only 2**(num_qubits - len(qubits)) amplitudes change; list their indices directly
+    indices = np.array([sum(1 << (num_qubits - 1 - q) for q in qubits)], dtype=np.int64)
+    for qubit in range(num_qubits):
+        if qubit not in qubits:
+            indices = np.concatenate([indices, indices | (1 << (num_qubits - 1 - qubit))])
+    state[..., indices] *= -1
+    return state
+
+
+def apply_swap(state, qubit_a, qubit_b, num_qubits, chunk_size=None):
+    """
+    Exchanges two qubits of the state, in place.
+
+    :param state: Statevector (or batch of statevectors).
+    :param qubit_a: First qubit.
+    :param qubit_b: Second qubit.
+    :param num_qubits: Number of qubits of the state.
+    :param chunk_size: Optional maximum number of amplitudes processed at a time.
+    :return: The updated state.
+    """
+    view, axes = _split(state, [qubit_a, qubit_b], num_qubits)
+    for block in _blocks(view, chunk_size):
+        a01 = block[_index(block.ndim, {axes[qubit_a]: 0, axes[qubit_b]: 1})]
+        a10 = block[_index(block.ndim, {axes[qubit_a]: 1, axes[qubit_b]: 0})]
+        old = a01.copy()
+        a01[...] = a10
+        a10[...] = old
+    return state
+
+
+def apply_gate(state, gate, num_qubits, chunk_size=None):
+    """
+    Applies one recorded unitary gate to the state, in place.
+
+    :param state: Statevector (or batch of statevectors) of shape (..., 2**num_qubits).
+    :param gate: Gate to apply.
+    :param num_qubits: Number of qubits of the state.
+    :param chunk_size: Optional maximum number of amplitudes processed at a time, for states too large to copy.
+    :return: The updated state.
+    """
+    if gate.condition:
+        raise ValueError(f"Gate '{gate.name}' depends on measurement results and needs the branching simulator.")
+    matrix = single_qubit_matrix(gate)
+    if matrix is not None:
+        return apply_matrix(state, matrix, gate.qubits[0], num_qubits, chunk_size)
+    if gate.name == 'cnot':
+        return apply_controlled(state, SINGLE_QUBIT_GATES['x'], gate.qubits[:1], gate.qubits[1], num_qubits, chunk_size)
+    if gate.name == 'toffoli':
+        return apply_controlled(state, SINGLE_QUBIT_GATES['x'], gate.qubits[:2], gate.qubits[2], num_qubits, chunk_size)
+    if gate.name in ('cz', 'mcz'):
+        return apply_phase_flip(state, gate.qubits, num_qubits, chunk_size)
+    if gate.name == 'swap':
+        return apply_swap(state, gate.qubits[0], gate.qubits[1], num_qubits, chunk_size)
+    raise ValueError(f"Gate '{gate.name}' cannot be simulated on a statevector.")
+
+
+def split_terminal_measurements(gates):
+    """
+    Separates a gate list into its unitary part and the measurements at the end of the circuit.
+
+    Leading prepz operations on qubits that have not been used yet are dropped, since every qubit
+    already starts in |0>. A measurement is terminal when no later gate other than another measurement
+    touches the measured qubit.
+
+    :param gates: Recorded gates.
+    :return: Tuple (unitary gates, measured qubits in the order they were first measured).
+    :raises ValueError: If the circuit measures or resets a qubit in the middle of the computation, or
+        contains gates conditioned on measurement results.
+    """
+    unitary = []
+    measured = []
+    touched = set()
+    for gate in gates:
+        if gate.name == 'measure':
+            if gate.qubits[0] not in measured:
+                measured.append(gate.qubits[0])
+            continue
+        if gate.name == 'prepz':
+            if gate.qubits[0] in touched or gate.qubits[0] in measured:
+                raise ValueError(f"prepz on qubit {gate.qubits[0]} after it was used is not supported.")
+            continue
+        if gate.condition:
+            raise ValueError(f"Gate '{gate.name}' is conditioned on measurement results; "
+                             f"mid-circuit measurement is not supported.")
+        for qubit in gate.qubits:
+            if qubit in measured:
+                raise ValueError(f"Gate '{gate.name}' acts on qubit {qubit} after it was measured; "
+                                 f"mid-circuit measurement is not supported.")
+        touched.update(gate.qubits)
+        unitary.append(gate)
+    return unitary, measured
+
+
+def simulate(gates, num_qubits, dtype=np.complex128, state=None, chunk_size=None):
+    """
+    Simulates a recorded gate list and returns the statevector just before the final measurements.
+
+    :param gates: Recorded gates (for example RecordingKernel.gates).
+    :param num_qubits: Number of qubits to simulate.
+    :param dtype: Complex dtype of the amplitudes.
+    :param state: Optional initial statevector, updated in place; defaults to |00...0>. It may be a memory-mapped
+        state from zero_state(path=...).
+    :param chunk_size: Optional maximum number of amplitudes processed at a time; defaults to DEFAULT_CHUNK_SIZE
+        for memory-mapped states.
+    :return: Final statevector of length 2**num_qubits.
+    """
+    unitary, _ = split_terminal_measurements(gates)
+    if state is None:
+        state = zero_state(num_qubits, dtype)
+    if chunk_size is None and isinstance(state, np.memmap):
+        chunk_size = DEFAULT_CHUNK_SIZE
+    for gate in unitary:
+        apply_gate(state, gate, num_qubits, chunk_size)
+    return state